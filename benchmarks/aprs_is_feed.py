@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Replay an APRS-IS feed from a local fake server and measure how fast
+AprsIsClient turns it into frames. If aprslib is installed, the old
+aprslib consumer + Frame.from_aprs path is measured too (aprslib drops
+the packets it cannot parse, so it counts fewer frames).
+
+    python3 benchmarks/aprs_is_feed.py [-n LINES] [--capture FILE]
+
+A capture is a file with one raw APRS-IS line per line, as saved from a
+full feed connection (port 10152); without one a synthetic mix of
+positions, messages, telemetry and keepalives is used.
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ioreth.aprs_is_client import AprsIsClient
+from ioreth.ax25 import Frame
+from ioreth.reactor import Reactor
+
+
+SAMPLE = [
+    b"PP5ITT-7>APDR15,PP5JRS-15*,WIDE2-2,qAR,PU5BRA-10:=2628.97S/04906.81Wx Ittner",
+    b"DU2XXR-10>APRS,TCPIP*,qAC,T2PHIL:!1613.22N/12058.70E#PHG5130 iGate",
+    b"N0CALL-9>T4SQ0Y,WIDE1-1,WIDE2-1,qAR,K0ABC:`p4Hl!7>/]\"4W}=",
+    b"DU1ABC>APRS,TCPIP*,qAC,T2SYDNEY::APRSPH   :CQ hotg good morning{12",
+    b"# aprsc 2.1.14-g5e22b37 18 Oct 2026 10:00:00 GMT T2TEST 127.0.0.1:14580",
+    b"W1AW-13>APN391,WIDE2-1,qAR,W1XYZ-1:T#123,045,100,000,000,000,00000000",
+    b"KD9ABC-5>APDR16,TCPIP*,qAC,T2USANE:=4130.12N/08741.23W[/A=000600",
+    b"VK2XYZ>APX219,TCPIP*,qAC,T2AUSTRAL:>Monitoring 145.175",
+]
+
+
+def load_lines(args):
+    if args.capture:
+        with open(args.capture, 'rb') as f:
+            lines = [l.rstrip(b"\r\n") for l in f if l.strip()]
+    else:
+        lines = SAMPLE
+    out = (lines * (args.lines // len(lines) + 1))[:args.lines]
+    return b"".join(l + b"\r\n" for l in out), len(out)
+
+
+def fake_server(srv, feed):
+    """Accept one client, answer its login and replay the feed."""
+    conn, _ = srv.accept()
+    conn.sendall(b"# aprsc 2.1.14 fake feed\r\n")
+    login = b""
+    while b"\n" not in login:
+        login += conn.recv(512)
+    call = login.split()[1]
+    conn.sendall(b"# logresp " + call + b" unverified, server T2TEST\r\n")
+    conn.sendall(feed)
+    conn.close()
+
+
+class CountingClient(AprsIsClient):
+
+    def __init__(self, addr, port):
+        AprsIsClient.__init__(self, addr, port)
+        self.count = 0
+
+    def on_recv_frame(self, frame):
+        self.count += 1
+
+    def on_disconnect(self):
+        self.reactor.stop()
+
+
+def run_native(feed):
+    srv = socket.create_server(('127.0.0.1', 0))
+    port = srv.getsockname()[1]
+    thr = threading.Thread(target=fake_server, args=(srv, feed))
+    thr.start()
+
+    client = CountingClient('127.0.0.1', port)
+    client.setCallsign('N0CALL')
+    client.setReactor(Reactor())
+    start = time.perf_counter()
+    client.connect()
+    client.reactor.run_forever()
+    elapsed = time.perf_counter() - start
+    thr.join()
+    srv.close()
+    return client.count, elapsed
+
+
+def run_aprslib(feed):
+    import aprslib
+
+    srv = socket.create_server(('127.0.0.1', 0))
+    port = srv.getsockname()[1]
+    thr = threading.Thread(target=fake_server, args=(srv, feed))
+    thr.start()
+
+    count = 0
+
+    def on_packet(packet):
+        nonlocal count
+        Frame.from_aprs(packet['raw'].encode('ASCII'))
+        count += 1
+
+    conn = aprslib.IS('N0CALL', host='127.0.0.1', port=port)
+    start = time.perf_counter()
+    conn.connect()
+    try:
+        conn.consumer(on_packet, blocking=True)
+    except (aprslib.ConnectionDrop, ConnectionError, OSError):
+        pass
+    elapsed = time.perf_counter() - start
+    conn.close()
+    thr.join()
+    srv.close()
+    return count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', '--lines', type=int, default=200000)
+    parser.add_argument('--capture', help='file with raw APRS-IS lines')
+    args = parser.parse_args()
+
+    # aprslib logs every packet it fails to parse.
+    logging.disable(logging.CRITICAL)
+
+    feed, nlines = load_lines(args)
+    print(f"{nlines} lines, {len(feed)} bytes")
+    runs = [('native', run_native)]
+    try:
+        import aprslib  # noqa: F401
+        runs.append(('aprslib', run_aprslib))
+    except ImportError:
+        print("aprslib not installed, skipping comparison")
+    for name, func in runs:
+        count, elapsed = func(feed)
+        print(f"{name:>8}: {count} frames in {elapsed:.3f}s "
+              f"({count / elapsed:,.0f} frames/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Measure memory and allocations per decoded frame.
+
+Decodes a stream of KISS frames from a few hundred distinct stations
+using the usual path aliases, keeping all frames alive, and reports the
+retained memory, retained allocations and decode time per frame. Frames
+are lazy, so by default only the screening done for every packet (the
+data type) is paid for; --materialize also decodes addresses and info.
+
+The same frames are also decoded as ioreth used to, eagerly and with a
+new Address object for every address, for comparison.
+
+    python3 benchmarks/frame_memory.py [-n FRAMES] [--materialize]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ioreth.ax25 import Address, Frame, APRS_CONTROL_FLD, APRS_PROTOCOL_ID
+
+logger = logging.getLogger('iorethd.ax25')
+
+PATHS = [
+    ['WIDE1-1', 'WIDE2-2'],
+    ['WIDE2-1'],
+    ['PP5JRS-15*', 'WIDE2-1'],
+    ['WIDE1*', 'PP5JRS-15*'],
+    [],
+]
+
+
+class LegacyAddress:
+    """The Address ioreth used to have: one plain object per address."""
+
+    def __init__(self, callsign, ssid=0, digipeated=False, end_of_path=False):
+        self.callsign = callsign
+        self.ssid = ssid
+        self.digipeated = digipeated
+        self.end_of_path = end_of_path
+
+    @staticmethod
+    def from_bytes(addr):
+        if len(addr) != 7:
+            raise ValueError("Bad AX25 address")
+
+        callsign = "".join(chr(n >> 1) for n in addr[0:6]).strip()
+        ssid = (addr[6] & 0b00011110) >> 1
+        digipeated = bool(addr[6] & 0b10000000)
+        end_of_path = bool(addr[6] & 1)
+
+        return LegacyAddress(callsign, ssid, digipeated, end_of_path)
+
+
+class LegacyFrame:
+    """The Frame ioreth used to have, decoding everything up front."""
+
+    def __init__(self, source, dest, path, control, pid, info, via=None):
+        logger.debug(f"({source=}, {dest=}, {path=}, {control=}, {pid=}, {info=}, {via=})")
+        self.source = source
+        self.dest = dest
+        self.path = path
+        self.control = control
+        self.pid = pid
+        self.info = info
+        self.via = via
+        self.connection = None
+
+    @staticmethod
+    def from_kiss_bytes(fdata):
+        pos = 0
+        dlen = len(fdata)
+        if dlen < 19:
+            raise ValueError("Frame length is smaller than expected minimum")
+
+        dest = LegacyAddress.from_bytes(fdata[0:7])
+        pos += 7
+
+        addr_list = []
+        while pos < dlen - 7:
+            addr_list.append(LegacyAddress.from_bytes(fdata[pos : pos + 7]))
+            pos += 7
+            if addr_list[-1].end_of_path:
+                break
+
+        source = addr_list[0]
+        path = [ p for p in addr_list[1:] ]
+
+        if pos >= dlen - 2:
+            raise ValueError("Invalid frame data")
+
+        control = fdata[pos]
+        pid = fdata[pos + 1]
+        info = fdata[pos + 2 :]
+
+        return LegacyFrame(source, dest, path, control, pid, info)
+
+
+def make_frames(nframes, nstations=300):
+    rnd = random.Random(42)
+    stations = [f'PY{n % 10}A{chr(65 + n % 26)}{chr(65 + n // 26 % 26)}-{n % 16}'
+                for n in range(nstations)]
+    frames = []
+    for _ in range(nframes):
+        path = rnd.choice(PATHS)
+        frame = Frame(
+            Address.from_string(rnd.choice(stations)),
+            Address.from_string('APRS'),
+            [Address.from_string(p) for p in path],
+            APRS_CONTROL_FLD,
+            APRS_PROTOCOL_ID,
+            b'=2628.97S/04906.81Wx Ittner',
+        )
+        frames.append(frame.to_kiss_bytes())
+    return frames
+
+
+def measure(name, decode, raw):
+    # Warm up any caches so they are not charged to the measurement.
+    for data in raw[:1000]:
+        decode(data)
+
+    start = time.perf_counter()
+    for data in raw:
+        decode(data)
+    elapsed = time.perf_counter() - start
+
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    kept = [decode(data) for data in raw]
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sys.getallocatedblocks() - blocks
+
+    nframes = len(raw)
+    print(f"{name}:")
+    print(f"  decode time:         {elapsed / nframes * 1e6:8.2f} us/frame")
+    print(f"  retained memory:     {retained / nframes:8.1f} bytes/frame")
+    print(f"  retained blocks:     {blocks / nframes:8.1f} allocations/frame")
+    print(f"  peak traced memory:  {peak / nframes:8.1f} bytes/frame")
+    del kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', '--frames', type=int, default=20000)
+    parser.add_argument('--materialize', action='store_true',
+                        help='access all the fields of every frame')
+    args = parser.parse_args()
+
+    raw = make_frames(args.frames)
+
+    def decode(data):
+        frame = Frame.from_kiss_bytes(data)
+        frame.data_type
+        if args.materialize:
+            frame.source, frame.dest, frame.path, frame.info
+        return frame
+
+    print(f"{args.frames} frames")
+    for name, func in (('lazy', decode),
+                       ('legacy', LegacyFrame.from_kiss_bytes)):
+        measure(name, func, raw)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Feed KISS frames through a loopback socket pair standing in for the TNC
+and measure how fast they are deframed, comparing the streaming decoder
+with the old split-and-reslice loop.
+
+    python3 benchmarks/kiss_deframer.py [-n FRAMES] [--chunk BYTES]
+"""
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ioreth import kiss
+from ioreth.ax25 import Address, Frame, APRS_CONTROL_FLD, APRS_PROTOCOL_ID
+
+
+def make_stream(nframes):
+    frame = Frame(
+        Address.from_string('PP5ITT-7'),
+        Address.from_string('APDR15'),
+        [Address.from_string('WIDE1-1'), Address.from_string('WIDE2-2')],
+        APRS_CONTROL_FLD,
+        APRS_PROTOCOL_ID,
+        # Includes bytes that need escaping.
+        b':APRSFL   :cq hello \xc0 net \xdb{42',
+    )
+    return kiss.escape(frame.to_kiss_bytes()) * nframes
+
+
+class LegacyDecoder:
+    """The deframing loop TcpKissClient used to have."""
+
+    def __init__(self):
+        self._inbuf = bytearray()
+
+    def feed(self, data):
+        frames = []
+        self._inbuf += data
+        while len(self._inbuf) > 3:
+            if self._inbuf[0] != kiss.FEND[0]:
+                raise ValueError("Bad frame start")
+            lst = self._inbuf[2:].split(kiss.FEND, 1)
+            if len(lst) < 2:
+                break
+            self._inbuf = lst[1]
+            frames.append(
+                lst[0]
+                .replace(kiss.FESC_TFEND, kiss.FEND)
+                .replace(kiss.FESC_TFESC, kiss.FESC)
+            )
+        return frames
+
+
+def run(decoder, stream, chunk):
+    rsock, wsock = socket.socketpair()
+
+    def writer():
+        view = memoryview(stream)
+        for pos in range(0, len(view), chunk):
+            wsock.sendall(view[pos : pos + chunk])
+        wsock.close()
+
+    thr = threading.Thread(target=writer)
+    count = 0
+    start = time.perf_counter()
+    thr.start()
+    while True:
+        data = rsock.recv(chunk)
+        if not data:
+            break
+        count += len(decoder.feed(data))
+    elapsed = time.perf_counter() - start
+    thr.join()
+    rsock.close()
+    return count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', '--frames', type=int, default=100000)
+    parser.add_argument('--chunk', type=int, default=65536,
+                        help='bytes per write/recv')
+    args = parser.parse_args()
+
+    stream = make_stream(args.frames)
+    print(f"{args.frames} frames, {len(stream)} bytes, {args.chunk} byte chunks")
+    for name, decoder in (('streaming', kiss.KissDecoder()),
+                          ('legacy', LegacyDecoder())):
+        count, elapsed = run(decoder, stream, args.chunk)
+        print(f"{name:>10}: {count} frames in {elapsed:.3f}s "
+              f"({count / elapsed:,.0f} frames/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,13 @@
 import logging
 import time
 import re
+import types
 
 logging.basicConfig()
 logger = logging.getLogger('commands.cq')
 
-from ioreth.ax25 import Address, Frame, APRS_CONTROL_FLD, APRS_PROTOCOL_ID
+from ioreth.fanout import NetMessage
+from ioreth.netlog import open_store
 
 netlog = None
 config = None
@@ -31,70 +33,140 @@ class NetLog:
     multiple times with different messages, then there will be mulitple
     entries in the netlog file.
 
-    Internally the full netlog file is kept in memory as the `checkin`
-    attribute of the netlog instance. The `checkin` attribute is an
+    With `netlog_db` set in the files section the net is stored in that
+    SQLite database instead, and the netlog file is kept as an export.
+    The first time, the existing netlog file is imported.
+
+    The net lasts one day: at local midnight it starts over empty. Only
+    the entries of the current day are kept in memory, in the `checkins`
+    attribute of the netlog instance. The `checkins` attribute is an
     array of hash maps with the value of each field available. The keys
     to the hash map are `time`, `station`, `via` and `message`.
 
     When a station checks out of the net using the `unsubscribe` command,
     a netlog entry is created with the message '*UNSUBSCRIBE*'.
 
+    Every entry also updates, as it is read or written, a set of the
+    (station, message) pairs already logged and the map of the stations
+    currently in the net to their connection, so the queries do not
+    need to go through the whole log.
+
+    Listeners added with `add_listener` are called with the callsigns of
+    the current checkins every time a station joins or leaves the net.
+
+    Creating the netlog again with other paths, as when the files section
+    of the config file changes, switches the same instance to the store
+    at those paths.
+
     """
-    def __new__(cls, logfile=None):
+    def __new__(cls, logfile=None, database=None):
         if not hasattr(cls, 'instance'):
             cls.instance = super(NetLog, cls).__new__(cls)
-            cls.logfile = logfile
-            cls.fp = open(logfile, 'a+')
-
-            # first we need to initialize checkins and then read the values
+            cls.store = None
+            cls.rollover_at = 0
             cls.checkins = []
-            cls.checkins = cls.instance.read()
+            cls._dupes = set()
+            cls._members = {}
+            cls.listeners = []
+            cls.members = frozenset()
+        if cls.store is None or (logfile, database) != (cls.logfile, cls.database):
+            cls.instance._open(logfile, database)
         return cls.instance
 
+    def _open(self, logfile, database):
+        """Load the net from the store at these paths, closing the one
+        used so far, if any.
+        """
+        if self.store is not None:
+            self.store.close()
+        cls = self.__class__
+        cls.logfile = logfile
+        cls.database = database
+        cls.store = open_store(logfile, database)
+        self.read()
+        self._members_changed()
+
     def __del__(self):
-        self.fp.close()
+        self.store.close()
 
     def write(self, sender: str, connection: str, text: str):
+        self._rollover()
         now = time.strftime("%Y-%m-%d %H:%M:%S %Z")
-        self.fp.write(f"{now}|{sender}|{text}\n")
-        self.fp.flush()
-        self.checkins.append({'time': now, 'station': sender,
-                              'message': text, 'via': connection})
+        entry = {'time': now, 'station': sender, 'message': text,
+                 'via': connection}
+        self.store.append(entry)
+        self.checkins.append(entry)
+
+        if self._index(entry):
+            self._members_changed()
+
+    def _members_changed(self):
+        members = frozenset(self._members)
+        if members != self.members:
+            self.__class__.members = members
+            for callback in self.listeners:
+                callback(members)
+
+    def _rollover(self):
+        """Start the net of the new day after midnight."""
+        if time.time() < self.rollover_at:
+            return
+        self.read()
+        self._members_changed()
+
+    def _index(self, entry):
+        """Add a log entry to the indexes. Returns True if the members
+        of the net changed.
+        """
+        station = entry['station']
+        self._dupes.add((station, entry['message']))
+        if entry['message'] == '*UNSUBSCRIBE*':
+            return self._members.pop(station, None) is not None
+        joined = station not in self._members
+        self._members[station] = entry['via']
+        return joined
+
+    def add_listener(self, callback):
+        """Call callback(callsigns) now and whenever the members change.
+        Returns a function that removes the listener.
+        """
+        self.listeners.append(callback)
+        callback(self.members)
+
+        def remove():
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+        return remove
 
     def read(self) -> str:
+        """Load the entries of the current day."""
         self.checkins.clear()
+        self._dupes.clear()
+        self._members.clear()
+
+        now = time.localtime()
+        tomorrow = (now.tm_year, now.tm_mon, now.tm_mday + 1, 0, 0, 0, 0, 0, -1)
+        self.__class__.rollover_at = time.mktime(tomorrow)
 
-        self.fp.seek(0)
-
-        entries = self.fp.readlines()
-        for entry in entries:
-            ci_time, ci_source, ci_mesg = entry.split('|', 2)
-            ci_station, ci_via = ci_source.split('/', 2)
-            ci_mesg = ci_mesg.replace('\n', '')
-            self.checkins.append({'time': ci_time,
-                                  'station': ci_station,
-                                  'via': ci_via,
-                                  'message': ci_mesg })
+        for checkin in self.store.entries(time.strftime("%Y-%m-%d", now)):
+            self.checkins.append(checkin)
+            self._index(checkin)
         return self.checkins
 
     def check_for_dup(self, sender, mesg):
-        for checkin in self.checkins:
-            if checkin['station'].startswith(sender) and mesg == str(checkin['message']):
-                return True
-        return False
+        self._rollover()
+        return (sender, mesg) in self._dupes
 
     def current_checkins(self):
-        callsigns = {}
-        for entry in self.checkins:
-            if entry['station'] in callsigns and entry['message'] == '*UNSUBSCRIBE*':
-                del callsigns[entry['station']]
-                continue
-            callsigns[entry['station']] = entry['via']
-
-        return callsigns
+        """Read-only map of the callsigns in the net to the connection
+        they were last heard through, in check in order.
+        """
+        self._rollover()
+        return types.MappingProxyType(self._members)
 
     def checkin_count(self):
-        return len(self.current_checkins())
+        self._rollover()
+        return len(self._members)
 
 
 def register(bot_config):
@@ -105,7 +177,8 @@ def register(bot_config):
         return
 
     config = bot_config
-    netlog = NetLog(config['files']['netlog'])
+    netlog = NetLog(config['files']['netlog'],
+                    config.get('files', 'netlog_db', fallback=None))
 
     return [{ 'command': 'cq',
               'status': False,
@@ -126,70 +199,64 @@ def register(bot_config):
               'status': False,
               'help': 'UNSUBSCRIBE|UNSUB|U: check out of the net & stop checking notifications',
               'cron': '',
-              'alias': ['u', 'unsub'],
+              'aliases': ['u', 'unsub'],
+            },
+            { 'members': netlog.add_listener,
             }]
 
-def invoke(frame, cmd: str, args: str):
-    logger.debug(f"({frame=}, {cmd=}, {args=})")
+def invoke(msg):
+    logger.debug(f"({msg=})")
+    cmd = msg.command
     if cmd == 'cq':
-        return do_cq(frame, args)
+        return do_cq(msg)
     elif cmd == 'net':
-        return do_net(frame, args)
+        return do_net(msg)
     elif cmd == 'list':
-        return do_list(frame, args)
+        return do_list(msg)
     elif cmd in ['unsubscribe', 'unsub', 'u']:
-        return do_unsubscribe(frame, args)
+        return do_unsubscribe(msg)
 
 
-def do_cq(frame, args):
-    logger.debug(f"({frame=}, {args=})")
-    global config, netlog
+def do_cq(msg):
+    logger.debug(f"({msg=})")
+    global netlog
 
     # need to do some dup checking on the checkin
-    station = str(frame.source).replace('*', '')  # Checkin sent with no path
+    station, args = msg.source, msg.args
     if netlog.check_for_dup(station, args):
         return ''
 
     # write another check in to netlog file
-    notifications = do_net(frame, args)
-
-    # iterate through the check ins and send a message
-    checkins = netlog.current_checkins()
-    for receiver, via in checkins.items():
-        # we don't need to send notification to the source
-        if not receiver == station:
-            bot_name = Address.from_string(config[f'conn.{via}']['callsign'])
-            dest = Address.from_string(config[f'conn.{via}']['destination'])
-            mesg = f':{receiver:9}:{station}: {args}'.encode('ASCII')
-            path = []
-            for p in config[f'conn.{via}']['path'].split(','):
-                path.append(Address.from_string(p))
-
-            notif_frame = Frame(bot_name, dest, path, APRS_CONTROL_FLD,
-                                APRS_PROTOCOL_ID, mesg)
-            notif_frame.connection = via
-            notifications.append(notif_frame)
+    notifications = do_net(msg)
+
+    # the bot sends the message to the other check ins, through the
+    # connection each one was heard on
+    recipients = {receiver: via
+                  for receiver, via in netlog.current_checkins().items()
+                  if receiver != station}
+    if recipients:
+        notifications.append(NetMessage(station, f'{station}: {args}', recipients))
     return notifications
 
-def do_net(frame, args):
-    logger.debug(f"({frame=}, {args=})")
+def do_net(msg):
+    logger.debug(f"({msg=})")
     global config, netlog
 
     # need to do some dup checking on the checkin
-    station = str(frame.source).replace('*', '')  # Checkin sent with no path
+    station, args = msg.source, msg.args
     if netlog.check_for_dup(station, args):
         return ''
 
     # write another check in to netlog file
-    netlog.write(station, frame.connection, args)
+    netlog.write(station, msg.connection, args)
 
     # iterate through the check ins and send a message
     notifications = [f"You are checked in as {station}"]
 
     return notifications
 
-def do_list(frame, args):
-    logger.debug(f"({frame=}, {args=})")
+def do_list(msg):
+    logger.debug(f"({msg=})")
     global netlog
 
     # gather a list of checkins and response with list of callsigns
@@ -209,12 +276,11 @@ def do_list(frame, args):
     return responses
 
 
-def do_unsubscribe(frame, args):
-    logger.debug(f"({frame=}, {args=})")
+def do_unsubscribe(msg):
+    logger.debug(f"({msg=})")
     global netlog
 
-    station = str(frame.source).replace('*', '')
-    netlog.write(station, frame.connection, '*UNSUBSCRIBE*')
+    netlog.write(msg.source, msg.connection, '*UNSUBSCRIBE*')
 
     return 'You have checked out of the net'
 
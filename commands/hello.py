@@ -7,7 +7,6 @@ def register(config):
               'help': 'HELLO|ALLO|NIHAO: respond with a greating'
             }]
 
-def invoke(frame, cmd: str, args: str):
-    station = str(frame.source).replace('*', '')
-    return f"{cmd} {station}"
+def invoke(msg):
+    return f"{msg.command} {msg.source}"
 
@@ -17,14 +17,50 @@
 #
 
 import time
+import random
 import logging
 
-from .ax25 import Frame, Address, APRS_CONTROL_FLD, APRS_PROTOCOL_ID
+from .ax25 import FrameTemplate, Address
+from .delivery import DeliveryEngine
+from .message import Message
+from .txsched import TransmitScheduler, PRIO_ACK, PRIO_REPLY, PRIO_BULLETIN
 
 logging.basicConfig()
 logger = logging.getLogger('iorethd.aprs_client')
 
 
+class PacketSubscribers:
+    """Registry of callbacks interested in APRS data types, so plugins can
+    receive packets without subclassing AprsClient. Callbacks are called as
+    callback(frame).
+    """
+
+    def __init__(self):
+        self._subs = {}
+        # Bumped on every change so clients know when to rebuild their
+        # dispatch tables.
+        self.version = 0
+
+    def subscribe(self, data_types, callback):
+        """Call 'callback' for every packet whose data type is one of the
+        characters (or bytes) in 'data_types'.
+        """
+        if isinstance(data_types, str):
+            data_types = data_types.encode('latin-1')
+        for data_type in data_types:
+            self._subs.setdefault(data_type, []).append(callback)
+        self.version += 1
+
+    def unsubscribe(self, callback):
+        for callbacks in self._subs.values():
+            while callback in callbacks:
+                callbacks.remove(callback)
+        self.version += 1
+
+    def get(self, data_type):
+        return self._subs.get(data_type, ())
+
+
 class AprsClient:
     """Handle parsing and generation of APRS packets.
     """
@@ -32,11 +68,58 @@ class AprsClient:
     DEFAULT_PATH = "WIDE1-1,WIDE2-2"
     DEFAULT_DESTINATION = "APZIOR"
 
+    # Callback for each APRS data type; everything else goes to
+    # on_aprs_others.
+    DATA_TYPE_HANDLERS = {
+        ord(":"): 'on_aprs_message',
+        ord(">"): 'on_aprs_status',
+        ord(";"): 'on_aprs_object',
+        ord(")"): 'on_aprs_item',
+        ord("?"): 'on_aprs_query',
+        ord("<"): 'on_aprs_capabilities',
+        ord("!"): 'on_aprs_position_wtr',
+        ord("@"): 'on_aprs_position_ts_msg',
+        ord("="): 'on_aprs_position_msg',
+        ord("/"): 'on_aprs_position_ts',
+        ord("T"): 'on_aprs_telemetry',
+        ord("`"): 'on_aprs_mic_e',
+        ord("'"): 'on_aprs_old_mic_e',
+    }
+    # Callbacks that do something even when not overridden.
+    ACTIVE_HANDLERS = ('on_aprs_message',)
+
+    # Results of screen_message()
+    MSG_REJECTED = 0
+    MSG_DIRECT = 1
+    MSG_BULLETIN = 2
+
     def __init__(self):
+        self.callsign = None
         self.path = None
         self.destination = None
+        self.aliases = ''
+        self.bulletin_groups = ''
         self.handler = None
+        self.reactor = None
         self.conn_name = None
+        self._templates = {}
+        self._addressees = None
+        self.subscribers = PacketSubscribers()
+        self.dupes = None
+        self.delivery = DeliveryEngine(self)
+        self.tx = TransmitScheduler(lambda frame: self.write_frame(frame),
+                                    lambda: self.is_connected())
+        self.reconnect_min = 1
+        self.reconnect_max = 300
+        self.reconnect_state = 'disconnected'
+        self._reconnect_attempts = 0
+        self._reconnect_timer = None
+        self._keep_connected = False
+        self._dispatch = None
+        self._dispatch_version = None
+        self.packets_dropped = 0
+        self.messages_accepted = 0
+        self.messages_rejected = 0
 
     def setDestination(self, dest: str):
         self.destination = dest
@@ -44,9 +127,124 @@ class AprsClient:
     def setPath(self, path: str):
         self.path = path
 
+    def setAliases(self, aliases: str):
+        """Comma separated list of other addressees we answer to."""
+        self.aliases = aliases
+
+    def setBulletinGroups(self, groups: str):
+        """Comma separated list of bulletin groups (the 'yyyyy' in
+        BLNxyyyyy) we want to receive.
+        """
+        self.bulletin_groups = groups
+
     def setHandler(self, handler):
         self.handler = handler
 
+    def setPacketSubscribers(self, subscribers):
+        """Share a registry of callbacks interested in data types."""
+        self.subscribers = subscribers
+
+    def setMessageRetries(self, retries: int, delay: float):
+        """Number of times a message asking for an ack is resent and the
+        initial delay between attempts (doubled after each one).
+        """
+        self.delivery.retries = retries
+        self.delivery.delay = delay
+
+    def setDupeFilter(self, dupes):
+        """Share a DupeFilter so a message received through several
+        paths or connections is only handled once.
+        """
+        self.dupes = dupes
+
+    def setReactor(self, reactor):
+        """Event loop where this connection registers its socket. Must be
+        set before connect().
+        """
+        self.reactor = reactor
+        self.tx.reactor = reactor
+
+    def setReconnect(self, min_delay: float, max_delay: float):
+        """Reconnection backoff: the delay starts at 'min_delay' seconds
+        and doubles on each failed attempt up to 'max_delay'.
+        """
+        self.reconnect_min = min_delay
+        self.reconnect_max = max_delay
+
+    def is_connected(self):
+        return False
+
+    def start(self):
+        """Connect and keep the connection up, reconnecting after errors
+        or drops with exponential backoff. Queued frames are kept while
+        disconnected and sent once the connection is up again.
+        """
+        self._keep_connected = True
+        self._try_connect()
+
+    def stop(self):
+        """Disconnect and stop reconnecting. Messages waiting for an ack
+        are given up and queued frames are dropped.
+        """
+        self._keep_connected = False
+        if self._reconnect_timer:
+            self._reconnect_timer.cancel()
+            self._reconnect_timer = None
+        self.delivery.cancel_all()
+        self.tx.clear()
+        self.disconnect()
+
+    def _try_connect(self):
+        self._reconnect_timer = None
+        if self.is_connected():
+            return
+        self.reconnect_state = 'connecting'
+        try:
+            self.connect()
+        except Exception as exc:
+            logger.warning(f"Connection {self.conn_name} failed: {exc}")
+            self.on_connect_failed()
+
+    def _schedule_reconnect(self):
+        if not self._keep_connected or not self.reactor or self._reconnect_timer:
+            return
+        delay = min(self.reconnect_max,
+                    self.reconnect_min * 2 ** self._reconnect_attempts)
+        # Jitter so several connections (or bots) do not retry in lockstep.
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self._reconnect_attempts += 1
+        self.reconnect_state = 'waiting'
+        logger.info(f"Reconnecting {self.conn_name} in {delay:.1f}s")
+        self._reconnect_timer = self.reactor.call_later(delay, self._try_connect)
+
+    def on_connect(self):
+        self.reconnect_state = 'connected'
+        self._reconnect_attempts = 0
+        # Send whatever was queued while we were disconnected.
+        self.tx.pump()
+
+    def on_connect_failed(self):
+        self.reconnect_state = 'disconnected'
+        self._schedule_reconnect()
+
+    def on_disconnect(self):
+        self.reconnect_state = 'disconnected'
+        self._schedule_reconnect()
+
+    def setTxPacing(self, rate: float, burst: int, max_queue: int):
+        """Transmit at most 'rate' frames per second on average, in bursts
+        of up to 'burst' frames, keeping up to 'max_queue' frames waiting.
+        A rate of 0 sends frames as soon as they are queued.
+        """
+        self.tx.configure(rate, burst, max_queue)
+
+    def enqueue_frame(self, frame, priority=PRIO_REPLY):
+        """Queue a frame to be sent when the pacing allows. Acks go before
+        replies, replies before fan-out notifications and these before
+        bulletins.
+        """
+        return self.tx.enqueue(frame, priority)
+
     def send_frame_bytes(self, frame_bytes):
         try:
             logger.info("SEND: %s", frame_bytes.hex())
@@ -57,18 +255,18 @@ class AprsClient:
     def on_recv_frame(self, frame):
         """ Handle an AX.25 frame and look for APRS data packets.
         """
-        logger.debug(f'({frame=})')
+        logger.debug("(frame=%r)", frame)
 
         # set the connection name on the frame so it can be determined
         # later on how to route replies
         frame.connection = self.conn_name
 
-        if frame.info == b"":
+        if frame.data_type is None:
             # No data.
             return
 
         via = None
-        if frame.info[0] == ord(b"}"):
+        if frame.data_type == ord(b"}"):
             # Got a third-party APRS packet, check the payload.
             # PP5ITT-10>APDW15,PP5JRS-15*,WIDE2-1:}PP5ITT-7>APDR15,TCPIP,PP5ITT-10*::PP5ITT-10:ping 00:01{17
 
@@ -98,11 +296,18 @@ class AprsClient:
                 return
 
             # Source address should be a valid callsign+SSID.
-            source = Address(eae_path[0].decode('ascii', errors='ignore'))
             destpath_info = eae_path[1].split(b":", 1)
             destpath = destpath_info[0].split(b",")
-            dest = Address(destpath[0].decode('ascii', errors='ignore'))
-            path = [ Address(p.decode('ascii', errors='ignore')) for p in destpath[1:] ]
+            try:
+                source = Address.from_string(eae_path[0].decode('ascii', errors='ignore'))
+                dest = Address.from_string(destpath[0].decode('ascii', errors='ignore'))
+                path = [ Address.from_string(p.decode('ascii', errors='ignore')) for p in destpath[1:] ]
+            except (ValueError, IndexError):
+                logger.warning(
+                    "Discarding third party packet with bad headers. %s",
+                    frame.to_string(),
+                )
+                return
 
             if len(destpath_info) != 2:
                 logger.warning(
@@ -121,43 +326,22 @@ class AprsClient:
 
         self.on_aprs_packet(frame)
 
-    # def enqueue_frame(self, frame):
-    #     logger.info("AX.25 frame %d: %s", self._frame_cnt, frame.to_aprs())
-    #     #self.enqueue_frame_bytes(frame.to_kiss_bytes())
-    #     self.enqueue_frame_bytes(frame.to_aprs())
-
-    # def enqueue_frame_bytes(self, data_bytes):
-    #     logger.info("AX.25 frame %d enqueued for sending", self._frame_cnt)
-    #     self._snd_queue.append((self._frame_cnt, data_bytes))
-    #     self._frame_cnt += 1
-
-    # def dequeue_frame_bytes(self):
-    #     now = time.monotonic()
-    #     if now < (self._snd_queue_last + self._snd_queue_interval):
-    #         return
-    #     self._snd_queue_last = now
-    #     if len(self._snd_queue) > 0:
-    #         num, frame_bytes = self._snd_queue.pop(0)
-    #         logger.info("Sending queued AX.25 frame %d", num)
-    #         logger.info(frame_bytes)
-    #         self.send_frame_bytes(frame_bytes)
-
-    # def on_loop_hook(self):
-    #     self.dequeue_frame_bytes()
+    def frame_template(self):
+        """Encoded headers for the frames we send, built once per
+        (callsign, destination, path).
+        """
+        key = (self.callsign, self.destination, self.path)
+        template = self._templates.get(key)
+        if template is None:
+            template = FrameTemplate.from_strings(*key)
+            self._templates[key] = template
+        return template
 
     def make_frame(self, data, via=None):
         """Shortcut for making a AX.25 frame with a APRS packet with the
         known (mostly constant) information and 'data' as the contents.
         """
-        return Frame(
-            Address.from_string(self.callsign),
-            Address.from_string(self.destination),
-            [Address.from_string(s) for s in self.path.split(",")],
-            APRS_CONTROL_FLD,
-            APRS_PROTOCOL_ID,
-            data,
-            via,
-        )
+        return self.frame_template().make_frame(data, via)
 
     def make_aprs_msg(self, to_call, text, via=None):
         """Make an APRS message packet sending 'text' to 'to_call'.
@@ -170,21 +354,32 @@ class AprsClient:
         """
         return self.make_frame((">" + status).encode("utf-8"), via)
 
-    def send_aprs_msg(self, to_call, text, via=None):
-        logger.debug(f"({to_call}, {text}, {via})")
-        self.write_frame(self.make_aprs_msg(to_call, text, via=via))
+    def send_aprs_msg(self, to_call, text, via=None, ack=False,
+                      priority=PRIO_REPLY):
+        """Send a message. With 'ack' it gets a message id and is resent
+        until the recipient acks it.
+        """
+        logger.debug(f"({to_call}, {text}, {via}, {ack})")
+        if ack:
+            self.delivery.send(to_call, text, via, priority)
+        else:
+            self.enqueue_frame(self.make_aprs_msg(to_call, text, via=via),
+                               priority)
 
     def send_aprs_status(self, status, via=None):
         logger.debug(f"({status}, {via})")
-        self.write_frame(self.make_aprs_status(status, via=via))
+        self.enqueue_frame(self.make_aprs_status(status, via=via),
+                           PRIO_BULLETIN)
 
     def on_aprs_packet(self, frame):
         """A APRS packet was received, possibly through a third-party forward.
 
         This code runs *after* the search for third-party packets. The
         default implementation will call a more specialized callback for
-        known data types. Users can override this for specialized parsing
-        if required.
+        known data types, plus any callbacks in the subscribers registry,
+        through a table indexed by the data type byte. Packets of types
+        nobody handles are dropped right there. Users can override this
+        for specialized parsing if required.
 
         origframe: the original ax25.Frame
         source: the sender's callsign as a string.
@@ -192,115 +387,196 @@ class AprsClient:
         via: None is not a third party packet; otherwise is the callsign of
              the forwarder (as a string).
         """
-        logger.debug(f'({frame=})')
+        logger.debug("(frame=%r)", frame)
 
-        if frame.info == b"":
+        data_type = frame.data_type
+        if data_type is None:
             self.on_aprs_empty(frame)
             return
-        data_type = frame.info[0]
-        if data_type == ord(b":"):
-            self.on_aprs_message(frame)
-        elif data_type == ord(b">"):
-            self.on_aprs_status(frame)
-        elif data_type == ord(b";"):
-            self.on_aprs_object(frame)
-        elif data_type == ord(b")"):
-            self.on_aprs_item(frame)
-        elif data_type == ord(b"?"):
-            self.on_aprs_query(frame)
-        elif data_type == ord(b"<"):
-            self.on_aprs_capabilities(frame)
-        elif data_type == ord(b"!"):
-            self.on_aprs_position_wtr(frame)
-        elif data_type == ord(b"@"):
-            self.on_aprs_position_ts_msg(frame)
-        elif data_type == ord(b"="):
-            self.on_aprs_position_msg(frame)
-        elif data_type == ord(b"/"):
-            self.on_aprs_position_ts(frame)
-        elif data_type == ord(b"T"):
-            self.on_aprs_telemetry(frame)
-        elif data_type == ord(b"`"):
-            self.on_aprs_mic_e(frame)
-        elif data_type == ord(b"'"):
-            self.on_aprs_old_mic_e(frame)
-        else:
-            self.on_aprs_others(frame)
+
+        if self._dispatch_version != self.subscribers.version:
+            self._build_dispatch()
+        handler = self._dispatch[data_type]
+        if handler is None:
+            # Nobody cares about this data type.
+            self.packets_dropped += 1
+            return
+        handler(frame)
+
+    def _build_dispatch(self):
+        """Build the table mapping every data type byte to the function(s)
+        that handle it. Types handled only by the empty default callbacks
+        and without subscribers map to None.
+        """
+        table = [None] * 256
+        for data_type in range(256):
+            name = self.DATA_TYPE_HANDLERS.get(data_type, 'on_aprs_others')
+            handlers = []
+            if (name in self.ACTIVE_HANDLERS
+                    or getattr(type(self), name) is not getattr(AprsClient, name)):
+                handlers.append(getattr(self, name))
+            handlers.extend(self.subscribers.get(data_type))
+
+            if len(handlers) == 1:
+                table[data_type] = handlers[0]
+            elif handlers:
+                def call_all(frame, handlers=tuple(handlers)):
+                    for handler in handlers:
+                        handler(frame)
+                table[data_type] = call_all
+
+        self._dispatch = table
+        self._dispatch_version = self.subscribers.version
 
     def on_aprs_empty(self, frame):
         """APRS empty packet (no payload). What can we do with this?! Just
         log the sending station as alive?
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
+    def _addressee_sets(self):
+        key = (self.callsign, self.aliases, self.bulletin_groups)
+        if self._addressees is None or self._addressees[0] != key:
+            def to_set(names):
+                return frozenset(
+                    n.strip().upper().encode('ascii', errors='ignore')
+                    for n in names if n and n.strip()
+                )
+            direct = to_set([self.callsign] + self.aliases.split(','))
+            groups = to_set(self.bulletin_groups.split(','))
+            self._addressees = (key, direct, groups)
+        return self._addressees[1], self._addressees[2]
+
+    def screen_message(self, frame):
+        """Check the addressee of a message packet straight from the raw
+        info bytes. Returns MSG_DIRECT if it is addressed to us,
+        MSG_BULLETIN if it is a bulletin for a group we subscribed, or
+        MSG_REJECTED.
+        """
+        info = frame.info_view
+        # The addressee is a fixed 9 character field: ":ADDRESSEE:text"
+        if len(info) < 11 or info[10] != 0x3A:
+            return self.MSG_REJECTED
+        addressee = info[1:10].tobytes().rstrip().upper()
+        direct, groups = self._addressee_sets()
+        if addressee in direct:
+            return self.MSG_DIRECT
+        if groups and addressee[:3] == b"BLN" and addressee[4:] in groups:
+            return self.MSG_BULLETIN
+        return self.MSG_REJECTED
+
     def on_aprs_message(self, frame=None):
         """Parse APRS message packet (data type: :)
 
         This may be a directed message, a bulletin, announce ... with or
-        without confirmation request, or maybe just trash. We will need to
-        look inside to know.
+        without confirmation request, or maybe just trash. Messages not
+        addressed to us are dropped before any decoding.
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
+
+        kind = self.screen_message(frame)
+        if kind == self.MSG_REJECTED:
+            self.messages_rejected += 1
+            return
+        self.messages_accepted += 1
+
+        # The info field holds addressee, text and msgid. Messages with a
+        # msgid are retried by the sender until acked, so they are
+        # remembered for longer.
+        if self.dupes is not None:
+            retried = b"{" in frame.info
+            if self.dupes.check(frame.source.callsign, frame.source.ssid,
+                                frame.info,
+                                window=self.dupes.retry_window if retried else None):
+                logger.info(f"Dropping duplicate message from {frame.source}")
+                if retried and kind == self.MSG_DIRECT:
+                    self._ack_again(frame)
+                return
 
-        data_str = frame.info.decode("utf-8", errors="backslashreplace")
+        if kind == self.MSG_BULLETIN:
+            self.on_aprs_bulletin(frame)
+            return
 
-        addressee_text = data_str[1:].split(":", 1)
-        if len(addressee_text) != 2:
-            logger.warning("Bad addressee:text pair: %s", addressee_text)
+        msg = Message.from_frame(frame)
+        if msg is None:
             return
-        addressee = addressee_text[0].strip()
-        text_msgid = addressee_text[1].rsplit("{", 1)
-        text = text_msgid[0]
-        msgid = None
-        if len(text_msgid) == 2:
+        if msg.msgid is None and self.delivery.on_ack_rej(msg.source, msg.text):
+            # An ack or rej for one of our messages, not a query.
+            return
+
+        if msg.msgid is not None:
             # This message is asking for an ack.
-            msgid = text_msgid[1]
+            logger.info(f"Sending ack to message {msg.msgid} from {msg.source}.")
+            self.send_aprs_msg(msg.source, "ack" + msg.msgid, frame.via,
+                               priority=PRIO_ACK)
 
-            logger.info(f"Sending ack to message {msgid} from {frame.source}.")
-            self.send_aprs_msg(frame.source.to_string().replace('*',''), "ack" + msgid, frame.via)
-            frame.info = f":{addressee:9}:{text}".encode()
+        logger.info(f"Message from {msg.source}:{msg.text}")
+        response = self.handler.on_message(msg)
+        self.reply(msg, response)
 
-        logger.info(f"Message from {frame.source}:{text}")
-        response = self.handler.on_message(frame)
+    def _ack_again(self, frame):
+        """Ack a message already handled: our first ack may have been lost.
+        """
+        msg = Message.from_frame(frame)
+        if msg is None or msg.msgid is None:
+            return
+        logger.info(f"Sending ack to message {msg.msgid} from {msg.source} again.")
+        self.send_aprs_msg(msg.source, "ack" + msg.msgid, frame.via,
+                           priority=PRIO_ACK)
+
+    def reply(self, msg, response):
+        """Send 'response', a text or a list of texts, to the sender of
+        'msg'. Handlers that answer later call this themselves.
+        """
         logger.debug(f"{response=}")
 
+        # Only ask for acks from stations that use them.
+        ack = msg.msgid is not None
+
         # response is allowed to come back as multiple messages
         if type(response) == list:
             for r in response:
                 logger.debug(f'sending {response=}')
-                self.send_aprs_msg(str(frame.source), r, frame.via)
+                self.send_aprs_msg(msg.source, r, msg.via, ack=ack)
         else:
-            self.send_aprs_msg(str(frame.source), response, frame.via)
+            self.send_aprs_msg(msg.source, response, msg.via, ack=ack)
+
+    def on_aprs_bulletin(self, frame=None):
+        """Bulletin for one of the subscribed groups (data type: :). These
+        are neither acked nor answered.
+        """
+        logger.debug("(frame=%r)", frame)
+        logger.info(f"Bulletin from {frame.source}: {frame.info[1:]}")
 
     def on_aprs_status(self, frame=None):
         """APRS status packet (data type: >)
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_object(self, frame=None):
         """Object packet (data type: ;)
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_item(self, frame=None):
         """Object packet (data type: ))
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_query(self, frame=None):
         """APRS query packet (data type: ?)
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_capabilities(self, frame=None):
         """Station capabilities packet (data type: <)
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_position_wtr(self, frame=None):
@@ -314,7 +590,7 @@ class AprsClient:
         PP5JR-15>APNU3B,WIDE1-1,WIDE3-3:!2741.46S/04908.89W#PHG7460/REDE SUL APRS BOA VISTA RANCHO QUEIMADO SC
         PY5CTV-13>APTT4,PP5BAU-15*,PP5JRS-15*:! Weather Station ISS Davis Morro do Caratuva - PR
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_position_ts_msg(self, frame=None):
@@ -323,7 +599,7 @@ class AprsClient:
         eg.
         PP5JR-13>APRS,PP5JR-15*,PP5JRS-15*:@092248z2741.47S/04908.88W_098/011g014t057r000p000P000h60b07816.DsVP
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_position_msg(self, frame=None):
@@ -332,35 +608,35 @@ class AprsClient:
         eg.
         PY5TJ-12>APBK,PY5CTV-13*,WIDE1*,PP5JRS-15*:=2532.12S/04914.18WkTelemetria: 14.6v 25*C 56% U. Rel
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_position_ts(self, frame=None):
         """Position with timestamp, no APRS messaging (data type: /)
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_telemetry(self, frame=None):
         """Telemetry packet (data type: T)
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_mic_e(self, frame=None):
         """APRS Mic-E packet, current (data type: `)
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_old_mic_e(self, frame=None):
         """APRS Mic-E packet, old (data type: ')
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
 
     def on_aprs_others(self, frame=None):
         """All other APRS data types (possibly unknown)
         """
-        logger.debug(f"({frame=})")
+        logger.debug("(frame=%r)", frame)
         pass
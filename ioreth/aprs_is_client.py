@@ -16,76 +16,312 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
-import aprslib
 import time
 import logging
-import socket       # necessary for short term fix
 
-from .aprs_client import AprsClient
+from .stream_client import StreamClient
 from .ax25 import Frame
 
 logging.basicConfig()
 logger = logging.getLogger('iorethd.aprs_is_client')
 
-class AprsIsClient(AprsClient):
+
+class AprsIsServer:
+    """A server we may connect to and how well it has been doing."""
+
+    __slots__ = ('host', 'port', 'latency', 'failures', 'retry_at')
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = int(port)
+        # Smoothed time from login to logresp; None until measured.
+        self.latency = None
+        self.failures = 0
+        self.retry_at = 0
+
+    @staticmethod
+    def parse_list(servers: str, default_port=14580):
+        """Parse a comma separated list of 'host' or 'host:port'."""
+        lst = []
+        for item in servers.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            host, _, port = item.rpartition(':')
+            if not host or not port.isdigit():
+                # No port, or an IPv6 address without one.
+                host, port = item, default_port
+            lst.append(AprsIsServer(host.strip('[]'), port))
+        return lst
+
+    def record_login(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = (self.latency + latency) / 2
+        self.failures = 0
+        self.retry_at = 0
+
+    def record_failure(self, min_delay, max_delay):
+        """Keep away from this server for a while, longer the more it
+        fails in a row.
+        """
+        self.failures += 1
+        delay = min(max_delay, min_delay * 2 ** self.failures)
+        self.retry_at = time.monotonic() + delay
+
+    def is_healthy(self, now):
+        return self.retry_at <= now
+
+    def __repr__(self):
+        latency = 'unknown' if self.latency is None else f'{self.latency * 1000:.0f}ms'
+        return f"<AprsIsServer {self.host}:{self.port} latency={latency} failures={self.failures}>"
+
+
+class AprsIsClient(StreamClient):
+    """APRS-IS client: logs in, sends the filter and passes every received
+    packet line straight to Frame.from_aprs.
+
+    With several servers, each connection goes to the healthy one that
+    answered the login the fastest; servers not measured yet are tried
+    first and the ones that fail are avoided for a while.
+    """
+
+    PROTOCOL = "APRS-IS"
+    SOFTWARE = "Ioreth 0.1"
+    # Servers send a keepalive comment every 20s or so; if nothing at all
+    # arrives for this long the connection is considered dead.
+    IDLE_TIMEOUT = 120
+    LOGIN_TIMEOUT = 30
+    # Lines are at most 512 bytes, anything longer is garbage.
+    MAX_LINE = 4096
+    # Servers limit the length of the login line; keep the filter well
+    # below that, dropping the budlist entries that do not fit.
+    MAX_FILTER_LEN = 400
+    # Sessions lasting this long do not count as a server failure when
+    # they drop, so we go back to the same server.
+    STABLE_SESSION = 300
 
     def __init__(self, addr="rotate.aprs.net", port=14580):
         logger.debug(f'({addr=}, {port=})')
 
-        AprsClient.__init__(self)
-        self.addr = addr
-        self.port = int(port)
+        StreamClient.__init__(self, addr, port)
+        self.servers = [AprsIsServer(addr, port)]
+        self.server = None
+        self._login_sent = 0
+        self._login_done = 0
+        self.passcode = "-1"
         self.filter = ''
-        self._connection = None
-
-    def connect(self):
-        self._connection = aprslib.IS(self.callsign, passwd=self.passcode,
-                                      host=self.addr, port=self.port)
-        self._connection.set_filter(self.filter)
-        self._connection.connect()
-        #self._connection.consumer(self.on_recv, raw=True)
-        self.on_connect()
+        self.dynamic_filter = False
+        self.filter_interval = 30
+        self._buddies = ()
+        self._filter_sent = None
+        self._filter_last = 0
+        self._filter_timer = None
+        self.filter_updates = 0
+        self._inbuf = bytearray()
+        self._logged_in = False
+        self._last_rx = 0
+        self._watchdog = None
+        self._run = False
+        self.lines_received = 0
+        self.comments_received = 0
+        self.bad_lines = 0
 
+    def setServers(self, servers: str):
+        """Comma separated list of 'host[:port]' to choose from."""
+        lst = AprsIsServer.parse_list(servers, self.port)
+        if lst:
+            self.servers = lst
 
-    def disconnect(self):
-        if self._connection:
-            self._connection.close()
-            self.on_disconnect()
+    def select_server(self):
+        now = time.monotonic()
+        healthy = [s for s in self.servers if s.is_healthy(now)]
+        if not healthy:
+            return min(self.servers, key=lambda s: s.retry_at)
+        # min() keeps the configured order between equals.
+        return min(healthy, key=lambda s: s.latency or 0)
 
-    def is_connected(self):
-        return bool(self._connection)
-
-    def setCallsign(self, callsign: str):
-        self.callsign = callsign
+    def connect(self, timeout=10):
+        self.server = self.select_server()
+        self.addr = self.server.host
+        self.port = self.server.port
+        StreamClient.connect(self, timeout)
 
     def setPasscode(self, passcode: str):
         self.passcode = passcode
 
     def setFilter(self, filter: str):
+        """Set the static part of the server side filter, updating it on
+        the server if we are already logged in.
+        """
         self.filter = filter
+        self._update_filter()
 
-    def on_recv(self, aprslib_frame):
-        logger.debug(f'({aprslib_frame=})')
+    def setDynamicFilter(self, enabled: bool, interval: float = 30):
+        """Extend the filter with our own addressees (g/) and the stations
+        set with setBuddies() (b/), sending a new filter to the server
+        when they change, at most once every 'interval' seconds.
+        """
+        self.dynamic_filter = enabled
+        self.filter_interval = interval
+        self._update_filter()
 
-        frame = Frame.from_aprs(aprslib_frame['raw'].encode('ASCII'))
-        self.on_recv_frame(frame)
+    def setBuddies(self, calls):
+        """Stations whose packets we want to receive, e.g. the members of
+        the net.
+        """
+        self._buddies = tuple(sorted(set(calls)))
+        self._update_filter()
 
-    def on_loop_hook(self):
-        logger.debug('()')
+    def build_filter(self):
+        """The filter string for the current settings."""
+        parts = []
+        if self.filter:
+            parts.append(self.filter)
+        if self.dynamic_filter:
+            calls = [self.callsign]
+            calls += [a.strip() for a in self.aliases.split(',') if a.strip()]
+            parts.append('g/' + '/'.join(calls))
+            if self._buddies:
+                room = self.MAX_FILTER_LEN - len(' '.join(parts)) - 3
+                buddies = []
+                for call in self._buddies:
+                    room -= len(call) + 1
+                    if room < 0:
+                        logger.warning(f"APRS-IS filter too long, only {len(buddies)} "
+                                       f"of {len(self._buddies)} stations included")
+                        break
+                    buddies.append(call)
+                if buddies:
+                    parts.append('b/' + '/'.join(buddies))
+        return ' '.join(parts)
 
-        # short term fix untit aprslib gets patched
-        # ref: https://github.com/rossengeorgiev/aprs-python/pull/92
-        try:
-            self._connection.consumer(self.on_recv, blocking=False)
-        except socket.error as e:
-            if 'timed out' in str(e):
-                pass
-        except aprslib.exceptions.ConnectionDrop:
+    def _update_filter(self):
+        """Send the filter to the server if it changed since the last time,
+        but not more often than every filter_interval seconds.
+        """
+        if not self._logged_in or self._filter_timer:
+            return
+        new_filter = self.build_filter()
+        if new_filter == self._filter_sent:
+            return
+        wait = self._filter_last + self.filter_interval - time.monotonic()
+        if wait > 0:
+            self._filter_timer = self.reactor.call_later(wait, self._on_filter_timer)
+            return
+        logger.info(f"Updating APRS-IS filter: {new_filter}")
+        self.send_bytes(f"#filter {new_filter}\r\n".encode('ascii'))
+        self._filter_sent = new_filter
+        self._filter_last = time.monotonic()
+        self.filter_updates += 1
+
+    def _on_filter_timer(self):
+        self._filter_timer = None
+        self._update_filter()
+
+    def reset_stream(self):
+        self._inbuf.clear()
+        self._logged_in = False
+        self._filter_sent = None
+        if self._watchdog:
+            self._watchdog.cancel()
+            self._watchdog = None
+        if self._filter_timer:
+            self._filter_timer.cancel()
+            self._filter_timer = None
+
+    def is_connected(self):
+        return StreamClient.is_connected(self) and self._logged_in
+
+    def on_stream_connected(self):
+        login = f"user {self.callsign} pass {self.passcode} vers {self.SOFTWARE}"
+        self._filter_sent = self.build_filter()
+        self._filter_last = time.monotonic()
+        if self._filter_sent:
+            login += f" filter {self._filter_sent}"
+        logger.info(f"Logging in to {self.addr}:{self.port} as {self.callsign}")
+        # The login must precede anything left queued from the last session.
+        self.send_bytes((login + "\r\n").encode('ascii'), first=True)
+        self._last_rx = self._login_sent = time.monotonic()
+        self._login_done = 0
+        self._watchdog = self.reactor.call_later(self.LOGIN_TIMEOUT,
+                                                 self._check_alive)
+
+    def _check_alive(self):
+        self._watchdog = None
+        if not self._logged_in:
+            logger.warning("APRS-IS login timed out")
+            self.disconnect()
+            return
+        idle = time.monotonic() - self._last_rx
+        if idle > self.IDLE_TIMEOUT:
+            logger.warning(f"Nothing received from APRS-IS for {idle:.0f}s")
             self.disconnect()
-            self.connect()
+            return
+        self._watchdog = self.reactor.call_later(self.IDLE_TIMEOUT - idle,
+                                                 self._check_alive)
 
-        # if will_disconnect:
-        #     self.disconnect()
+    def on_server_comment(self, line):
+        """A '#' line from the server: banner, keepalive or login reply."""
+        if self._logged_in or not line.startswith(b"# logresp"):
+            return
+        # # logresp CALL verified, server T2FOO
+        lst = line.decode('ascii', errors='replace').split()
+        status = lst[3].rstrip(',') if len(lst) > 3 else ''
+        self._login_done = time.monotonic()
+        latency = self._login_done - self._login_sent
+        self.server.record_login(latency)
+        logger.info(f"APRS-IS login to {self.addr} in {latency * 1000:.0f}ms: "
+                    f"{' '.join(lst[2:])}")
+        if status != 'verified' and self.passcode != "-1":
+            logger.warning("APRS-IS passcode not accepted, receiving only")
+        self._logged_in = True
+        self.on_connect()
+        # Catch up with changes made while logging in.
+        self._update_filter()
+
+    def on_data(self, data):
+        self._last_rx = time.monotonic()
+        buf = self._inbuf
+        buf += data
+        pos = 0
+        while True:
+            eol = buf.find(b"\n", pos)
+            if eol < 0:
+                break
+            end = eol
+            if end > pos and buf[end - 1] == 0x0D:
+                end -= 1
+            if end > pos:
+                self.lines_received += 1
+                if buf[pos] == 0x23:
+                    # Keepalives and other server comments.
+                    self.comments_received += 1
+                    if not self._logged_in:
+                        self.on_server_comment(bytes(buf[pos:end]))
+                else:
+                    self.on_recv(bytes(buf[pos:end]))
+            pos = eol + 1
+            if not self._sock:
+                # Disconnected while handling a line.
+                return
+
+        del buf[:pos]
+        if len(buf) > self.MAX_LINE:
+            logger.warning("Discarding oversized APRS-IS line")
+            buf.clear()
+
+    def on_recv(self, line):
+        logger.debug('(%s)', line)
+
+        try:
+            frame = Frame.from_aprs(line)
+        except ValueError as exc:
+            self.bad_lines += 1
+            logger.debug(f"Discarding bad APRS-IS line: {exc}")
+            return
+        self.on_recv_frame(frame)
 
     def exit_loop(self):
         self._run = False
@@ -101,11 +337,29 @@ class AprsIsClient(AprsClient):
         if not self.is_connected():
             return
 
-        self._connection.sendall(frame.to_string())
+        self.send_bytes((frame.to_string() + "\r\n").encode('utf-8'))
 
     def on_connect(self):
         logger.info("APRS-IS connection connected")
+        StreamClient.on_connect(self)
+
+    def on_connect_failed(self):
+        self._server_failed()
+        StreamClient.on_connect_failed(self)
 
     def on_disconnect(self):
         logger.warning("APRS-IS connection disconnected! Will try again soon...")
+        if (not self._login_done
+                or time.monotonic() - self._login_done < self.STABLE_SESSION):
+            self._server_failed()
+        self._login_done = 0
+        StreamClient.on_disconnect(self)
 
+    def _server_failed(self):
+        if not self.server:
+            return
+        self.server.record_failure(self.reconnect_min, self.reconnect_max)
+        now = time.monotonic()
+        if any(s.is_healthy(now) for s in self.servers):
+            # Fail over right away instead of backing off.
+            self._reconnect_attempts = 0
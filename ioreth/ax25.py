@@ -17,6 +17,7 @@
 #
 
 import logging
+import re
 
 logging.basicConfig()
 logger = logging.getLogger('iorethd.ax25')
@@ -29,28 +30,99 @@ Random utilities for handling AX25 frames
 _ADDR_DIGIPEATED_BIT = 0b10000000
 _ADDR_END_OF_PATH_BIT = 1
 
+# What Address.from_string() accepts, for a whole "SOURCE>DEST,PATH" header.
+_ADDR_RE = r"[^>,*-]+(?:-[0-9]+)?\*?"
+_APRS_HEADER_RE = re.compile(rf"{_ADDR_RE}>{_ADDR_RE}(?:,{_ADDR_RE})*", re.ASCII)
+
 APRS_CONTROL_FLD = 0x03
 APRS_PROTOCOL_ID = 0xF0
 
 
 class Address:
+    """An AX.25 address (callsign, SSID and flags).
+
+    Addresses are immutable and interned: decoding the same 7 address
+    bytes or the same string again returns the very same object, so the
+    few hundred callsigns and path aliases seen on a channel are only
+    allocated once. Use replace() to get a variant with other flags.
+    """
+
+    __slots__ = ('callsign', 'ssid', 'digipeated', 'end_of_path', '_bytes',
+                 '_str')
+
+    # Maximum number of entries in each interning cache before it is reset.
+    CACHE_SIZE = 4096
+    _by_bytes = {}
+    _by_string = {}
+    _by_fields = {}
+
     def __init__(self, callsign, ssid=0, digipeated=False, end_of_path=False):
-        self.callsign = callsign
-        self.ssid = ssid
-        self.digipeated = digipeated
-        self.end_of_path = end_of_path
+        setattr_ = object.__setattr__
+        setattr_(self, 'callsign', callsign)
+        setattr_(self, 'ssid', ssid)
+        setattr_(self, 'digipeated', digipeated)
+        setattr_(self, 'end_of_path', end_of_path)
+        setattr_(self, '_bytes', None)
+        setattr_(self, '_str', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Address is immutable, use replace() to change {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError("Address is immutable")
+
+    @staticmethod
+    def _cache_put(cache, key, addr):
+        if len(cache) >= Address.CACHE_SIZE:
+            cache.clear()
+        cache[key] = addr
+        return addr
+
+    @staticmethod
+    def intern(callsign, ssid=0, digipeated=False, end_of_path=False):
+        """Return the shared Address with these fields."""
+        key = (callsign, ssid, digipeated, end_of_path)
+        addr = Address._by_fields.get(key)
+        if addr is None:
+            addr = Address._cache_put(Address._by_fields, key,
+                                      Address(callsign, ssid, digipeated,
+                                              end_of_path))
+        return addr
+
+    def replace(self, **changes):
+        """Return an Address like this one with some of the fields changed.
+        """
+        fields = {
+            'callsign': self.callsign,
+            'ssid': self.ssid,
+            'digipeated': self.digipeated,
+            'end_of_path': self.end_of_path,
+        }
+        fields.update(changes)
+        if (fields['callsign'] == self.callsign and fields['ssid'] == self.ssid
+                and fields['digipeated'] == self.digipeated
+                and fields['end_of_path'] == self.end_of_path):
+            return self
+        return Address.intern(**fields)
 
     @staticmethod
     def from_bytes(addr):
-        if len(addr) != 7:
+        key = bytes(addr)
+        cached = Address._by_bytes.get(key)
+        if cached is not None:
+            return cached
+
+        if len(key) != 7:
             raise ValueError("Bad AX25 address")
 
-        callsign = "".join(chr(n >> 1) for n in addr[0:6]).strip()
-        ssid = (addr[6] & 0b00011110) >> 1
-        digipeated = bool(addr[6] & _ADDR_DIGIPEATED_BIT)
-        end_of_path = bool(addr[6] & _ADDR_END_OF_PATH_BIT)
+        callsign = "".join(chr(n >> 1) for n in key[0:6]).strip()
+        ssid = (key[6] & 0b00011110) >> 1
+        digipeated = bool(key[6] & _ADDR_DIGIPEATED_BIT)
+        end_of_path = bool(key[6] & _ADDR_END_OF_PATH_BIT)
 
-        return Address(callsign, ssid, digipeated, end_of_path)
+        return Address._cache_put(
+            Address._by_bytes, key,
+            Address.intern(callsign, ssid, digipeated, end_of_path))
 
     @staticmethod
     def from_string(addr_str, end_of_path=False):
@@ -63,6 +135,11 @@ class Address:
             PP5ITT-10   -- Callsign with SSID;
             PP5ITT-10*  -- Digipeated callsign with SSID.
         """
+        key = (addr_str, end_of_path)
+        cached = Address._by_string.get(key)
+        if cached is not None:
+            return cached
+
         digipeated = False
         ssid = 0
         if addr_str[-1] == "*":
@@ -71,9 +148,14 @@ class Address:
         lst = addr_str.split("-", 1)
         if len(lst) == 2:
             ssid = int(lst[1])
-        return Address(lst[0], ssid, digipeated, end_of_path)
+        return Address._cache_put(
+            Address._by_string, key,
+            Address.intern(lst[0], ssid, digipeated, end_of_path))
 
     def to_bytes(self):
+        if self._bytes is not None:
+            return self._bytes
+
         # TODO APRS-IS connections do allow other SSIDs
         if self.ssid < 0 or self.ssid > 15:
             raise ValueError("Bad SSID %d" % self.ssid)
@@ -96,16 +178,33 @@ class Address:
         if self.end_of_path:
             lastb |= _ADDR_END_OF_PATH_BIT
         addr.append(lastb)
-        return bytes(addr)
+        object.__setattr__(self, '_bytes', bytes(addr))
+        return self._bytes
 
     def to_string(self):
+        if self._str is not None:
+            return self._str
         cs_pair = self.callsign
         if self.ssid != 0:
             cs_pair += f"-{self.ssid}"
         if self.digipeated:
             cs_pair += "*"
+        object.__setattr__(self, '_str', cs_pair)
         return cs_pair
 
+    def _key(self):
+        return (self.callsign, self.ssid, self.digipeated, self.end_of_path)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Address):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
     def __bytes__(self):
         return self.to_bytes()
 
@@ -116,67 +215,190 @@ class Address:
         return self.to_string()
 
 
+_RAW_KISS = 1
+_RAW_APRS = 2
+
+
 class Frame:
+    """An AX.25 frame.
+
+    Frames decoded with from_kiss_bytes() or from_aprs() are lazy: they
+    keep the received buffer and only decode the addresses and copy the
+    info field when these are first accessed. data_type and info_view
+    can be used to screen packets without materializing anything.
+
+    Message packets addressed to us get the parsed message.Message in
+    'message'.
+    """
+
+    __slots__ = ('_source', '_dest', '_path', 'control', 'pid', '_info',
+                 'via', 'connection', 'message', '_raw', '_raw_kind',
+                 '_hdr_end', '_info_start', '_template')
+
     def __init__(self, source, dest, path, control, pid, info, via=None):
-        logger.debug(f"({source=}, {dest=}, {path=}, {control=}, {pid=}, {info=}, {via=})")
-        self.source = source
-        self.dest = dest
-        self.path = path
+        logger.debug("(%r, %r, %r, %r, %r, %r, %r)",
+                     source, dest, path, control, pid, info, via)
+        self._raw = None
+        self._template = None
+        self._source = source
+        self._dest = dest
+        self._path = path
         self.control = control
         self.pid = pid
-        self.info = info
+        self._info = info
         self.via = via
         self.connection = None
+        self.message = None
+
+    @staticmethod
+    def _from_raw(raw, kind, hdr_end, info_start, control, pid):
+        f = Frame.__new__(Frame)
+        f._raw = raw
+        f._template = None
+        f._raw_kind = kind
+        f._hdr_end = hdr_end
+        f._info_start = info_start
+        f._source = None
+        f._dest = None
+        f._path = None
+        f._info = None
+        f.control = control
+        f.pid = pid
+        f.via = None
+        f.connection = None
+        f.message = None
+        return f
+
+    def _decode_addresses(self):
+        raw = self._raw
+        if self._raw_kind == _RAW_KISS:
+            view = memoryview(raw)
+            self._dest = Address.from_bytes(view[0:7])
+            self._source = Address.from_bytes(view[7:14])
+            self._path = [Address.from_bytes(view[pos : pos + 7])
+                          for pos in range(14, self._hdr_end, 7)]
+        else:
+            # Headers must be ASCII. Otherwhise is an error.
+            headers = raw[:self._hdr_end].decode("ascii", errors='ignore')
+            lst = headers.split(">", 1)
+            self._source = Address.from_string(lst[0])
+            addrs = [Address.from_string(s) for s in lst[1].split(",")]
+            self._dest = addrs[0]
+            self._path = addrs[1:]
+            self._update_end_of_path_flags()
+
+    @property
+    def source(self):
+        if self._source is None:
+            self._decode_addresses()
+        return self._source
+
+    @source.setter
+    def source(self, value):
+        if self._source is None:
+            self._decode_addresses()
+        self._template = None
+        self._source = value
+
+    @property
+    def dest(self):
+        if self._dest is None:
+            self._decode_addresses()
+        return self._dest
+
+    @dest.setter
+    def dest(self, value):
+        if self._dest is None:
+            self._decode_addresses()
+        self._template = None
+        self._dest = value
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._decode_addresses()
+        return self._path
+
+    @path.setter
+    def path(self, value):
+        if self._path is None:
+            self._decode_addresses()
+        self._template = None
+        self._path = value
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = self._raw[self._info_start:]
+        return self._info
+
+    @info.setter
+    def info(self, value):
+        self._info = value
+
+    @property
+    def info_view(self):
+        """The info field as a memoryview, without copying it."""
+        if self._info is not None:
+            return memoryview(self._info)
+        return memoryview(self._raw)[self._info_start:]
+
+    @property
+    def data_type(self):
+        """The APRS data type (first byte of the info field) or None if
+        there is no info field.
+        """
+        if self._info is not None:
+            return self._info[0] if self._info else None
+        if self._info_start < len(self._raw):
+            return self._raw[self._info_start]
+        return None
 
     @staticmethod
     def from_kiss_bytes(fdata):
-        pos = 0
         dlen = len(fdata)
         if dlen < 19:
             raise ValueError(
                 "Frame length is smaller than expected minimum. frame data: "
                 + fdata.hex()
             )
+        if type(fdata) is not bytes:
+            fdata = bytes(fdata)
 
-        dest = Address.from_bytes(fdata[0:7])
-        pos += 7
-
-        addr_list = []
+        # Find the end of the address list (destination, source and path)
+        # without decoding any of them.
+        pos = 7
         while pos < dlen - 7:
-            addr_list.append(Address.from_bytes(fdata[pos : pos + 7]))
             pos += 7
-            if addr_list[-1].end_of_path:
+            if fdata[pos - 1] & _ADDR_END_OF_PATH_BIT:
                 break
 
-        source = addr_list[0]
-        path = [ p for p in addr_list[1:] ]
-
         if pos >= dlen - 2:
             raise ValueError("Invalid frame data: " + fdata.hex())
 
-        control = fdata[pos]
-        pid = fdata[pos + 1]
-        info = fdata[pos + 2 :]
-
-        return Frame(source, dest, path, control, pid, info)
+        return Frame._from_raw(fdata, _RAW_KISS, pos, pos + 2, fdata[pos],
+                               fdata[pos + 1])
 
     def _update_end_of_path_flags(self):
         """Ensure "end of path" information is always valid.
         """
-        self.source.end_of_path = False
+        self.source = self.source.replace(end_of_path=False)
         if len(self.path) > 0:
-            self.dest.end_of_path = False
-            for p in self.path:
-                p.end_of_path = False
-            self.path[-1].end_of_path = True
+            self.dest = self.dest.replace(end_of_path=False)
+            last = len(self.path) - 1
+            if any(p.end_of_path != (i == last) for i, p in enumerate(self.path)):
+                self.path = [p.replace(end_of_path=(i == last))
+                             for i, p in enumerate(self.path)]
         else:
-            self.dest.end_of_path = True
+            self.dest = self.dest.replace(end_of_path=True)
 
     def to_kiss_bytes(self):
-        self._update_end_of_path_flags()
         via = ''
         if self.via:
             via = f"{self.via}>{self.via}:}}"
+        if self._template is not None:
+            return bytes(via, 'utf-8') + self._template.kiss_header + self.info
+        self._update_end_of_path_flags()
         return (
             bytes(via, 'utf-8')
             + self.dest.to_bytes()
@@ -192,32 +414,20 @@ class Frame:
         """
         # PP5ITT-7>APDR15,PP5JRS-15*,WIDE2-2,qAR,PU5BRA-10:=2628.97S/04906.81Wx Ittner
 
-        # Split the frame in headers and data
-        lst = raw_frame.split(b":", 1)
-        if len(lst) != 2:
+        # Find where headers end and data starts
+        if type(raw_frame) is not bytes:
+            raw_frame = bytes(raw_frame)
+        colon = raw_frame.find(b":")
+        if colon < 0:
             raise ValueError("Bad APRS frame string")
-
-        # Headers must be ASCII. Otherwhise is an error.
-        headers = lst[0].decode("ascii", errors='ignore')
-        info = lst[1]
-
-        lst = headers.split(">", 1)
-        if len(lst) != 2:
+        # The addresses are only decoded when used, but a frame that can
+        # not be decoded must fail here.
+        headers = raw_frame[:colon].decode("ascii", errors='ignore')
+        if not _APRS_HEADER_RE.fullmatch(headers):
             raise ValueError("Bad headers in APRS frame string")
 
-        source = Address.from_string(lst[0])
-        addrs = [Address.from_string(s) for s in lst[1].split(",")]
-        if len(addrs) == 0:
-            raise ValueError("No destination address in APRS frame string")
-
-        dest = addrs[0]
-        addrs[-1].end_of_path = True
-        path = addrs[1:]
-
-        f = Frame(source, dest, path, APRS_CONTROL_FLD, APRS_PROTOCOL_ID, info)
-        f._update_end_of_path_flags()
-        logger.debug(f'{f=}')
-        return f
+        return Frame._from_raw(raw_frame, _RAW_APRS, colon, colon + 1,
+                               APRS_CONTROL_FLD, APRS_PROTOCOL_ID)
 
     def to_aprs(self):
         """Convert the frame to a APRS byte array. Does not suport Mic-E yet.
@@ -248,16 +458,24 @@ class Frame:
         else:
             via = ''
 
+        if self._template is not None:
+            return (via + self._template.text_header + ":"
+                    + self.info.decode('utf-8', errors='backslashreplace'))
+
         buf = (
             via
-            + self.source.to_string()
-            + ">"
-            + self.dest.to_string()
+            + self.header_string()
+            + ":"
+            + self.info.decode('utf-8', errors='backslashreplace')
         )
+
+        return buf
+
+    def header_string(self):
+        """Render the addresses as in 'SOURCE>DEST,PATH'."""
+        buf = self.source.to_string() + ">" + self.dest.to_string()
         if len(self.path) > 0:
             buf += "," + ",".join(a.to_string() for a in self.path)
-        buf = buf + ":" + self.info.decode('utf-8', errors='backslashreplace')
-
         return buf
 
     # def pack_path(addr_strings):
@@ -289,3 +507,53 @@ class Frame:
 
     def __str__(self):
         return self.to_string()
+
+
+class FrameTemplate:
+    """Pre-encoded addresses for frames sharing source, destination and
+    path, like everything a connection sends. Frames made from a template
+    are encoded with a single concatenation.
+
+    The KISS header is only encoded when first needed, as APRS-IS
+    connections may use callsigns and SSIDs that AX.25 can not carry.
+    """
+
+    __slots__ = ('source', 'dest', 'path', 'control', 'pid', '_kiss_header',
+                 'text_header')
+
+    def __init__(self, source, dest, path, control=APRS_CONTROL_FLD,
+                 pid=APRS_PROTOCOL_ID):
+        proto = Frame(source, dest, list(path), control, pid, b"")
+        proto._update_end_of_path_flags()
+        self.source = proto.source
+        self.dest = proto.dest
+        self.path = tuple(proto.path)
+        self.control = control
+        self.pid = pid
+        self._kiss_header = None
+        self.text_header = proto.header_string()
+
+    @property
+    def kiss_header(self):
+        if self._kiss_header is None:
+            proto = Frame(self.source, self.dest, list(self.path), self.control,
+                          self.pid, b"")
+            self._kiss_header = proto.to_kiss_bytes()
+        return self._kiss_header
+
+    @staticmethod
+    def from_strings(source, dest, path):
+        """Make a template from address strings; 'path' is a comma
+        separated list and may be empty.
+        """
+        return FrameTemplate(
+            Address.from_string(source),
+            Address.from_string(dest),
+            [Address.from_string(p) for p in path.split(",") if p],
+        )
+
+    def make_frame(self, info, via=None):
+        f = Frame(self.source, self.dest, self.path, self.control, self.pid,
+                  info, via)
+        f._template = self
+        return f
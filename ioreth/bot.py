@@ -40,272 +40,547 @@
 import sys
 import time
 import logging
-import configparser
 import os
-import re
-import random
+import hashlib
+import importlib
+import importlib.util
+import json
+import threading
 
 logging.basicConfig()
 logger = logging.getLogger('iorethd.bot')
 
-from cronex import CronExpression
 from .ax25 import Frame
-from .tcp_kiss_client import TcpKissClient
-from .aprs_is_client import AprsIsClient
+from .aprs_client import PacketSubscribers
+from .txsched import PRIO_FANOUT, PRIO_BULLETIN
+from .reactor import Reactor
+from .dupefilter import DupeFilter
+from .config import ConfigSnapshot, ConfigView, ConfigError
+from .watcher import ConfigWatcher, DirectoryWatcher
+from .bulletins import BulletinSchedule
+from .fanout import FanOut, NetMessage
+from .router import CommandRouter, CommandPool, DEFERRED
 from . import remotecmd
-from . import utils
 from glob import glob
-from importlib import import_module
+
+
+# Connection types and the classes handling them, imported only when a
+# connection of that type is configured.
+CONNECTION_CLASSES = {
+    'kiss': ('.tcp_kiss_client', 'TcpKissClient'),
+    'aprs-is': ('.aprs_is_client', 'AprsIsClient'),
+}
+
+# What the plugin manifest keeps of the registration of each command.
+MANIFEST_KEYS = ('command', 'help', 'alias', 'aliases', 'threaded', 'timeout')
+
+
+class _Plugin:
+    """A command_dir module and what it registered."""
+
+    __slots__ = ('name', 'module', 'digest', 'sections', 'callbacks', 'infos',
+                 'loaded', 'removers')
+
+    def __init__(self, name, module, digest, sections, callbacks, infos,
+                 loaded=True):
+        self.name = name
+        # A _LazyPlugin until the module is actually loaded.
+        self.module = module
+        # Of the source, to tell a real change from a touch.
+        self.digest = digest
+        # Config sections read by register(), with digests of their values.
+        self.sections = sections
+        self.callbacks = callbacks
+        self.infos = infos
+        self.loaded = loaded
+        # Remove the net member listeners added by the plugin.
+        self.removers = []
+
+    def manifest_entry(self):
+        return {
+            'digest': self.digest,
+            'sections': self.sections,
+            'eager': any('command' not in info for info in self.infos),
+            'commands': [{k: info[k] for k in MANIFEST_KEYS if k in info}
+                         for info in self.infos if 'command' in info],
+        }
+
+
+class _LazyPlugin:
+    """Stands for a plugin known from the manifest until one of its
+    commands is used, when the module is loaded and replaces it.
+    """
+
+    def __init__(self, bot, name):
+        self.bot = bot
+        self.name = name
+
+    def invoke(self, msg):
+        bot = self.bot
+        try:
+            bot.load_plugin(self.name)
+        except Exception as exc:
+            logger.error(f"Loading plugin {self.name} failed: {exc!r}")
+            bot._unregister_plugin(self.name)
+            return None
+        return bot.commands.dispatch(msg, bot.on_deferred_reply)
 
 
 class ReplyBot:
+    # Seconds to wait before writing a changed plugin manifest.
+    MANIFEST_SAVE_DELAY = 1
+    # Seconds before running a periodic task again after it failed.
+    PERIODIC_RETRY_DELAY = 60
+
     def __init__(self, config_file):
         logger.debug(f"({config_file})")
         self._config_file = config_file
-        self._last_config_load = None
         self._handlers = dict()
-        self.config = configparser.ConfigParser()
-        self.config.optionxform = str # config values are case sensitive
-        self.check_updated_config()
+        self._connected = False
+        # Loaded plugins by module name.
+        self._plugins = dict()
+        self._command_dir = None
+        self._manifest_timer = None
+        self.plugin_watcher = None
+        self.reactor = Reactor()
+        self.dupe_filter = DupeFilter()
+        self.command_pool = CommandPool(self.reactor)
+        self.commands = CommandRouter(self.command_pool)
+        self.bulletins = BulletinSchedule()
+        self.fanout = FanOut(self.reactor, self._handlers)
+        # A bad file is fatal now, but only logged on later reloads.
+        self.config = None
+        self.apply_config(ConfigSnapshot.load(config_file))
+        self.config_watcher = ConfigWatcher(config_file, self.reactor,
+                                            self.reload_config)
 
         # enable Sentry error capturing if DSN is specified
-        if self.config.get('bot', 'sentry_dsn'):
-            import sentry_sdk
-            sentry_sdk.init(dsn=self.config.get('bot', 'sentry_dsn'))
+        if self.config.bot.sentry_dsn:
+            self._start_sentry(self.config.bot.sentry_dsn)
 
         #self.aprs = BotAprsHandler(self._cfg.get('aprs', 'callsign'), self)
-        self._last_blns = time.monotonic()
-        self._last_cron_blns = 0
         self._last_status = time.monotonic()
-        self._last_reconnect_attempt = 0
-        self.remote_cmd = remotecmd.RemoteCommandHandler()
+        bot_config = self.config.bot
+        self.remote_cmd = remotecmd.RemoteCommandHandler(
+            workers=bot_config.remote_workers,
+            preload=bot_config.remote_preload,
+            timeout=bot_config.remote_timeout,
+            reactor=self.reactor,
+            callback=self.on_remote_command_result,
+        )
 
         # setup logs
         #self.netlog = BotLog(f"{self.config['files']['netlog']}-{time.strftime('%Y%m%d')}")
         #self.netmsg = BotLog(f"{self.config['files']['netmsg']}")
 
         # discover additional commands added to command_dir directory
-        self._extra_commands = dict()
-        self.register_commands(self.config.get('bot', 'command_dir'))
-
-
-    def load_config(self):
+        self.register_builtin_commands()
+        self._net_members = dict()
+        self.packet_subscribers = PacketSubscribers()
+        self.register_commands(self.config.bot.command_dir)
+
+    def reload_config(self):
+        """The configuration file changed: load it again and apply what
+        is different. A file with errors is ignored and the current
+        configuration kept.
+        """
         logger.debug(f"()")
         try:
-            self.config.clear()
-            logger.debug(f'reading configuration from {self._config_file}')
-            self.config.read(self._config_file)
+            config = ConfigSnapshot.load(self._config_file)
+        except ConfigError as exc:
+            logger.error(f"Keeping the current configuration: {exc}")
+            return
+        self.apply_config(config)
+        logger.info("Configuration reloaded")
 
-            # reset when the config was loaded
-            self._last_config_load = self._config_mtime()
+    def apply_config(self, config):
+        """Switch to the ConfigSnapshot 'config', rebuilding only the
+        connections, plugins and bulletin schedule whose sections changed.
+        """
+        old, self.config = self.config, config
+        changed = set(config.sections()) if old is None else config.changed_sections(old)
+        logger.debug(f"changed sections: {sorted(changed)}")
+
+        bot_config = config.bot
+        self.dupe_filter.window = bot_config.dupe_window
+        self.dupe_filter.retry_window = bot_config.dupe_retry_window
+        pool = self.command_pool
+        pool.workers = bot_config.command_workers
+        pool.timeout = bot_config.command_timeout
+        pool.max_pending = bot_config.command_queue
+        self.fanout.batch = bot_config.fanout_batch
+        self.fanout.interval = bot_config.fanout_interval
+        self.fanout.unreachable_for = bot_config.fanout_unreachable
+
+        if 'bulletins' in changed:
+            self.bulletins.configure(config.bulletins)
+
+        if self._connected:
+            for name in [s[5:] for s in changed if s.startswith('conn.')]:
+                conn = self._handlers.pop(name, None)
+                if conn is not None:
+                    logger.info(f"Stopping connection {name}")
+                    conn.stop()
+                if name in config.connections:
+                    logger.info(f"Starting connection {name}")
+                    self._start_connection(config.connections[name])
+
+        if old is not None:
+            for plugin in list(self._plugins.values()):
+                if plugin.sections.keys() & changed:
+                    logger.info(f"Registering {plugin.name} again")
+                    try:
+                        if plugin.loaded:
+                            self._register_plugin(plugin.name, plugin.module,
+                                                  plugin.digest)
+                        else:
+                            self.load_plugin(plugin.name)
+                    except Exception as exc:
+                        logger.error(f"Registering {plugin.name} failed: {exc}")
+            self.commands.invalidate_help()
+
+    def _start_sentry(self, dsn):
+        """Set up Sentry error capturing in the background: importing
+        sentry_sdk takes a while and should not delay the connections.
+        Errors in the first moments may be missed.
+        """
+        def init():
+            try:
+                import sentry_sdk
+                sentry_sdk.init(dsn=dsn)
+            except Exception as exc:
+                logger.error(f"Can not start Sentry: {exc!r}")
+        threading.Thread(target=init, name='sentry-init', daemon=True).start()
+
+    def _start_connection(self, cc):
+        """Create and start the connection described by a ConnectionConfig."""
+        module, class_name = CONNECTION_CLASSES[cc.type]
+        conn = getattr(importlib.import_module(module, __package__), class_name)(
+            cc.host, cc.port)
+        if cc.type == 'aprs-is':
+            conn.setPasscode(cc.passcode)
+            if cc.servers:
+                conn.setServers(cc.servers)
+            if cc.filter is not None:
+                conn.setFilter(cc.filter)
+            conn.setDynamicFilter(cc.dynamic_filter, cc.filter_interval)
+            conn.setBuddies(self.net_members())
+        conn.conn_name = cc.name
+        conn.setCallsign(cc.callsign)
+        conn.setDestination(cc.destination)
+        conn.setPath(cc.path)
+        conn.setAliases(cc.aliases)
+        conn.setBulletinGroups(cc.bulletin_groups)
+        conn.setHandler(self)
+        conn.setReactor(self.reactor)
+        conn.setPacketSubscribers(self.packet_subscribers)
+        conn.setDupeFilter(self.dupe_filter)
+        conn.setReconnect(cc.reconnect_min, cc.reconnect_max)
+        conn.setMessageRetries(cc.msg_retries, cc.msg_retry_delay)
+        conn.setTxPacing(cc.tx_rate, cc.tx_burst, cc.tx_queue)
+        conn.start()
+        self._handlers[cc.name] = conn
+        return conn
 
-        except Exception as exc:
-            logger.error(exc)
+    def connect(self):
+        logger.debug('()')
+        self._connected = True
+        for cc in self.config.connections.values():
+            self._start_connection(cc)
 
-    def check_updated_config(self):
-        logger.debug(f"()")
-        try:
-            if self._last_config_load != self._config_mtime():
-                self.load_config()
-                logger.info("Configuration reloaded")
-        except Exception as exc:
-            logger.error(exc)
+    def register_commands(self, cmd_dir: str):
+        """Import every module in cmd_dir and call its register(config).
+        It returns a list of dicts, either describing a command:
 
-    def _config_mtime(self) -> int:
-        return os.stat(self._config_file).st_mtime
+            {'command': 'cq', 'help': '...', 'aliases': ['c']}
 
-    def connect(self):
-        logger.debug('()')
-        for sect in [s for s in self.config.sections() if re.match(r'conn\.', s)]:
-            conn_name = sect.replace('conn.', '')
-            conn_def = dict(self.config.items(sect))
-
-            if conn_def['type'] == 'kiss':
-                conn = TcpKissClient(conn_def['host'], conn_def['port'])
-                conn.conn_name = conn_name
-                conn.setCallsign(conn_def['callsign'])
-                conn.setDestination(conn_def['destination'])
-                conn.setPath(conn_def['path'])
-                conn.setHandler(self)
-                conn.connect()
-            elif conn_def['type'] == 'aprs-is':
-                conn = AprsIsClient(conn_def['host'], conn_def['port'])
-                conn.conn_name = conn_name
-                conn.setCallsign(conn_def['callsign'])
-                conn.setPasscode(conn_def['passcode'])
-                conn.setDestination(conn_def['destination'])
-                conn.setPath(conn_def['path'])
-                if 'filter' in conn_def:
-                    conn.setFilter(conn_def['filter'])
-                conn.setHandler(self)
-                conn.connect()
-            else:
-                logger.error(f"{sect} has an invalid type: ignoring connection")
-                next
+        that is handled by the module's invoke(msg), where msg is the
+        received message.Message (msg.command, msg.args, msg.source,
+        msg.connection, msg.frame...). Commands that may block, and only
+        return a reply, can add 'threaded': True to run in the command
+        pool, optionally with their own 'timeout' in seconds. Or asking
+        for received packets of some APRS data types:
 
-            self._handlers[conn_name] = conn
+            {'packets': '!=/@', 'callback': on_position}
 
+        where callback(frame) is called for every such packet, or offering
+        the callsigns of the stations in a net:
 
-    def register_commands(self, cmd_dir: str):
+            {'members': add_listener}
+
+        where add_listener(callback) must call callback(callsigns) now and
+        every time the members change. It may return a function removing
+        the listener, called when the module is registered again.
+
+        The config given to register() always reads the current
+        configuration; when a section the module read during register()
+        changes, the module is registered again. Modules are also loaded
+        again, and registered again, when their file changes.
+
+        What each module registers is kept in a manifest. Modules that
+        only register commands, and did not change since (nor did the
+        config sections they read), are not imported at startup: their
+        commands are taken from the manifest and the module is loaded when
+        one of them is first used.
+        """
         logger.debug(f"({cmd_dir})")
         sys.path.append(cmd_dir)
+        self._command_dir = cmd_dir
+        manifest = self._read_manifest()
 
         logger.info(f"Registering external commands from {cmd_dir}")
         for cmd_file in glob(f"{cmd_dir}/*.py"):
             base_file = os.path.basename(os.path.splitext(cmd_file)[0])
             try:
                 logger.debug(f'Registering {base_file}')
-                mod = import_module(base_file)
-                if hasattr(mod, 'logger'):
-                    mod.logger.level = logger.level
-                infos = mod.register(self.config)
-
-                for info in infos:
-                    logger.info(f"Registered command: {info['command']}")
-                    info['module'] = mod
-                    self._extra_commands[info['command']] = info
-                    if 'alias' in info:
-                        for also in info['alias']:
-                            self._extra_commands[also] = info
+                entry = manifest.get(base_file)
+                if entry and self._can_defer(base_file, entry):
+                    self._register_lazy(base_file, entry)
+                else:
+                    self.load_plugin(base_file)
 
             except Exception as e:
                 logger.error(e)
                 if logger.level == logging.DEBUG:
                     raise e
 
-    def update_bulletins(self):
-        logger.debug('()')
-        if not self.config.has_section("bulletins"):
-            return
+        self.plugin_watcher = DirectoryWatcher(cmd_dir, self.reactor,
+                                               self.on_plugins_changed, '*.py')
 
-        max_age = self.config.getint("bulletins", "send_freq", fallback=600)
+    def _manifest_path(self):
+        return (self.config.bot.plugin_manifest
+                or os.path.join(self._command_dir, '.manifest.json'))
 
-        # There are two different time bases here: simple bulletins are based
-        # on intervals, so we can use monotonic timers to prevent any crazy
-        # behavior if the clock is adjusted and start them at arbitrary moments
-        # so we don't need to worry about transmissions being concentrated at
-        # some magic moments. Rule-based blns are based on wall-clock time, so
-        # we must ensure they are checked exactly once a minute, behaves
-        # correctly when the clock is adjusted, and distribute the transmission
-        # times to prevent packet storms at the start of minute.
-
-        now_mono = time.monotonic()
-        now_time = time.time()
-
-        # Optimization: return ASAP if nothing to do.
-        if (now_mono <= (self._last_blns + max_age)) and (
-            now_time <= (self._last_cron_blns + 60)
-        ):
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path()) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exc:
+            logger.warning(f"Ignoring the plugin manifest: {exc}")
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def _save_manifest_later(self):
+        if self._manifest_timer is None:
+            self._manifest_timer = self.reactor.call_later(
+                self.MANIFEST_SAVE_DELAY, self._save_manifest)
+
+    def _save_manifest(self):
+        self._manifest_timer = None
+        path = self._manifest_path()
+        manifest = {name: plugin.manifest_entry()
+                    for name, plugin in sorted(self._plugins.items())}
+        try:
+            with open(f"{path}.tmp", 'w') as f:
+                json.dump(manifest, f, indent=1)
+            os.replace(f"{path}.tmp", path)
+        except (OSError, TypeError, ValueError) as exc:
+            logger.warning(f"Can not save the plugin manifest {path}: {exc}")
+
+    def _source_digest(self, name):
+        path = os.path.join(self._command_dir, f"{name}.py")
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def _section_digest(self, section):
+        if section not in self.config:
+            return ''
+        items = sorted(self.config[section].items())
+        return hashlib.sha256(repr(items).encode()).hexdigest()
+
+    def _can_defer(self, name, entry):
+        """Whether the manifest entry still describes plugin 'name'."""
+        try:
+            return (not entry['eager']
+                    and entry['digest'] == self._source_digest(name)
+                    and all(self._section_digest(s) == d
+                            for s, d in entry['sections'].items()))
+        except (KeyError, AttributeError, TypeError):
+            return False
+
+    def _register_lazy(self, name, entry):
+        """Register the commands of plugin 'name' from its manifest entry,
+        to load the module on first use.
+        """
+        stub = _LazyPlugin(self, name)
+        infos = entry['commands']
+        self._plugins[name] = _Plugin(name, stub, entry['digest'],
+                                      entry['sections'], [], infos, loaded=False)
+        for info in infos:
+            logger.info(f"Registered command: {info['command']} (not loaded)")
+            # The stub loads the module, so it must run in the event loop.
+            self.commands.register_info(dict(info, threaded=False), stub)
+
+    def load_plugin(self, name):
+        """Import command_dir/name.py and register it, replacing what a
+        previous version registered. The module is only imported again if
+        its source changed. Nothing changes if it fails to import or to
+        register. Returns whether it was (re)loaded.
+        """
+        path = os.path.join(self._command_dir, f"{name}.py")
+        digest = self._source_digest(name)
+        plugin = self._plugins.get(name)
+        if plugin is not None and plugin.loaded and plugin.digest == digest:
+            return False
+
+        # A fresh module object, only made visible once it works, so a
+        # broken version does not replace a working one.
+        spec = importlib.util.spec_from_file_location(name, path)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        if hasattr(mod, 'logger'):
+            mod.logger.level = logger.level
+        self._register_plugin(name, mod, digest)
+        sys.modules[name] = mod
+        return True
+
+    def on_plugins_changed(self, files):
+        """Files in command_dir were changed, added or removed. Runs from
+        the event loop, so the commands are swapped between two packets.
+        """
+        logger.debug(f"({files=})")
+        for cmd_file in sorted(files):
+            name = os.path.splitext(cmd_file)[0]
+            if not os.path.exists(os.path.join(self._command_dir, cmd_file)):
+                if name in self._plugins:
+                    logger.info(f"Plugin {name} removed")
+                    self._unregister_plugin(name)
+                    self._save_manifest_later()
+                    sys.modules.pop(name, None)
+                    if name in self._net_members:
+                        self.on_net_members(name, ())
+                continue
+            known = name in self._plugins
+            try:
+                if self.load_plugin(name):
+                    logger.info(f"Plugin {name} {'reloaded' if known else 'loaded'}")
+            except Exception as exc:
+                if known:
+                    logger.error(f"Reloading plugin {name} failed, keeping "
+                                 f"the previous version: {exc!r}")
+                else:
+                    logger.error(f"Loading plugin {name} failed: {exc!r}")
+
+    def _unregister_plugin(self, name):
+        plugin = self._plugins.pop(name, None)
+        if plugin is None:
             return
+        self.commands.unregister_module(plugin.module)
+        for callback in plugin.callbacks:
+            self.packet_subscribers.unsubscribe(callback)
+        for remove in plugin.removers:
+            remove()
+
+    def _register_plugin(self, name, mod, digest=None):
+        """Call the register() of plugin module 'mod' and, if that works,
+        replace whatever the plugin 'name' registered before.
+        """
+        view = ConfigView(lambda: self.config)
+        view.recording = True
+        try:
+            infos = list(mod.register(view) or [])
+        finally:
+            view.recording = False
+        for info in infos:
+            if 'packets' in info:
+                ok = callable(info.get('callback'))
+            elif 'members' in info:
+                ok = callable(info['members'])
+            else:
+                ok = 'command' in info and hasattr(mod, 'invoke')
+            if not ok:
+                raise ValueError(f"Bad registration from {name}: {info!r}")
+
+        self._unregister_plugin(name)
+        callbacks = []
+        sections = {s: self._section_digest(s) for s in view.sections_read}
+        plugin = _Plugin(name, mod, digest, sections, callbacks, infos)
+        self._plugins[name] = plugin
+        self._save_manifest_later()
+        for info in infos:
+            if 'packets' in info:
+                logger.info(f"Registered packet types: {info['packets']}")
+                self.packet_subscribers.subscribe(info['packets'],
+                                                  info['callback'])
+                callbacks.append(info['callback'])
+                continue
+            if 'members' in info:
+                logger.info(f"Registered net members from {name}")
+                remove = info['members'](lambda calls, name=name:
+                                         self.on_net_members(name, calls))
+                if callable(remove):
+                    plugin.removers.append(remove)
+                continue
+            logger.info(f"Registered command: {info['command']}")
+            self.commands.register_info(info, mod)
+
+    def net_members(self):
+        """Callsigns of the stations in all the nets."""
+        members = set()
+        for calls in self._net_members.values():
+            members.update(calls)
+        return members
+
+    def on_net_members(self, name, calls):
+        """Members of the net kept by module 'name' changed. The APRS-IS
+        server filters are updated to pass their packets.
+        """
+        logger.debug(f"({name=}, {len(calls)=})")
+        self._net_members[name] = frozenset(calls)
+        members = self.net_members()
+        for conn in self._handlers.values():
+            if hasattr(conn, 'setBuddies'):
+                conn.setBuddies(members)
 
-        bln_map = dict()
-
-        # Find all standard (non rule-based) bulletins.
-        keys = self.config.options("bulletins")
-        keys.sort()
-        std_blns = [
-            k for k in keys if k.startswith("BLN") and len(k) > 3 and "_" not in k
-        ]
-
-        # Do not run if time was not set yet (e.g. Raspberry Pis getting their
-        # time from NTP but before conecting to the network)
-        time_was_set = time.gmtime().tm_year > 2000
-
-        # Map all matching rule-based bulletins.
-        if time_was_set and now_time > (self._last_cron_blns + 60):
-            # Randomize the delay until next check to prevent packet storms
-            # in the first seconds following a minute. It will, of course,
-            # still run within the minute.
-            timestr = time.strftime("%Y%m%d")
-            timestrtxt = time.strftime("%m%d")
-            filename1 = "/home/pi/ioreth/ioreth/ioreth/netlog-"+timestr
-
-            self._last_cron_blns = 60 * int(now_time / 60.0) + random.randint(0, 30)
-
-            cur_time = time.localtime()
-            utc_offset = cur_time.tm_gmtoff / 3600  # UTC offset in hours
-            ref_time = cur_time[:5]  # (Y, M, D, hour, min)
-
-            for k in keys:
-                # if key is "BLNx_rule_x", etc.
-                lst = k.split("_", 3)
-                if (
-                    len(lst) == 3
-                    and lst[0].startswith("BLN")
-                    and lst[1] == "rule"
-                    and (lst[0] not in std_blns)
-                ):
-                    expr = CronExpression(self.config.get("bulletins", k))
-                    if expr.check_trigger(ref_time, utc_offset):
-                        bln_map[lst[0]] = expr.comment
-
-        # If we need to send standard bulletins now, copy them to the map.
-        if now_mono > (self._last_blns + max_age):
-            self._last_blns = now_mono
-            for k in std_blns:
-                bln_map[k] = self.config.get("bulletins", k)
-
-        if len(bln_map) > 0:
-            to_send = [(k, v) for k, v in bln_map.items()]
-            to_send.sort()
-            for (bln, text) in to_send:
-                for (name, conn) in self._handlers.items():
-                    logger.info(f"Posting bulletin: {bln}='{text}' to {name}")
-                    conn.send_aprs_msg(bln, text)
+    def update_bulletins(self):
+        """Send any bulletins that are due. Returns the number of seconds
+        until the next bulletin may be due.
+        """
+        logger.debug('()')
+        for (bln, text) in self.bulletins.due():
+            for (name, conn) in self._handlers.items():
+                logger.info(f"Posting bulletin: {bln}='{text}' to {name}")
+                conn.send_aprs_msg(bln, text, priority=PRIO_BULLETIN)
+        return self.bulletins.next_delay()
 
     def update_status(self):
+        """Returns the number of seconds until the next status is due."""
         logger.debug('()')
-        if not self.config.has_section("status"):
-            return
+        if self.config.status is None:
+            return 60
 
-        max_age = self.config.getint("status", "send_freq", fallback=600)
+        max_age = self.config.status.send_freq
         now_mono = time.monotonic()
         if now_mono < (self._last_status + max_age):
-            return
+            return self._last_status + max_age - now_mono
 
         self._last_status = now_mono
         #self.remote_cmd.post_cmd(SystemStatusCommand(self._cfg))
+        return max_age
 
-    def check_reconnection(self):
-        logger.debug('()')
-        if self.is_connected():
-            return
-        try:
-            # Server is in localhost, no need for a fancy exponential backoff.
-            if time.monotonic() > self._last_reconnect_attempt + 5:
-                logger.info("Trying to reconnect")
-                self._last_reconnect_attempt = time.monotonic()
-                self.connect()
-        except ConnectionRefusedError as e:
-            logger.warning(e)
+    def _run_periodic(self, func):
+        """Run 'func' now and then again after the number of seconds it
+        returns, forever. If it fails it is run again after
+        PERIODIC_RETRY_DELAY seconds.
+        """
+        def run():
+            delay = self.PERIODIC_RETRY_DELAY
+            try:
+                delay = func()
+            finally:
+                self.reactor.call_later(delay, run)
+        self.reactor.call_later(0, run)
 
     def start(self):
-        logger.debug('()')
-        while True:
-            logger.debug('Starting event loop')
-            #AprsClient.on_loop_hook(self)
-            self.check_updated_config()
-            #self.check_reconnection()
-            self.update_bulletins()
-            #self.update_status()
-
-            # Poll results from external commands, if any.
-            while True:
-                rcmd = self.remote_cmd.poll_ret()
-                if not rcmd:
-                    break
-                self.on_remote_command_result(rcmd)
-
-            for (name, conn) in self._handlers.items():
-                try:
-                    logger.debug(f'Calling connection {name} event loop')
-                    conn.on_loop_hook()
-                    logger.debug('Event loop returned')
-                except Exception as e:
-                    logger.error(f"Connection error on {name}: {e}")
-                    raise e
-
-            time.sleep(1);
+        logger.debug('Starting event loop')
+        self.config_watcher.start()
+        if self.plugin_watcher:
+            self.plugin_watcher.start()
+        self._run_periodic(self.update_bulletins)
+        #self._run_periodic(self.update_status)
+        self.reactor.run_forever()
 
     def on_remote_command_result(self, cmd):
         logger.debug(f"({cmd})")
@@ -315,22 +590,47 @@ class ReplyBot:
             logger.info(f"{cmd.status_str=}")
             self.aprs.send_aprs_status(cmd.status_str)
 
-    def on_message(self, frame):
-        logger.debug(f'({frame=})')
-        reply = self.process_internal_commands(frame)
+    def on_message(self, msg):
+        logger.debug(f'({msg=})')
 
-        if reply is None:
-            reply = self.process_external_commands(frame)
+        if '\x00' in msg.args or '<0x' in msg.args:
+            logger.info("Message contains null character from APRS looping issue. Stop processing." )
+            return []
+        self.fanout.heard(msg.source, msg.msgid is not None)
+
+        reply = self.commands.dispatch(msg, self.on_deferred_reply)
+        if reply is DEFERRED:
+            # Running in the command pool, on_deferred_reply() answers.
+            return []
+        return self._route_reply(reply)
+
+    def on_deferred_reply(self, msg, reply):
+        """A command that ran in the command pool finished (or timed out).
+        Called from the event loop.
+        """
+        logger.debug(f'({msg=}, {reply=})')
+        conn = self._handlers.get(msg.connection)
+        if conn is None:
+            logger.warning(f"No connection {msg.connection} to reply to {msg.source}")
+            return
+        conn.reply(msg, self._route_reply(reply))
 
+    def _route_reply(self, reply):
+        """Send the frames in a command reply through their connections,
+        hand its NetMessages to the fan-out and return the texts for the
+        sender.
+        """
         if reply is None:
             # send help message
             reply = "Message not understood, please send 'help' for info."
 
         new_mesgs = [f for f in reply if type(f) == Frame]
-        for msg in new_mesgs:
+        for notif in new_mesgs:
             # send the msg out the approriate connection
-            logger.info(f'sending to {msg.dest}: {msg.info}')
-            self._handlers[msg.connection].write_frame(msg)
+            logger.info(f'sending to {notif.dest}: {notif.info}')
+            self._handlers[notif.connection].enqueue_frame(notif, PRIO_FANOUT)
+        for net_msg in [m for m in reply if isinstance(m, NetMessage)]:
+            self.fanout.submit(net_msg)
 
         # return the replies to just the originating station
         if type(reply) == str:
@@ -338,80 +638,48 @@ class ReplyBot:
         else:
             return [f for f in reply if type(f) == str]
 
-    def process_internal_commands(self, frame):
-        """We got an text message direct to us. Handle it as a bot query.
-        TODO: Make this a generic thing.
-
-        source: the sender's callsign+SSID
-        text: message text.
+    def register_builtin_commands(self):
+        """Commands handled by the bot itself. They go through the same
+        router as the plugins.
         """
-
-        addressee, cmd, args = self._unpack_message(frame)
-        timestrtxt = time.strftime("%m%d %H%MZ")
-
-        if '\x00' in args or '<0x' in args :
-            logger.info("Message contains null character from APRS looping issue. Stop processing." )
-            return
-
-        # # TODO Update for bot name
-        # if sourcetrunc == "APRSPH" or sourcetrunc == "ANSRVR" or sourcetrunc == "ID1OT" or sourcetrunc == "WLNK-1" or sourcetrunc == "KP4ASD" or qry[0:3] == "rej" or qry[0:3] == "aa:" or args == "may be unattended" or args =="QTH Digi heard you!" or qry == "aa:message" :
-        #     logger.info("Message from ignore list. Stop processing." )
-        #     return
-
-        if cmd == 'ping':
-            logger.info(f"Handling PING from {frame.source}")
-            return timestrtxt + ":Pong! " + args
-        elif cmd == 'test':
-#                  1234567890123456789012345678901234567890123456789012345678901234567
-            return timestrtxt + ":It works! HELP for more commands."
-        # elif qry == "?aprst" or qry == "?ping?" or qry == "aprst?" or qry == "aprst" :
-        #     tmp_lst = (
-        #         origframe.to_aprs_string()
-        #         .decode("utf-8", errors="replace")
-        #         .split("::", 2)
-        #     )
-        #     self.send_aprs_msg(sourcetrunc, tmp_lst[0] + ":")
-        # elif qry == "version":
-        #     self.send_aprs_msg(sourcetrunc, "Python " + sys.version.replace("\n", " "))
-        elif cmd == 'about':
-            return "APRS bot by WT0F based on ioreth by N2RAC/DU2XXR."
-        elif cmd == 'time':
-            return f"Localtime is {time.strftime("%Y-%m-%d %H:%M:%S %Z")}"
-        elif cmd in ('help', '?'):
-            help_text = [
-                'ABOUT: Send info about this bot',
-                'TIME: Send the current local time',
-                'PING: Ping the bot and receive back a pong'
-            ]
-
-            # gather help lines from commands
-            for name in self._extra_commands.keys():
-                if 'help' in self._extra_commands[name]:
-                    help_text.append(self._extra_commands[name]['help'])
-            return help_text
-
-        return None
-
-    def process_external_commands(self, frame):
-        addressee, cmd, args = self._unpack_message(frame)
-
-        if cmd in self._extra_commands:
-            info = self._extra_commands[cmd]
-            return info['module'].invoke(frame, cmd, args)
-
-    def _unpack_message(self, frame):
-        info = frame.info.decode('utf-8', errors='backslashreplace').lstrip()
-
-        if info[0] == ':':
-            # standard APRS message
-            parts = info.split(':')
-            addressee = parts[1].strip()
-            text = re.split(r'\s+', parts[2].strip(), 1)
-            cmd = text[0].lower()
-            args = ''
-            if len(text) == 2:
-                args = text[1]
-
-            return (addressee, cmd, args)
-
-        return (None, '', '')
+        commands = self.commands
+        commands.register('about', self.cmd_about,
+                          'ABOUT: Send info about this bot')
+        commands.register('time', self.cmd_time,
+                          'TIME: Send the current local time')
+        commands.register('ping', self.cmd_ping,
+                          'PING: Ping the bot and receive back a pong')
+        commands.register('test', self.cmd_test)
+        commands.register('help', self.cmd_help, aliases=['?'])
+
+    # # TODO Update for bot name
+    # if sourcetrunc == "APRSPH" or sourcetrunc == "ANSRVR" or sourcetrunc == "ID1OT" or sourcetrunc == "WLNK-1" or sourcetrunc == "KP4ASD" or qry[0:3] == "rej" or qry[0:3] == "aa:" or args == "may be unattended" or args =="QTH Digi heard you!" or qry == "aa:message" :
+    #     logger.info("Message from ignore list. Stop processing." )
+    #     return
+
+    # elif qry == "?aprst" or qry == "?ping?" or qry == "aprst?" or qry == "aprst" :
+    #     tmp_lst = (
+    #         origframe.to_aprs_string()
+    #         .decode("utf-8", errors="replace")
+    #         .split("::", 2)
+    #     )
+    #     self.send_aprs_msg(sourcetrunc, tmp_lst[0] + ":")
+    # elif qry == "version":
+    #     self.send_aprs_msg(sourcetrunc, "Python " + sys.version.replace("\n", " "))
+
+    def cmd_ping(self, msg):
+        logger.info(f"Handling PING from {msg.source}")
+        return time.strftime("%m%d %H%MZ") + ":Pong! " + msg.args
+
+    def cmd_test(self, msg):
+#                                            1234567890123456789012345678901234567890123456789012345678901234567
+        return time.strftime("%m%d %H%MZ") + ":It works! HELP for more commands."
+
+    def cmd_about(self, msg):
+        return "APRS bot by WT0F based on ioreth by N2RAC/DU2XXR."
+
+    def cmd_time(self, msg):
+        return f"Localtime is {time.strftime('%Y-%m-%d %H:%M:%S %Z')}"
+
+    def cmd_help(self, msg):
+        return self.commands.help_pages()
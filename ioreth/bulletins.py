@@ -0,0 +1,266 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import datetime
+import heapq
+import logging
+import random
+import time
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.bulletins')
+
+
+def _utc_offset(t):
+    """UTC offset, in hours, of the local time at 't'."""
+    return time.localtime(t).tm_gmtoff / 3600
+
+
+def _local_minute(t):
+    return time.localtime(t)[:5]
+
+
+def _local_to_time(tm, start):
+    """The first time at or after 'start' when the local time is the
+    minute 'tm', or None. A minute skipped by a DST change never happens
+    and one in the hour repeated at its end happens twice.
+    """
+    times = set()
+    for isdst in (0, 1):
+        t = time.mktime(tm + (0, 0, 0, isdst))
+        if t >= start and _local_minute(t) == tm:
+            times.add(t)
+    return min(times, default=None)
+
+
+class BulletinRule:
+    """A compiled BLNx_rule_y: knows the next local minute it matches."""
+
+    __slots__ = ('bln', 'key', 'expr', '_hours', '_minutes')
+
+    # A rule that matches nothing this far ahead is looked at again then.
+    SEARCH_DAYS = 366
+    # Rules with periodic (%) minutes or hours are searched minute by
+    # minute, this far ahead.
+    SCAN_MINUTES = 24 * 60
+
+    def __init__(self, bln, key, rule):
+        # Only needed, and so only imported, with rule-based bulletins.
+        from cronex import CronExpression
+        self.bln = bln
+        self.key = key
+        self.expr = CronExpression(rule)
+        minutes, hours = self.expr.string_tab[:2]
+        if '%' in minutes or '%' in hours:
+            self._hours = self._minutes = None
+        else:
+            self._hours = sorted(self.expr.numerical_tab[1])
+            self._minutes = sorted(self.expr.numerical_tab[0])
+
+    @property
+    def text(self):
+        return self.expr.comment
+
+    def matches(self, t):
+        """Whether the rule matches the local minute of time 't'."""
+        return self.expr.check_trigger(_local_minute(t), _utc_offset(t))
+
+    def next_match(self, start):
+        """Start of the first local minute at or after 'start' (a minute
+        boundary) matching the rule, or (None, t) if there is none before
+        't', when the search must be done again.
+        """
+        if self._hours is None:
+            return self._scan(start)
+        y, mo, d, h, m = _local_minute(start)
+        day = datetime.date(y, mo, d)
+        # From an hour earlier on the clock, that may still be ahead if
+        # it is repeated at the end of DST.
+        earlier = _local_minute(start - 3600)
+        first = earlier[3:] if earlier[:3] == (y, mo, d) else (0, 0)
+        for _ in range(self.SEARCH_DAYS):
+            t = self._match_in_day(day, first, start)
+            if t is not None:
+                return t, None
+            day += datetime.timedelta(days=1)
+            first = (0, 0)
+        return None, time.mktime((day.year, day.month, day.day, 0, 0, 0, 0, 0, -1))
+
+    def _match_in_day(self, day, first, start):
+        """The earliest time at or after 'start' on local date 'day',
+        from the clock time 'first' on, matching the rule, or None.
+        """
+        best = limit = None
+        checked = False
+        for hour in self._hours:
+            for minute in self._minutes:
+                if (hour, minute) < first:
+                    continue
+                if limit is not None and (hour, minute) > limit:
+                    return best
+                tm = (day.year, day.month, day.day, hour, minute)
+                if not checked:
+                    # Only the day fields can fail from here on.
+                    offset = _utc_offset(time.mktime(tm + (0, 0, 0, -1)))
+                    if not self.expr.check_trigger(tm, offset):
+                        return None
+                    checked = True
+                t = _local_to_time(tm, start)
+                if t is not None and (best is None or t < best):
+                    # A later clock time within the next hour may still
+                    # come first if DST ends meanwhile.
+                    if best is None:
+                        limit = (hour + 1, minute)
+                    best = t
+        return best
+
+    def _scan(self, start):
+        t = start
+        for _ in range(self.SCAN_MINUTES):
+            if self.matches(t):
+                return t, None
+            t += 60
+        return None, t
+
+
+class BulletinSchedule:
+    """When to send the bulletins in the [bulletins] section.
+
+    Simple bulletins go every send_freq seconds, measured by the monotonic
+    clock. Rule-based ones keep a heap with the time each bulletin is next
+    due: the start of the next local minute one of its rules matches plus
+    a random delay of up to JITTER seconds, shared by all the bulletins
+    of that minute, so stations do not all transmit at the same moment.
+    When it is due, the last matching rule (in key order) gives the text.
+
+    If the wall clock is changed, or was not set yet, the rule bulletins
+    are scheduled again from the current minute; next_delay() never
+    exceeds MAX_SLEEP so a change is noticed soon.
+    """
+
+    JITTER = 30
+    MAX_SLEEP = 60
+    # Wall clock changes smaller than this are just NTP doing its job.
+    CLOCK_TOLERANCE = 1.0
+
+    def __init__(self):
+        self.send_freq = 600
+        self.simple = ()
+        self._rules = {}
+        self._heap = []
+        self._jitter = {}
+        self._fired = {}
+        self._last_std = time.monotonic()
+        self._clock_offset = None
+
+    def configure(self, config):
+        """Use the bulletins of a config.BulletinsConfig (or None for no
+        bulletins). The simple bulletin interval keeps running and rule
+        bulletins already sent for this minute are not sent again.
+        """
+        rules = {}
+        if config is not None:
+            self.send_freq = config.send_freq
+            self.simple = config.simple
+            for bln, key, rule in config.rules:
+                try:
+                    rules.setdefault(bln, []).append(BulletinRule(bln, key, rule))
+                except ValueError as exc:
+                    logger.error(f"Ignoring bulletin rule {key}: {exc}")
+        else:
+            self.simple = ()
+        self._rules = rules
+        self._reschedule()
+
+    @staticmethod
+    def _time_was_set():
+        # Do not run if time was not set yet (e.g. Raspberry Pis getting
+        # their time from NTP but before conecting to the network)
+        return time.gmtime().tm_year > 2000
+
+    def _reschedule(self):
+        self._heap = []
+        self._clock_offset = time.time() - time.monotonic()
+        if not self._time_was_set():
+            return
+        minute = 60 * int(time.time() // 60)
+        for bln in self._rules:
+            self._schedule(bln, max(minute, self._fired.get(bln, minute - 60) + 60))
+
+    def _schedule(self, bln, start):
+        found = [rule.next_match(start) for rule in self._rules[bln]]
+        minutes = [t for t, _ in found if t is not None]
+        if minutes:
+            minute = min(minutes)
+            jitter = self._jitter.get(minute)
+            if jitter is None:
+                jitter = self._jitter[minute] = random.uniform(0, self.JITTER)
+            heapq.heappush(self._heap, (minute + jitter, minute, bln))
+        else:
+            # Nothing for a long time; look again later.
+            heapq.heappush(self._heap, (min(t for _, t in found), None, bln))
+
+    def _clock_changed(self):
+        offset = time.time() - time.monotonic()
+        if self._clock_offset is None:
+            return True
+        return abs(offset - self._clock_offset) > self.CLOCK_TOLERANCE
+
+    def due(self):
+        """The (bulletin, text) pairs to send now, sorted."""
+        bln_map = {}
+        now_mono = time.monotonic()
+        if self.simple and now_mono > self._last_std + self.send_freq:
+            self._last_std = now_mono
+            bln_map.update(self.simple)
+
+        if self._rules:
+            if self._clock_changed():
+                logger.info("Wall clock changed, rescheduling bulletins")
+                self._reschedule()
+            now = time.time()
+            current = 60 * int(now // 60)
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, minute, bln = heapq.heappop(heap)
+                if minute is None or minute < current:
+                    # Recheck, or late (suspended, busy loop): it is not
+                    # that minute anymore.
+                    self._schedule(bln, current)
+                    continue
+                text = None
+                for rule in self._rules[bln]:
+                    if rule.matches(minute):
+                        text = rule.text
+                if text is not None:
+                    bln_map[bln] = text
+                self._fired[bln] = minute
+                self._schedule(bln, minute + 60)
+            for minute in [m for m in self._jitter if m < current]:
+                del self._jitter[minute]
+
+        return sorted(bln_map.items())
+
+    def next_delay(self):
+        """Seconds until due() may have something to send."""
+        delay = self.MAX_SLEEP
+        if self.simple:
+            delay = min(delay, self._last_std + self.send_freq - time.monotonic())
+        if self._heap:
+            delay = min(delay, self._heap[0][0] - time.time())
+        return max(1, delay)
@@ -0,0 +1,354 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import configparser
+import logging
+import types
+from typing import NamedTuple, Optional
+
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.config')
+
+"""
+The bot configuration, loaded once per change of the file into an
+immutable snapshot with every value already converted and checked.
+"""
+
+CONNECTION_TYPES = ('kiss', 'aprs-is')
+
+_UNSET = object()
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def _split_list(value):
+    return tuple(v.strip() for v in value.split(',') if v.strip())
+
+
+class _Section:
+    """Typed getters over the raw options of a section, raising
+    ConfigError with the section and option names.
+    """
+
+    def __init__(self, name, items):
+        self.name = name
+        self.items = items
+
+    def _convert(self, option, fallback, func, typename):
+        if option not in self.items:
+            if fallback is _UNSET:
+                raise ConfigError(f"[{self.name}] {option} is missing")
+            return fallback
+        try:
+            return func(self.items[option])
+        except ValueError:
+            raise ConfigError(f"[{self.name}] {option} must be {typename}, "
+                              f"not {self.items[option]!r}") from None
+
+    def str(self, option, fallback=_UNSET):
+        return self._convert(option, fallback, str, 'a string')
+
+    def int(self, option, fallback=_UNSET, minimum=None):
+        value = self._convert(option, fallback, int, 'an integer')
+        if minimum is not None and option in self.items and value < minimum:
+            raise ConfigError(f"[{self.name}] {option} must be at least "
+                              f"{minimum}, not {value}")
+        return value
+
+    def float(self, option, fallback=_UNSET):
+        return self._convert(option, fallback, float, 'a number')
+
+    def bool(self, option, fallback=_UNSET):
+        def to_bool(value):
+            value = value.strip().lower()
+            if value not in configparser.ConfigParser.BOOLEAN_STATES:
+                raise ValueError(value)
+            return configparser.ConfigParser.BOOLEAN_STATES[value]
+        return self._convert(option, fallback, to_bool, 'yes or no')
+
+
+class ConnectionConfig(NamedTuple):
+    """A [conn.NAME] section."""
+    name: str
+    type: str
+    host: str
+    port: int
+    servers: str
+    callsign: str
+    passcode: str
+    destination: str
+    path: str
+    aliases: str
+    bulletin_groups: str
+    filter: Optional[str]
+    dynamic_filter: bool
+    filter_interval: float
+    reconnect_min: float
+    reconnect_max: float
+    msg_retries: int
+    msg_retry_delay: float
+    tx_rate: float
+    tx_burst: int
+    tx_queue: int
+
+    @staticmethod
+    def from_section(name, sect):
+        return ConnectionConfig(
+            name=name,
+            type=sect.str('type'),
+            host=sect.str('host', 'rotate.aprs.net'),
+            port=sect.int('port', 14580),
+            servers=sect.str('servers', ''),
+            callsign=sect.str('callsign'),
+            passcode=sect.str('passcode', '-1'),
+            destination=sect.str('destination'),
+            path=sect.str('path'),
+            aliases=sect.str('aliases', ''),
+            bulletin_groups=sect.str('bulletin_groups', ''),
+            filter=sect.str('filter', None),
+            dynamic_filter=sect.bool('dynamic_filter', True),
+            filter_interval=sect.float('filter_interval', 30),
+            reconnect_min=sect.float('reconnect_min', 1),
+            reconnect_max=sect.float('reconnect_max', 300),
+            msg_retries=sect.int('msg_retries', 3),
+            msg_retry_delay=sect.float('msg_retry_delay', 30),
+            tx_rate=sect.float('tx_rate', 0),
+            tx_burst=sect.int('tx_burst', 1, minimum=1),
+            tx_queue=sect.int('tx_queue', 100, minimum=1),
+        )
+
+
+class BotConfig(NamedTuple):
+    """The [bot] section."""
+    name: str
+    command_dir: str
+    plugin_manifest: str
+    sentry_dsn: str
+    dupe_window: int
+    dupe_retry_window: int
+    command_workers: int
+    command_timeout: float
+    command_queue: int
+    remote_workers: int
+    remote_preload: tuple
+    remote_timeout: float
+    fanout_batch: int
+    fanout_interval: float
+    fanout_unreachable: float
+
+    @staticmethod
+    def from_section(sect):
+        return BotConfig(
+            name=sect.str('name', ''),
+            command_dir=sect.str('command_dir', 'commands'),
+            plugin_manifest=sect.str('plugin_manifest', ''),
+            # May be quoted as in the sample configuration.
+            sentry_dsn=sect.str('sentry_dsn', '').strip('"\''),
+            dupe_window=sect.int('dupe_window', 30),
+            dupe_retry_window=sect.int('dupe_retry_window', 600),
+            command_workers=sect.int('command_workers', 4),
+            command_timeout=sect.float('command_timeout', 30),
+            command_queue=sect.int('command_queue', 32),
+            remote_workers=sect.int('remote_workers', 2),
+            remote_preload=_split_list(sect.str('remote_preload', '')),
+            remote_timeout=sect.float('remote_timeout', 60),
+            fanout_batch=sect.int('fanout_batch', 5),
+            fanout_interval=sect.float('fanout_interval', 5),
+            fanout_unreachable=sect.float('fanout_unreachable', 3600),
+        )
+
+
+class BulletinsConfig(NamedTuple):
+    """The [bulletins] section: simple bulletins as (name, text) and the
+    rules of rule-based ones as (name, key, cron rule), both sorted by key.
+    Rules for names that also have a simple bulletin are left out.
+    """
+    send_freq: int
+    simple: tuple
+    rules: tuple
+
+    @staticmethod
+    def from_section(sect):
+        keys = sorted(sect.items)
+        simple = tuple((k, sect.items[k]) for k in keys
+                       if k.startswith("BLN") and len(k) > 3 and "_" not in k)
+        names = {name for name, _ in simple}
+        rules = []
+        for k in keys:
+            # if key is "BLNx_rule_x", etc.
+            lst = k.split("_", 3)
+            if (len(lst) == 3 and lst[0].startswith("BLN") and lst[1] == "rule"
+                    and lst[0] not in names):
+                rules.append((lst[0], k, sect.items[k]))
+        return BulletinsConfig(sect.int('send_freq', 600), simple, tuple(rules))
+
+
+class StatusConfig(NamedTuple):
+    """The [status] section."""
+    send_freq: int
+
+    @staticmethod
+    def from_section(sect):
+        return StatusConfig(sect.int('send_freq', 600))
+
+
+class ConfigSnapshot:
+    """An immutable, checked copy of the configuration file.
+
+    Besides the typed sections (bot, connections, bulletins, status) it
+    answers the read-only part of the ConfigParser interface (get, getint,
+    has_option, config['section']['option'], ...) over the raw values, so
+    plugins can read their own sections.
+    """
+
+    __slots__ = ('path', 'bot', 'connections', 'bulletins', 'status',
+                 '_sections')
+
+    def __init__(self, path, sections):
+        """'sections' maps section names to dicts of raw option values."""
+        setattr_ = object.__setattr__
+        setattr_(self, 'path', path)
+        setattr_(self, '_sections', types.MappingProxyType(
+            {name: types.MappingProxyType(dict(items))
+             for name, items in sections.items()}))
+
+        bot = BotConfig.from_section(_Section('bot', self._sections.get('bot', {})))
+        connections = {}
+        for name, items in self._sections.items():
+            if not name.startswith('conn.'):
+                continue
+            sect = _Section(name, items)
+            conn_type = sect.str('type')
+            if conn_type not in CONNECTION_TYPES:
+                logger.error(f"{name} has an invalid type: ignoring connection")
+                continue
+            connections[name[5:]] = ConnectionConfig.from_section(name[5:], sect)
+        bulletins = status = None
+        if 'bulletins' in self._sections:
+            bulletins = BulletinsConfig.from_section(
+                _Section('bulletins', self._sections['bulletins']))
+        if 'status' in self._sections:
+            status = StatusConfig.from_section(
+                _Section('status', self._sections['status']))
+
+        setattr_(self, 'bot', bot)
+        setattr_(self, 'connections', types.MappingProxyType(connections))
+        setattr_(self, 'bulletins', bulletins)
+        setattr_(self, 'status', status)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConfigSnapshot is immutable")
+
+    @staticmethod
+    def load(path):
+        """Read and check the configuration file. Raises ConfigError."""
+        parser = configparser.ConfigParser()
+        parser.optionxform = str # config values are case sensitive
+        try:
+            with open(path) as fp:
+                parser.read_file(fp)
+            sections = {name: dict(parser.items(name)) for name in parser.sections()}
+        except (OSError, configparser.Error) as exc:
+            raise ConfigError(f"Can not read {path}: {exc}") from None
+        return ConfigSnapshot(path, sections)
+
+    def changed_sections(self, other):
+        """Names of the sections that differ from the snapshot 'other'
+        (including sections only present in one of them).
+        """
+        names = set(self._sections) | set(other._sections)
+        return {n for n in names if self._sections.get(n) != other._sections.get(n)}
+
+    # Read-only ConfigParser interface.
+
+    def sections(self):
+        return list(self._sections)
+
+    def has_section(self, section):
+        return section in self._sections
+
+    def has_option(self, section, option):
+        return option in self._sections.get(section, ())
+
+    def options(self, section):
+        return list(self[section])
+
+    def items(self, section):
+        return list(self[section].items())
+
+    def __getitem__(self, section):
+        try:
+            return self._sections[section]
+        except KeyError:
+            raise KeyError(section) from None
+
+    def __contains__(self, section):
+        return section in self._sections
+
+    def get(self, section, option, fallback=_UNSET):
+        return _Section(section, self._sections.get(section, {})).str(option, fallback)
+
+    def getint(self, section, option, fallback=_UNSET):
+        return _Section(section, self._sections.get(section, {})).int(option, fallback)
+
+    def getfloat(self, section, option, fallback=_UNSET):
+        return _Section(section, self._sections.get(section, {})).float(option, fallback)
+
+    def getboolean(self, section, option, fallback=_UNSET):
+        return _Section(section, self._sections.get(section, {})).bool(option, fallback)
+
+
+class ConfigView:
+    """What plugins get as their config: reads always go to the current
+    snapshot, so nothing a plugin reads later is stale, and the sections
+    read while recording (during register()) are remembered so the
+    plugin can be registered again when one of them changes.
+    """
+
+    _SECTION_METHODS = frozenset(('get', 'getint', 'getfloat', 'getboolean',
+                                  'has_section', 'has_option', 'options',
+                                  'items'))
+
+    def __init__(self, current):
+        self._current = current
+        self.sections_read = set()
+        self.recording = False
+
+    def _record(self, section):
+        if self.recording:
+            self.sections_read.add(section)
+
+    def __getattr__(self, name):
+        attr = getattr(self._current(), name)
+        if name in self._SECTION_METHODS:
+            def read(section, *args, **kwargs):
+                self._record(section)
+                return attr(section, *args, **kwargs)
+            return read
+        return attr
+
+    def __getitem__(self, section):
+        self._record(section)
+        return self._current()[section]
+
+    def __contains__(self, section):
+        self._record(section)
+        return section in self._current()
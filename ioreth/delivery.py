@@ -0,0 +1,161 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import logging
+import random
+import re
+
+from .txsched import PRIO_REPLY
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.delivery')
+
+# APRS message ids are 1 to 5 alphanumeric characters.
+_MAX_MSGID = 99999
+
+ACK_REJ_RE = re.compile(r'^(ack|rej)([A-Za-z0-9]{1,5})\s*$')
+
+
+class Delivery:
+    """A message waiting for an ack."""
+
+    __slots__ = ('dest', 'msgid', 'frame', 'priority', 'tries', 'delay',
+                 'timer', 'done')
+
+    def __init__(self, dest, msgid, frame, priority, delay, done=None):
+        self.dest = dest
+        self.msgid = msgid
+        self.frame = frame
+        self.priority = priority
+        self.tries = 1
+        self.delay = delay
+        self.timer = None
+        self.done = done
+
+    def finish(self, result):
+        if self.done is not None:
+            self.done(self.dest, result)
+
+
+class DeliveryEngine:
+    """Send APRS messages with a message id and retry them until they are
+    acked, rejected or run out of retries.
+
+    In-flight messages are indexed by (destination, msgid), so an ack is
+    matched with a single lookup, and each one has its own timer in the
+    connection's reactor instead of being scanned on every loop.
+    """
+
+    def __init__(self, client, retries=3, delay=30, backoff=2, max_delay=600):
+        self.client = client
+        self.retries = retries
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self._next_id = {}
+        self._pending = {}
+        self.sent = 0
+        self.resent = 0
+        self.acked = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def _alloc_msgid(self, dest):
+        # Start at a random point so ids are not reused right after a
+        # restart, as recipients ignore ids they have just seen.
+        msgid = self._next_id.get(dest)
+        if msgid is None:
+            msgid = random.randint(1, _MAX_MSGID)
+        self._next_id[dest] = msgid % _MAX_MSGID + 1
+        return str(msgid)
+
+    def in_flight(self):
+        return len(self._pending)
+
+    def send(self, to_call, text, via=None, priority=PRIO_REPLY, done=None):
+        """Send 'text' to 'to_call' asking for an ack and schedule its
+        retries. Returns the message id. 'done(dest, result)' is called
+        with 'acked', 'rejected', 'expired' or 'cancelled' once that is
+        known, or with 'sent' right away if there are no retries.
+        """
+        dest = to_call.upper()
+        msgid = self._alloc_msgid(dest)
+        frame = self.client.make_aprs_msg(to_call, f"{text}{{{msgid}", via)
+        self.client.enqueue_frame(frame, priority)
+        self.sent += 1
+
+        reactor = self.client.reactor
+        if self.retries > 0 and reactor:
+            delivery = Delivery(dest, msgid, frame, priority, self.delay, done)
+            delivery.timer = reactor.call_later(delivery.delay, self._retry,
+                                                delivery)
+            self._pending[(dest, msgid)] = delivery
+        elif done is not None:
+            done(dest, 'sent')
+        return msgid
+
+    def _retry(self, delivery):
+        key = (delivery.dest, delivery.msgid)
+        if self._pending.get(key) is not delivery:
+            return
+        if delivery.tries > self.retries:
+            logger.info(f"Message {delivery.msgid} to {delivery.dest} was never acked")
+            del self._pending[key]
+            self.expired += 1
+            delivery.finish('expired')
+            return
+
+        logger.info(f"Resending message {delivery.msgid} to {delivery.dest}")
+        delivery.tries += 1
+        self.resent += 1
+        self.client.enqueue_frame(delivery.frame, delivery.priority)
+        delivery.delay = min(delivery.delay * self.backoff, self.max_delay)
+        delivery.timer = self.client.reactor.call_later(delivery.delay,
+                                                        self._retry, delivery)
+
+    def on_ack_rej(self, source, text):
+        """Match an incoming message text against in-flight messages.
+        Returns True if 'text' is an ack or rej (whether it matched
+        anything or not), so it should not be processed any further.
+        """
+        m = ACK_REJ_RE.match(text)
+        if not m:
+            return False
+        kind, msgid = m.groups()
+        delivery = self._pending.pop((source.upper(), msgid), None)
+        if delivery is None:
+            logger.debug(f"Unexpected {kind}{msgid} from {source}")
+            return True
+
+        delivery.timer.cancel()
+        if kind == 'ack':
+            self.acked += 1
+            logger.info(f"Message {msgid} to {source} acked")
+            delivery.finish('acked')
+        else:
+            self.rejected += 1
+            logger.info(f"Message {msgid} to {source} rejected")
+            delivery.finish('rejected')
+        return True
+
+    def cancel_all(self):
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for delivery in pending:
+            delivery.timer.cancel()
+            delivery.finish('cancelled')
@@ -0,0 +1,76 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import logging
+import time
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.dupefilter')
+
+
+class DupeFilter:
+    """Remember recently seen packets for 'window' seconds.
+
+    The same packet often arrives several times, through different
+    digipeaters and through APRS-IS. Only a hash of the key is stored, in
+    insertion order, so lookups are O(1), expired entries are dropped from
+    the front and memory is bounded by 'max_entries'. Seeing a packet
+    again restarts its window, so a sender retrying more often than the
+    window is never taken as new.
+    """
+
+    def __init__(self, window=30, retry_window=600, max_entries=10000):
+        self.window = window
+        # For packets the sender resends until acked.
+        self.retry_window = retry_window
+        self.max_entries = max_entries
+        self._seen = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _expire(self, now):
+        seen = self._seen
+        while seen:
+            key, expires = next(iter(seen.items()))
+            if expires > now and len(seen) < self.max_entries:
+                break
+            seen.popitem(last=False)
+
+    def check(self, *key, window=None):
+        """Return True if 'key' was seen within the window (or 'window'
+        seconds, if given), remembering it for another window either way.
+        """
+        now = time.monotonic()
+        self._expire(now)
+        digest = hash(key)
+        # With different windows, entries behind the front may have
+        # expired already.
+        expires = self._seen.pop(digest, 0)
+        self._seen[digest] = now + (self.window if window is None else window)
+        if expires > now:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def clear(self):
+        self._seen.clear()
+
+    def __len__(self):
+        return len(self._seen)
@@ -0,0 +1,195 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import logging
+import time
+
+from .txsched import PRIO_FANOUT
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.fanout')
+
+"""
+Sending one message to every station in a net.
+"""
+
+
+class NetMessage:
+    """'text' from 'source' for the stations in 'recipients', a mapping of
+    callsigns to the name of the connection they are reached through.
+    Plugins return it in their reply, as they do with Frames. 'results'
+    gets the outcome for each recipient as it is known.
+    """
+
+    __slots__ = ('source', 'text', 'recipients', 'results')
+
+    def __init__(self, source, text, recipients):
+        self.source = source
+        self.text = text
+        self.recipients = dict(recipients)
+        self.results = {}
+
+    def __repr__(self):
+        return (f"NetMessage({self.source!r}, {self.text!r}, "
+                f"{len(self.recipients)} recipients)")
+
+
+class FanOut:
+    """Send NetMessages through the bot connections without flooding them.
+
+    Recipients are queued by connection and released at most 'batch' at a
+    time every 'interval' seconds, and only while the connection has less
+    than 'batch' frames waiting to be transmitted, so replies and acks are
+    neither held up behind a large net nor dropped from a full queue. The
+    frames are made from the connection's frame template.
+
+    Stations that ask for acks in their own messages get the message with
+    a message id, and are retried by the connection. One that never acks
+    is out of reach and skipped for 'unreachable_for' seconds, or until
+    it is heard from again. Stations are only remembered as using acks
+    for 'uses_acks_for' seconds after their last message with an id, and
+    at most 'max_entries' of each kind are kept, the oldest dropped first.
+    """
+
+    # Outcomes for a recipient: sent without asking for an ack, acked,
+    # rejected, never acked, skipped as out of reach, not queued for
+    # transmission (full queue, no connection) or given up when its
+    # connection stopped.
+    RESULTS = ('sent', 'acked', 'rejected', 'expired', 'skipped', 'dropped',
+               'cancelled')
+
+    def __init__(self, reactor, connections, batch=5, interval=5,
+                 unreachable_for=3600, uses_acks_for=86400, max_entries=10000):
+        self.reactor = reactor
+        self.connections = connections
+        self.batch = batch
+        self.interval = interval
+        self.unreachable_for = unreachable_for
+        self.uses_acks_for = uses_acks_for
+        self.max_entries = max_entries
+        # Connection name to deque of (message, callsign).
+        self._queues = {}
+        self._timers = {}
+        # Callsign to monotonic time it was last heard with a message id,
+        # and to the time it was found out of reach, both oldest first.
+        self._uses_acks = collections.OrderedDict()
+        self._unreachable = collections.OrderedDict()
+        self.results = dict.fromkeys(self.RESULTS, 0)
+
+    @staticmethod
+    def _expire(entries, older_than, max_entries):
+        while entries:
+            since = next(iter(entries.values()))
+            if since > older_than and len(entries) <= max_entries:
+                break
+            entries.popitem(last=False)
+
+    def _remember(self, entries, call, max_age):
+        now = time.monotonic()
+        entries.pop(call, None)
+        entries[call] = now
+        self._expire(entries, now - max_age, self.max_entries)
+
+    def heard(self, call, uses_acks=False):
+        """A message came from 'call'; 'uses_acks' if it had a message id."""
+        call = call.upper()
+        self._unreachable.pop(call, None)
+        if uses_acks:
+            self._remember(self._uses_acks, call, self.uses_acks_for)
+
+    def uses_acks(self, call):
+        self._expire(self._uses_acks, time.monotonic() - self.uses_acks_for,
+                     self.max_entries)
+        return call.upper() in self._uses_acks
+
+    def is_unreachable(self, call):
+        self._expire(self._unreachable,
+                     time.monotonic() - self.unreachable_for, self.max_entries)
+        return call.upper() in self._unreachable
+
+    def submit(self, message):
+        """Queue 'message' for all its recipients. The first batch of each
+        connection goes out once the reply to the sender is queued.
+        """
+        logger.info(f"Sending net message from {message.source} to "
+                    f"{len(message.recipients)} stations")
+        names = set()
+        for call, name in message.recipients.items():
+            if self.is_unreachable(call):
+                self._report(message, call, 'skipped')
+                continue
+            self._queues.setdefault(name, collections.deque()).append((message, call))
+            names.add(name)
+        for name in names:
+            if name not in self._timers:
+                self._timers[name] = self.reactor.call_later(0, self._release,
+                                                             name)
+
+    def _release(self, name):
+        self._timers.pop(name, None)
+        queue = self._queues[name]
+        conn = self.connections.get(name)
+        if conn is None:
+            logger.warning(f"No connection {name} for {len(queue)} net messages")
+            while queue:
+                self._report(*queue.popleft(), 'dropped')
+        for _ in range(self.batch - len(conn.tx) if conn else 0):
+            if not queue:
+                break
+            self._send(conn, *queue.popleft())
+        if queue:
+            self._timers[name] = self.reactor.call_later(self.interval,
+                                                         self._release, name)
+        else:
+            del self._queues[name]
+
+    def _send(self, conn, message, call):
+        if self.uses_acks(call):
+            conn.delivery.send(call, message.text, priority=PRIO_FANOUT,
+                               done=lambda dest, result:
+                                   self._on_delivery(message, call, result))
+        elif conn.enqueue_frame(conn.make_aprs_msg(call, message.text),
+                                PRIO_FANOUT):
+            self._report(message, call, 'sent')
+        else:
+            self._report(message, call, 'dropped')
+
+    def _on_delivery(self, message, call, result):
+        if result == 'expired':
+            self._remember(self._unreachable, call.upper(), self.unreachable_for)
+        self._report(message, call, result)
+
+    def _report(self, message, call, result):
+        message.results[call] = result
+        self.results[result] += 1
+        logger.info(f"Net message from {message.source} to {call}: {result}")
+        if len(message.results) == len(message.recipients):
+            counts = collections.Counter(message.results.values())
+            summary = ', '.join(f"{n} {r}" for r, n in sorted(counts.items()))
+            logger.info(f"Net message from {message.source} done: {summary}")
+
+    def stats(self):
+        """Recipients waiting, stations out of reach and results so far."""
+        self._expire(self._unreachable,
+                     time.monotonic() - self.unreachable_for, self.max_entries)
+        return {
+            'queued': sum(len(q) for q in self._queues.values()),
+            'unreachable': len(self._unreachable),
+            **self.results,
+        }
@@ -0,0 +1,146 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import logging
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.kiss')
+
+"""
+KISS framing, as spoken by TNCs over serial lines and TCP.
+"""
+
+FEND = b"\xc0"
+FESC = b"\xdb"
+TFEND = b"\xdc"
+TFESC = b"\xdd"
+DATA = b"\x00"
+FESC_TFESC = FESC + TFESC
+FESC_TFEND = FESC + TFEND
+
+_TFEND_BYTE = TFEND[0]
+_TFESC_BYTE = TFESC[0]
+
+
+def escape(frame_bytes):
+    """Escape a raw AX.25 frame and wrap it into a KISS data frame."""
+    return (
+        FEND
+        + DATA
+        + frame_bytes.replace(FESC, FESC_TFESC).replace(FEND, FESC_TFEND)
+        + FEND
+    )
+
+
+def unescape(data):
+    """Undo the KISS transparency escapes in a single pass over 'data'.
+    Returns None if there is an invalid escape sequence.
+    """
+    data = bytes(data)
+    if FESC not in data:
+        return data
+    parts = data.split(FESC)
+    out = [parts[0]]
+    for part in parts[1:]:
+        if not part:
+            return None
+        code = part[0]
+        if code == _TFEND_BYTE:
+            out.append(FEND)
+        elif code == _TFESC_BYTE:
+            out.append(FESC)
+        else:
+            return None
+        out.append(part[1:])
+    return b"".join(out)
+
+
+class KissDecoder:
+    """Streaming KISS deframer.
+
+    Received data is appended to a single buffer that is walked with a
+    cursor; consumed bytes are dropped once per feed() so a burst of frames
+    costs linear time. Empty FEND-FEND pairs are skipped, bytes outside of
+    frames, frames with invalid escapes or non-data commands are discarded
+    and the decoder resynchronizes at the next FEND.
+    """
+
+    # Far larger than any AX.25 frame. Anything bigger is line noise.
+    MAX_FRAME_LEN = 4096
+
+    def __init__(self):
+        self._buf = bytearray()
+        self.frames = 0
+        self.discarded = 0
+
+    def reset(self):
+        self._buf.clear()
+
+    def feed(self, data):
+        """Add received bytes and return a list with all the complete
+        frames (unescaped, without the command byte) found so far.
+        """
+        buf = self._buf
+        buf += data
+        end = len(buf)
+        frames = []
+        pos = 0
+
+        with memoryview(buf) as view:
+            while pos < end:
+                start = buf.find(FEND, pos)
+                if start < 0:
+                    # No frame start: everything left is garbage.
+                    self.discarded += end - pos
+                    pos = end
+                    break
+                if start > pos:
+                    self.discarded += start - pos
+
+                stop = buf.find(FEND, start + 1)
+                if stop < 0:
+                    # Incomplete frame, wait for more data.
+                    pos = start
+                    if end - start > self.MAX_FRAME_LEN:
+                        logger.warning("Discarding oversized KISS frame")
+                        self.discarded += end - start
+                        pos = end
+                    break
+
+                # The closing FEND may also open the next frame.
+                pos = stop
+                if stop == start + 1:
+                    continue
+
+                # Command byte: high nibble is the port, low nibble is the
+                # command. Only data frames are interesting.
+                if buf[start + 1] & 0x0F != 0:
+                    self.discarded += stop - start - 1
+                    continue
+
+                frame = unescape(view[start + 2 : stop])
+                if frame is None:
+                    logger.warning("Discarding KISS frame with bad escape")
+                    self.discarded += stop - start - 1
+                    continue
+                if frame:
+                    frames.append(frame)
+
+        del buf[:pos]
+        self.frames += len(frames)
+        return frames
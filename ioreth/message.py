@@ -0,0 +1,85 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import logging
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.message')
+
+
+class Message:
+    """An APRS message packet, parsed once when received and then handed
+    to the bot and to the command plugins.
+
+        source     sender callsign-SSID, without the digipeated mark
+        addressee  who the message was sent to
+        text       message text, without the msgid
+        msgid      message id if the sender asked for an ack, or None
+        command    first word of the text, in lower case
+        args       rest of the text
+    """
+
+    __slots__ = ('frame', 'source', 'addressee', 'text', 'msgid', 'command',
+                 'args')
+
+    def __init__(self, frame, source, addressee, text, msgid=None):
+        self.frame = frame
+        self.source = source
+        self.addressee = addressee
+        self.text = text
+        self.msgid = msgid
+        words = text.split(None, 1)
+        self.command = words[0].lower() if words else ''
+        self.args = words[1].strip() if len(words) == 2 else ''
+
+    @staticmethod
+    def from_frame(frame):
+        """Parse a message packet (":ADDRESSEE:text{msgid"). The result is
+        kept in frame.message, so this is only done once per frame. Returns
+        None if the packet is not a valid message.
+        """
+        if frame.message is not None:
+            return frame.message
+
+        data_str = frame.info.decode("utf-8", errors="backslashreplace")
+        addressee_text = data_str[1:].split(":", 1)
+        if data_str[:1] != ":" or len(addressee_text) != 2:
+            logger.warning("Bad addressee:text pair: %s", addressee_text)
+            return None
+
+        text, brace, msgid = addressee_text[1].rpartition("{")
+        if not brace:
+            text, msgid = msgid, None
+        source = frame.source.replace(digipeated=False,
+                                      end_of_path=False).to_string()
+        frame.message = Message(frame, source, addressee_text[0].strip(),
+                                text, msgid)
+        return frame.message
+
+    @property
+    def connection(self):
+        """Name of the connection the message came from."""
+        return self.frame.connection
+
+    @property
+    def via(self):
+        return self.frame.via
+
+    def __repr__(self):
+        return (f"<Message from {self.source} to {self.addressee}: "
+                f"{self.text!r} msgid={self.msgid}>")
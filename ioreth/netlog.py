@@ -0,0 +1,174 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import logging
+import os
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.netlog')
+
+"""
+Where net check ins are kept.
+
+Entries are dicts with the keys `time` ("2025-02-06 10:48:57 EST", local
+time), `station`, `via` (the connection name) and `message`. The date of
+an entry is the first ten characters of its time. Stores only hand out
+the entries of one date at a time, so nobody needs the whole history in
+memory.
+"""
+
+
+def parse_line(line):
+    """The entry in a line of a text netlog, or None if it is not one."""
+    try:
+        ci_time, ci_source, ci_mesg = line.rstrip('\n').split('|', 2)
+    except ValueError:
+        return None
+    # Older logs have no connection name.
+    ci_station, _, ci_via = ci_source.partition('/')
+    return {'time': ci_time,
+            'station': ci_station,
+            'via': ci_via,
+            'message': ci_mesg}
+
+
+def format_line(entry):
+    return f"{entry['time']}|{entry['station']}/{entry['via']}|{entry['message']}\n"
+
+
+class TextNetLogStore:
+    """The text netlog, one entry per line:
+
+        2025-02-06 10:48:57 EST|KB9LEB/tnc|73 FROM JACK IN NSB FL
+
+    Reading a date goes through the whole file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fp = open(path, 'a+')
+
+    def append(self, entry):
+        self.fp.write(format_line(entry))
+        self.fp.flush()
+
+    def entries(self, date):
+        self.fp.seek(0)
+        for line in self.fp:
+            entry = parse_line(line)
+            if entry is None:
+                logger.warning(f"Ignoring invalid line in {self.path}: {line!r}")
+            elif entry['time'].startswith(date):
+                yield entry
+
+    def close(self):
+        self.fp.close()
+
+
+class SqliteNetLogStore:
+    """The netlog in a SQLite database, in WAL mode and indexed on (net,
+    date, station), so reading a date only touches its own entries and
+    several nets may share a database.
+
+    If an 'export' store is given every entry is also appended to it,
+    and when the database has nothing for 'net' yet the export is
+    imported first.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS netlog (
+            id INTEGER PRIMARY KEY,
+            net TEXT NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            station TEXT NOT NULL,
+            via TEXT NOT NULL,
+            message TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS netlog_net_date_station
+            ON netlog (net, date, station);
+    """
+
+    def __init__(self, path, net, export=None):
+        # Only needed, and so only imported, with a database configured.
+        import sqlite3
+        self.path = path
+        self.net = net
+        self.export = export
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        if export is not None and not self._has_entries():
+            self.import_text(export.path)
+
+    def _has_entries(self):
+        return self.db.execute("SELECT 1 FROM netlog WHERE net = ? LIMIT 1",
+                               (self.net,)).fetchone() is not None
+
+    def _row(self, entry):
+        return (self.net, entry['time'][:10], entry['time'], entry['station'],
+                entry['via'], entry['message'])
+
+    def import_text(self, path):
+        """Add the entries of a text netlog, all in one transaction."""
+        rows = []
+        with open(path) as fp:
+            for line in fp:
+                entry = parse_line(line)
+                if entry is None:
+                    logger.warning(f"Ignoring invalid line in {path}: {line!r}")
+                    continue
+                rows.append(self._row(entry))
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "INSERT INTO netlog (net, date, time, station, via, message) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        logger.info(f"Imported {len(rows)} entries of {path} into {self.path}")
+
+    def append(self, entry):
+        self.db.execute(
+            "INSERT INTO netlog (net, date, time, station, via, message) "
+            "VALUES (?, ?, ?, ?, ?, ?)", self._row(entry))
+        if self.export is not None:
+            self.export.append(entry)
+
+    def entries(self, date):
+        cursor = self.db.execute(
+            "SELECT time, station, via, message FROM netlog "
+            "WHERE net = ? AND date = ? ORDER BY id", (self.net, date))
+        for ci_time, station, via, message in cursor:
+            yield {'time': ci_time, 'station': station, 'via': via,
+                   'message': message}
+
+    def close(self):
+        self.db.close()
+        if self.export is not None:
+            self.export.close()
+
+
+def open_store(logfile, database=None):
+    """The store for the text netlog 'logfile': the file itself or, with a
+    'database', that database exporting to the file. Nets sharing a
+    database are told apart by the names of their text netlogs.
+    """
+    text = TextNetLogStore(logfile)
+    if not database:
+        return text
+    return SqliteNetLogStore(database, os.path.basename(logfile), export=text)
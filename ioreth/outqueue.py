@@ -0,0 +1,107 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import itertools
+import logging
+import os
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.outqueue')
+
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+
+
+class OutputQueue:
+    """Queue of encoded frames waiting to be written to a socket.
+
+    Each frame is kept as its own buffer and all of them are handed to the
+    kernel at once with sendmsg(), so a partial write only advances an
+    offset into the first pending frame instead of copying the backlog.
+    """
+
+    def __init__(self):
+        self._chunks = collections.deque()
+        self._offset = 0
+        self._pending = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def append(self, data):
+        if not data:
+            return
+        self._chunks.append(memoryview(data))
+        self._pending += len(data)
+
+    def prepend(self, data):
+        """Put 'data' before everything else. Only valid when nothing was
+        partially sent.
+        """
+        if self._offset:
+            raise ValueError("Can not prepend to a partially sent queue")
+        self._chunks.appendleft(memoryview(data))
+        self._pending += len(data)
+
+    def clear(self):
+        self._chunks.clear()
+        self._offset = 0
+        self._pending = 0
+
+    def drop_partial(self):
+        """Drop the first frame if it was only partially sent, e.g. before
+        sending the rest of the queue over a new connection.
+        """
+        if self._offset:
+            self._pending -= len(self._chunks.popleft()) - self._offset
+            self._offset = 0
+
+    def __len__(self):
+        """Number of frames (including a partially sent one) in the queue."""
+        return len(self._chunks)
+
+    def __bool__(self):
+        return bool(self._chunks)
+
+    def bytes_in_flight(self):
+        """Number of bytes queued but not yet accepted by the kernel."""
+        return self._pending
+
+    def send(self, sock):
+        """Write as much as the socket accepts. Returns the number of bytes
+        sent; socket errors (including BlockingIOError) propagate.
+        """
+        if not self._chunks:
+            return 0
+
+        bufs = list(itertools.islice(self._chunks, _IOV_MAX))
+        bufs[0] = bufs[0][self._offset:]
+        nsent = sock.sendmsg(bufs)
+        self._consume(nsent)
+        return nsent
+
+    def _consume(self, nsent):
+        self._pending -= nsent
+        self.bytes_sent += nsent
+        nsent += self._offset
+        while self._chunks and nsent >= len(self._chunks[0]):
+            nsent -= len(self._chunks.popleft())
+            self.frames_sent += 1
+        self._offset = nsent
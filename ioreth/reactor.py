@@ -0,0 +1,218 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import heapq
+import itertools
+import logging
+import selectors
+import socket
+import time
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.reactor')
+
+
+class Timer:
+    """A callback scheduled to run at some point of the monotonic clock.
+    Returned by Reactor.call_later/call_at so it can be cancelled.
+    """
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return f"<Timer when={self.when:.3f} callback={self.callback!r}>"
+
+
+class Reactor:
+    """Single event loop for the bot.
+
+    All connections register their sockets here and get called back when
+    they become readable or writable, so there is exactly one place where
+    the process blocks. Periodic work (bulletins, status, config reload,
+    reconnection) is scheduled as timers on the monotonic clock and the
+    loop sleeps until the earliest deadline or the next I/O event,
+    whatever comes first.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._timers = []
+        self._seq = itertools.count()
+        self._running = False
+        # Lets other threads wake the loop up, see call_soon_threadsafe().
+        self._pending = collections.deque()
+        self._wakeup = socket.socketpair()
+        for sock in self._wakeup:
+            sock.setblocking(False)
+        self.add_reader(self._wakeup[0], self._run_pending)
+
+    def _update(self, fileobj, reader=None, writer=None, remove_reader=False,
+                remove_writer=False):
+        try:
+            key = self._selector.get_key(fileobj)
+            cur_reader, cur_writer = key.data
+        except KeyError:
+            key = None
+            cur_reader, cur_writer = None, None
+
+        if reader is not None:
+            cur_reader = reader
+        if writer is not None:
+            cur_writer = writer
+        if remove_reader:
+            cur_reader = None
+        if remove_writer:
+            cur_writer = None
+
+        events = 0
+        if cur_reader:
+            events |= selectors.EVENT_READ
+        if cur_writer:
+            events |= selectors.EVENT_WRITE
+
+        if key is None:
+            if events:
+                self._selector.register(fileobj, events, (cur_reader, cur_writer))
+        elif events == 0:
+            self._selector.unregister(fileobj)
+        elif events != key.events or (cur_reader, cur_writer) != key.data:
+            self._selector.modify(fileobj, events, (cur_reader, cur_writer))
+
+    def add_reader(self, fileobj, callback):
+        """Call 'callback()' every time 'fileobj' has data to be read."""
+        self._update(fileobj, reader=callback)
+
+    def remove_reader(self, fileobj):
+        self._update(fileobj, remove_reader=True)
+
+    def add_writer(self, fileobj, callback):
+        """Call 'callback()' while 'fileobj' can accept more data."""
+        self._update(fileobj, writer=callback)
+
+    def remove_writer(self, fileobj):
+        self._update(fileobj, remove_writer=True)
+
+    def remove(self, fileobj):
+        """Forget about 'fileobj' entirely (e.g. before closing it)."""
+        self._update(fileobj, remove_reader=True, remove_writer=True)
+
+    def call_at(self, when, callback, *args):
+        """Run 'callback(*args)' once at the monotonic time 'when'."""
+        timer = Timer(when, callback, args)
+        heapq.heappush(self._timers, (when, next(self._seq), timer))
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        """Run 'callback(*args)' once after 'delay' seconds."""
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Run 'callback(*args)' in the loop thread as soon as possible.
+        This is the only method that may be called from other threads.
+        """
+        self._pending.append((callback, args))
+        try:
+            self._wakeup[1].send(b"\0")
+        except BlockingIOError:
+            # Full: the loop has plenty of wake ups pending already.
+            pass
+
+    def _run_pending(self):
+        try:
+            while self._wakeup[0].recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self._pending:
+            callback, args = self._pending.popleft()
+            try:
+                callback(*args)
+            except Exception as exc:
+                logger.exception(f"Callback {callback!r} failed: {exc}")
+
+    def _next_timeout(self):
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return None
+        return max(0, self._timers[0][0] - time.monotonic())
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self._timers)
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as exc:
+                logger.exception(f"Timer {timer} failed: {exc}")
+
+    def run_once(self, timeout=None):
+        """Wait for I/O events or timers and dispatch them. 'timeout' caps
+        the waiting time; None means wait until the next timer.
+        """
+        next_timeout = self._next_timeout()
+        if timeout is None:
+            timeout = next_timeout
+        elif next_timeout is not None:
+            timeout = min(timeout, next_timeout)
+
+        # The wake up socket is always registered, so there is always
+        # something to wait for.
+        events = self._selector.select(timeout)
+
+        for key, mask in events:
+            reader, writer = key.data
+            if mask & selectors.EVENT_READ and reader:
+                try:
+                    reader()
+                except Exception as exc:
+                    logger.exception(f"Reader {reader!r} failed: {exc}")
+            # The reader may have closed or unregistered the file.
+            if mask & selectors.EVENT_WRITE and writer:
+                try:
+                    _, writer = self._selector.get_key(key.fileobj).data
+                except (KeyError, ValueError):
+                    writer = None
+                if writer:
+                    try:
+                        writer()
+                    except Exception as exc:
+                        logger.exception(f"Writer {writer!r} failed: {exc}")
+
+        self._run_timers()
+
+    def run_forever(self):
+        logger.debug('()')
+        self._running = True
+        while self._running:
+            self.run_once()
+
+    def stop(self):
+        self._running = False
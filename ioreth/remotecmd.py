@@ -16,9 +16,13 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
+import collections
+import concurrent.futures
+import importlib
+import itertools
 import logging
-import multiprocessing as mp
 import queue
+import time
 
 
 logging.basicConfig()
@@ -38,62 +42,263 @@ class BaseRemoteCommand:
         pass
 
 
+class _Job:
+    __slots__ = ('req_id', 'cmd', 'future', 'callback', 'timeout', 'timer',
+                 'deadline')
+
+    def __init__(self, req_id, cmd, future, callback, timeout):
+        self.req_id = req_id
+        self.cmd = cmd
+        self.future = future
+        self.callback = callback
+        self.timeout = timeout
+        self.timer = None
+        self.deadline = None
+
+
+class _Worker:
+    __slots__ = ('proc', 'conn', 'job')
+
+    def __init__(self, proc, conn):
+        self.proc = proc
+        self.conn = conn
+        self.job = None
+
+
 class RemoteCommandHandler:
-    """Run "commands" in an external process using the multiprocessing
-    module. When finished they are returned to the calling process in a
-    return queue.
+    """Run "commands" in a pool of external processes using the
+    multiprocessing module. Each command is returned, after running, to the
+    calling process through a concurrent.futures.Future.
+
+    The worker processes are started with the first command and kept: with
+    the "forkserver" context they are forked from a server that already
+    imported the 'preload' modules, so they are cheap to replace. Each
+    worker runs one command at a time; a command running for longer than
+    its timeout gets its worker killed and replaced. At most 'max_pending'
+    commands wait for a free worker.
 
-    Overhead here is enormous. The idea is only use this for things that
-    demand information from external sources or thar should be isolated
-    from the main process.
+    With a reactor, results and timeouts are handled by the event loop.
+    Otherwise poll_ret() must be called now and then.
     """
 
-    def __init__(self):
-        self._ctx = mp.get_context("spawn")
-        self._in_queue = self._ctx.Queue()
-        self._out_queue = self._ctx.Queue()
-        self._proc = None
-
-    def _start_proc(self):
-        if not self._proc:
-            self._proc = self._ctx.Process(
-                target=RemoteCommandHandler._remote_loop,
-                args=(self._in_queue, self._out_queue),
-            )
-            self._proc.start()
-
-    def _stop_proc(self):
-        if self._proc:
-            self.post_cmd("quit")
-            self._proc.join()
-            self._proc = None
-
-    def post_cmd(self, cmd):
-        """Post a new command to be ran in the helper process.
+    def __init__(self, workers=2, preload=(), timeout=60, max_pending=64,
+                 reactor=None, callback=None):
+        self._ctx = None
+        self.workers = workers
+        self.preload = tuple(preload)
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.reactor = reactor
+        # Called with the finished commands posted without a callback.
+        self.callback = callback
+        self._ids = itertools.count(1)
+        self._workers = []
+        self._pending = collections.deque()
+        self._finished = collections.deque()
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    def _context(self):
+        # multiprocessing is only imported once there are workers to run.
+        if self._ctx is None:
+            import multiprocessing as mp
+            methods = mp.get_all_start_methods()
+            self._ctx = mp.get_context("forkserver" if "forkserver" in methods
+                                       else "spawn")
+            if self._ctx.get_start_method() == "forkserver":
+                self._ctx.set_forkserver_preload(["ioreth.remotecmd", *self.preload])
+        return self._ctx
+
+    def start(self):
+        """Start the worker processes, if not running yet."""
+        while len(self._workers) < self.workers:
+            self._start_worker()
+
+    def _start_worker(self):
+        ctx = self._context()
+        parent_conn, child_conn = ctx.Pipe()
+        proc = ctx.Process(
+            target=RemoteCommandHandler._remote_loop,
+            args=(child_conn, self.preload),
+            daemon=True,
+        )
+        proc.start()
+        child_conn.close()
+        worker = _Worker(proc, parent_conn)
+        self._workers.append(worker)
+        if self.reactor:
+            self.reactor.add_reader(parent_conn,
+                                    lambda: self._on_readable(worker))
+        logger.debug(f"Started remote command worker {proc.pid}")
+        return worker
+
+    def _stop_worker(self, worker, kill=False):
+        self._workers.remove(worker)
+        if self.reactor:
+            self.reactor.remove(worker.conn)
+        if kill:
+            worker.proc.kill()
+        else:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        worker.proc.join(5)
+        if worker.proc.is_alive():
+            worker.proc.kill()
+            worker.proc.join()
+        worker.conn.close()
+
+    def stop(self):
+        """Stop all the workers. Queued commands are cancelled."""
+        while self._pending:
+            future = self._pending.popleft().future
+            if not future.cancel():
+                future.set_exception(concurrent.futures.CancelledError())
+        for worker in list(self._workers):
+            kill = worker.job is not None
+            if worker.job:
+                self._fail(worker, concurrent.futures.CancelledError())
+            self._stop_worker(worker, kill)
+
+    def post_cmd(self, cmd, callback=None, timeout=None):
+        """Post a new command to be ran in a worker process. Returns a
+        Future with the command, as modified by run(), as its result.
+        'callback' (or the handler's default callback), if any, is called
+        with the finished command; otherwise it is returned by poll_ret().
+        Raises queue.Full if too many commands are waiting.
         """
-        if not self._proc:
-            self._start_proc()
-        self._in_queue.put(cmd)
+        if len(self._pending) >= self.max_pending:
+            raise queue.Full("Too many remote commands waiting")
+        self.start()
+        future = concurrent.futures.Future()
+        job = _Job(next(self._ids), cmd, future, callback or self.callback,
+                   timeout or self.timeout)
+        self._pending.append(job)
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+        for worker in self._workers:
+            if not self._pending:
+                break
+            if worker.job is not None:
+                continue
+            job = self._next_job()
+            if job is None:
+                break
+            try:
+                worker.conn.send((job.req_id, job.cmd))
+            except OSError as exc:
+                # Dead worker: put the job back and replace the worker.
+                self._pending.appendleft(job)
+                self._replace_worker(worker, exc)
+                return self._dispatch()
+            worker.job = job
+            job.deadline = time.monotonic() + job.timeout
+            if self.reactor:
+                job.timer = self.reactor.call_later(job.timeout,
+                                                    self._on_timeout, worker, job)
+
+    def _next_job(self):
+        """The first pending job not cancelled meanwhile, now running."""
+        while self._pending:
+            job = self._pending.popleft()
+            # Until now the caller could still cancel it. A job put back
+            # after its worker died is already running.
+            if (job.future.running()
+                    or job.future.set_running_or_notify_cancel()):
+                return job
+        return None
+
+    def _replace_worker(self, worker, reason):
+        logger.warning(f"Replacing remote command worker {worker.proc.pid}: {reason}")
+        self._stop_worker(worker, kill=True)
+        self._start_worker()
+
+    def _fail(self, worker, exc):
+        job, worker.job = worker.job, None
+        if job.timer:
+            job.timer.cancel()
+        self.failed += 1
+        job.future.set_exception(exc)
+
+    def _on_timeout(self, worker, job):
+        if worker.job is not job:
+            return
+        logger.warning(f"Remote command {job.req_id} ({type(job.cmd).__name__}) "
+                       f"timed out after {job.timeout}s")
+        self.timed_out += 1
+        self._fail(worker, TimeoutError(f"Remote command timed out after {job.timeout}s"))
+        self._replace_worker(worker, "command timed out")
+        self._dispatch()
+
+    def _on_readable(self, worker):
+        try:
+            req_id, cmd, error = worker.conn.recv()
+        except (EOFError, OSError) as exc:
+            if worker.job:
+                self._fail(worker, RuntimeError(f"Remote command worker died: {exc!r}"))
+            self._replace_worker(worker, "worker died")
+            self._dispatch()
+            return
+
+        job, worker.job = worker.job, None
+        if job is None or job.req_id != req_id:
+            logger.error(f"Unexpected result for remote command {req_id}")
+        else:
+            if job.timer:
+                job.timer.cancel()
+            if error is not None:
+                self.failed += 1
+                job.future.set_exception(RuntimeError(error))
+            else:
+                self.completed += 1
+                job.future.set_result(cmd)
+                if job.callback:
+                    try:
+                        job.callback(cmd)
+                    except Exception as exc:
+                        logger.exception(f"Remote command callback failed: {exc}")
+                else:
+                    self._finished.append(cmd)
+        self._dispatch()
 
     def poll_ret(self):
-        """Check if there finished command in the remote process.
+        """Check if there finished command in the remote processes. Also
+        takes care of timeouts when there is no reactor.
         Return: ran command or None
         """
-        ret = None
-        try:
-            ret = self._out_queue.get(False)
-        except queue.Empty:
-            pass
-        return ret
+        if not self.reactor:
+            now = time.monotonic()
+            for worker in list(self._workers):
+                if worker.job and worker.job.deadline <= now:
+                    self._on_timeout(worker, worker.job)
+            for worker in list(self._workers):
+                if worker in self._workers and worker.conn.poll():
+                    self._on_readable(worker)
+        if self._finished:
+            return self._finished.popleft()
+        return None
 
     @staticmethod
-    def _remote_loop(in_queue, out_queue):
+    def _remote_loop(conn, preload):
         """Executes commands in an external processes
         """
+        for name in preload:
+            importlib.import_module(name)
         while True:
-            cmd = in_queue.get(True)
-            if cmd == "quit":
+            try:
+                req = conn.recv()
+            except (EOFError, KeyboardInterrupt):
+                break
+            if req is None:
                 break
-            elif isinstance(cmd, BaseRemoteCommand):
-                cmd.run()
-                out_queue.put(cmd)
+            req_id, cmd = req
+            try:
+                if isinstance(cmd, BaseRemoteCommand):
+                    cmd.run()
+                conn.send((req_id, cmd, None))
+            except Exception as exc:
+                conn.send((req_id, None, repr(exc)))
@@ -0,0 +1,338 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import bisect
+import itertools
+import logging
+import queue
+import textwrap
+import threading
+import time
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.router')
+
+# APRS message texts can not be longer than this.
+MAX_MSG_LEN = 67
+
+# Returned by CommandRouter.dispatch() when the reply will come later.
+DEFERRED = object()
+
+
+class Command:
+    """A command the bot answers to, with its call statistics."""
+
+    __slots__ = ('name', 'aliases', 'help', 'callback', 'module', 'info',
+                 'threaded', 'timeout', 'calls', 'errors', 'total_time',
+                 'histogram', 'timeouts', 'rejected', 'total_wait',
+                 'wait_histogram')
+
+    # Upper bounds, in seconds, of the latency histogram buckets. The last
+    # bucket counts everything slower.
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self, name, callback, help='', aliases=(), module=None,
+                 info=None, threaded=False, timeout=None):
+        self.name = name
+        self.aliases = tuple(aliases)
+        self.help = help
+        self.callback = callback
+        self.module = module
+        self.info = info or {}
+        self.threaded = threaded
+        self.timeout = timeout
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+        # Only for threaded commands.
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.wait_histogram = [0] * (len(self.BUCKETS) + 1)
+
+    def record(self, elapsed, failed=False):
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.total_time += elapsed
+        self.histogram[bisect.bisect_left(self.BUCKETS, elapsed)] += 1
+
+    def record_wait(self, waited):
+        """Time a threaded command spent queued for a worker."""
+        self.total_wait += waited
+        self.wait_histogram[bisect.bisect_left(self.BUCKETS, waited)] += 1
+
+    def stats(self):
+        buckets = [*self.BUCKETS, 'inf']
+        stats = {
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_time': self.total_time / self.calls if self.calls else 0,
+            'histogram': dict(zip(buckets, self.histogram)),
+        }
+        if self.threaded:
+            stats.update({
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'avg_wait': self.total_wait / self.calls if self.calls else 0,
+                'wait_histogram': dict(zip(buckets, self.wait_histogram)),
+            })
+        return stats
+
+    def __repr__(self):
+        return f"<Command {self.name} aliases={self.aliases} calls={self.calls}>"
+
+
+class _Job:
+    __slots__ = ('cmd', 'msg', 'done', 'queued', 'timer', 'timed_out',
+                 'thread')
+
+    def __init__(self, cmd, msg, done):
+        self.cmd = cmd
+        self.msg = msg
+        self.done = done
+        self.queued = time.perf_counter()
+        self.timer = None
+        self.timed_out = False
+        # The worker thread, once one took the job.
+        self.thread = None
+
+
+class CommandPool:
+    """A fixed number of worker threads running slow commands away from
+    the event loop.
+
+    Results are handed back to the loop with reactor.call_soon_threadsafe()
+    and delivered there as done(msg, reply). A command still running after
+    its timeout gets TIMEOUT_REPLY instead; the thread can not be stopped,
+    so it is replaced by a new one and quits once the command returns,
+    dropping its late result. A command timing out while still queued is
+    not run at all. At most 'max_pending' commands may be queued or
+    running; more are refused.
+
+    Changes to 'workers' take effect on the next submit(): extra threads
+    quit after the commands already queued.
+    """
+
+    TIMEOUT_REPLY = "Sorry, that is taking too long. Please try again later."
+    BUSY_REPLY = "Sorry, too busy right now. Please try again later."
+
+    def __init__(self, reactor, workers=4, timeout=30, max_pending=32):
+        self.reactor = reactor
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = 0
+        self._queue = queue.Queue()
+        # Threads taking jobs, including the ones told to quit.
+        self._threads = []
+        self._quitting = 0
+        self._names = itertools.count()
+
+    def _resize(self):
+        while len(self._threads) - self._quitting < self.workers:
+            thr = threading.Thread(target=self._worker, daemon=True,
+                                   name=f"command-{next(self._names)}")
+            self._threads.append(thr)
+            thr.start()
+        while len(self._threads) - self._quitting > self.workers:
+            # Taken by whichever thread gets there first.
+            self._quitting += 1
+            self._queue.put(None)
+
+    def submit(self, cmd, msg, done):
+        """Queue 'cmd' to run for 'msg'. Returns False if the pool is
+        full.
+        """
+        if self.pending >= self.max_pending:
+            cmd.rejected += 1
+            return False
+        self._resize()
+        job = _Job(cmd, msg, done)
+        job.timer = self.reactor.call_later(cmd.timeout or self.timeout,
+                                            self._on_timeout, job)
+        self.pending += 1
+        self._queue.put(job)
+        return True
+
+    def _worker(self):
+        thr = threading.current_thread()
+        # Until it is dropped after a command timed out.
+        while thr in self._threads:
+            job = self._queue.get()
+            if job is None:
+                self.reactor.call_soon_threadsafe(self._on_quit, thr)
+                return
+            job.thread = thr
+            if job.timed_out:
+                continue
+            started = time.perf_counter()
+            try:
+                reply, exc = job.cmd.callback(job.msg), None
+            except Exception as e:
+                reply, exc = None, e
+            finished = time.perf_counter()
+            self.reactor.call_soon_threadsafe(self._on_finished, job, reply,
+                                              exc, started, finished)
+
+    def _on_quit(self, thr):
+        self._threads.remove(thr)
+        self._quitting -= 1
+
+    def _on_finished(self, job, reply, exc, started, finished):
+        cmd = job.cmd
+        cmd.record_wait(started - job.queued)
+        cmd.record(finished - started, failed=exc is not None)
+        if job.timed_out:
+            logger.info(f"Dropping late reply of {cmd.name} after "
+                        f"{finished - job.queued:.1f}s")
+            return
+        self.pending -= 1
+        job.timer.cancel()
+        if exc is not None:
+            logger.error(f"Command {cmd.name} failed: {exc!r}")
+        job.done(job.msg, reply)
+
+    def _on_timeout(self, job):
+        job.timed_out = True
+        job.cmd.timeouts += 1
+        self.pending -= 1
+        logger.warning(f"Command {job.cmd.name} from {job.msg.source} timed out")
+        if job.thread in self._threads:
+            # Stuck in the command: it quits when (if) it returns.
+            self._threads.remove(job.thread)
+            self._resize()
+        job.done(job.msg, self.TIMEOUT_REPLY)
+
+
+class CommandRouter:
+    """Map command names and aliases to their handlers.
+
+    Built-in and plugin commands are registered the same way and found
+    with a single dict lookup. Handlers are called as callback(msg) with
+    the received message.Message; threaded ones run in the CommandPool,
+    if there is one. The help pages are rendered into APRS sized messages
+    once and kept until the commands change or invalidate_help() is
+    called.
+    """
+
+    def __init__(self, pool=None):
+        self._commands = {}
+        self._table = {}
+        self._help = None
+        self.pool = pool
+
+    @staticmethod
+    def _names(value):
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = value.split(',')
+        return [n.strip().lower() for n in value if n.strip()]
+
+    def register(self, name, callback, help='', aliases=(), module=None,
+                 info=None, threaded=False, timeout=None):
+        """Add a command. Names and aliases are case insensitive; a name
+        already in use is taken over by the new command. Threaded commands
+        must not touch the bot or the connections, only return a reply.
+        """
+        name = name.lower()
+        self.unregister(name)
+        cmd = Command(name, callback, help, self._names(aliases), module, info,
+                      threaded, timeout)
+        for key in (name, *cmd.aliases):
+            old = self._table.get(key)
+            if old is not None:
+                logger.warning(f"Command {key} of {old.name} replaced by {name}")
+            self._table[key] = cmd
+        self._commands[name] = cmd
+        self._help = None
+        return cmd
+
+    def register_info(self, info, module):
+        """Add a command from a plugin registration dict, handled by the
+        module's invoke(msg). Both 'alias' and 'aliases' are accepted;
+        'threaded' and 'timeout' are optional.
+        """
+        aliases = self._names(info.get('alias')) + self._names(info.get('aliases'))
+        return self.register(info['command'], module.invoke,
+                             info.get('help', ''), aliases, module, info,
+                             bool(info.get('threaded')), info.get('timeout'))
+
+    def unregister(self, name):
+        cmd = self._commands.pop(name.lower(), None)
+        if cmd is None:
+            return
+        for key in (cmd.name, *cmd.aliases):
+            if self._table.get(key) is cmd:
+                del self._table[key]
+        self._help = None
+
+    def unregister_module(self, module):
+        """Remove all commands handled by 'module'."""
+        for cmd in [c for c in self._commands.values() if c.module is module]:
+            self.unregister(cmd.name)
+
+    def lookup(self, name):
+        return self._table.get(name)
+
+    def __contains__(self, name):
+        return name in self._table
+
+    def __iter__(self):
+        return iter(self._commands.values())
+
+    def dispatch(self, msg, done=None):
+        """Run the command for 'msg'. Returns the handler's reply, or None
+        if there is no such command. Threaded commands return DEFERRED
+        and the reply is given later to done(msg, reply).
+        """
+        cmd = self._table.get(msg.command)
+        if cmd is None:
+            return None
+        if cmd.threaded and self.pool and done:
+            if not self.pool.submit(cmd, msg, done):
+                return self.pool.BUSY_REPLY
+            return DEFERRED
+        start = time.perf_counter()
+        try:
+            reply = cmd.callback(msg)
+        except Exception:
+            cmd.record(time.perf_counter() - start, failed=True)
+            raise
+        cmd.record(time.perf_counter() - start)
+        return reply
+
+    def invalidate_help(self):
+        self._help = None
+
+    def help_pages(self):
+        """The help texts of all commands, in registration order, as a
+        list of messages no longer than MAX_MSG_LEN.
+        """
+        if self._help is None:
+            pages = []
+            for cmd in self._commands.values():
+                if cmd.help:
+                    pages.extend(textwrap.wrap(cmd.help, MAX_MSG_LEN))
+            self._help = pages
+        return list(self._help)
+
+    def stats(self):
+        return {cmd.name: cmd.stats() for cmd in self._commands.values()}
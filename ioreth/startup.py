@@ -0,0 +1,113 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import contextlib
+import sys
+import time
+
+"""
+Where the daemon startup time goes, for iorethd --startup-profile.
+"""
+
+
+class _TimedLoader:
+    """Wraps a module loader to time exec_module()."""
+
+    def __init__(self, loader, profiler, name):
+        self._loader = loader
+        self._profiler = profiler
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def exec_module(self, module):
+        self._profiler._enter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._leave(self._name)
+
+
+class StartupProfiler:
+    """Time the startup phases and every module imported meanwhile, like
+    "python -X importtime" but summarized. Modules imported before
+    install() are not seen.
+    """
+
+    def __init__(self):
+        # (module, own time, cumulative time, nesting depth)
+        self.imports = []
+        self.phases = []
+        self._stack = []
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                spec.loader = _TimedLoader(spec.loader, self, name)
+            return spec
+        return None
+
+    def _enter(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def _leave(self, name):
+        start, children = self._stack.pop()
+        total = time.perf_counter() - start
+        if self._stack:
+            self._stack[-1][1] += total
+        self.imports.append((name, total - children, total, len(self._stack)))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self, out=sys.stderr, top=20):
+        print("Startup phases (ms):", file=out)
+        for name, elapsed in self.phases:
+            print(f"  {elapsed * 1000:9.1f}  {name}", file=out)
+
+        print("Imports by cumulative time (ms), as done by the phases:", file=out)
+        direct = sorted((i for i in self.imports if i[3] == 0),
+                        key=lambda i: i[2], reverse=True)
+        for name, _, total, _ in direct[:top]:
+            print(f"  {total * 1000:9.1f}  {name}", file=out)
+
+        print("Slowest modules by own time (ms):", file=out)
+        for name, own, _, _ in sorted(self.imports, key=lambda i: i[1],
+                                      reverse=True)[:top]:
+            print(f"  {own * 1000:9.1f}  {name}", file=out)
+        total = sum(i[2] for i in direct)
+        print(f"{len(self.imports)} modules imported in {total * 1000:.1f} ms",
+              file=out)
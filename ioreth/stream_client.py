@@ -0,0 +1,229 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import errno
+import os
+import socket
+import threading
+import logging
+
+from .aprs_client import AprsClient
+from .outqueue import OutputQueue
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.stream_client')
+
+
+class StreamClient(AprsClient):
+    """Base for connections over a non-blocking TCP stream driven by the
+    reactor: connects in the background, reads into a reusable buffer and
+    writes through an OutputQueue kept across reconnections.
+
+    Subclasses implement on_data() and may override on_stream_connected()
+    to run a handshake before calling on_connect().
+    """
+
+    # Name used in log messages.
+    PROTOCOL = "TCP"
+    RECV_SIZE = 65536
+
+    def __init__(self, addr, port):
+        AprsClient.__init__(self)
+        self.addr = addr
+        self.port = int(port)
+        self._sock = None
+        self._connecting = False
+        self._connect_timer = None
+        self._connect_seq = 0
+        self._outq = OutputQueue()
+        self._rbuf = bytearray(self.RECV_SIZE)
+        self._rview = memoryview(self._rbuf)
+
+    def setCallsign(self, callsign: str):
+        self.callsign = callsign
+
+    def connect(self, timeout=10):
+        """Start connecting. The connection is completed in the background
+        and on_connect() or on_connect_failed() is called later.
+        """
+        if not self.reactor:
+            raise RuntimeError("setReactor() must be called before connect()")
+        if self._connecting:
+            self._abort_connect("restarted", notify=False)
+        elif self._sock:
+            self.disconnect()
+        self.reset_stream()
+        # Data not written yet is kept and sent once connected again, but
+        # a frame cut in the middle would be garbage to the other side.
+        self._outq.drop_partial()
+
+        self._connect_seq += 1
+        try:
+            addrs = socket.getaddrinfo(self.addr, self.port, type=socket.SOCK_STREAM,
+                                       flags=socket.AI_NUMERICHOST)
+        except socket.gaierror:
+            addrs = None
+
+        self._connecting = True
+        self._connect_timer = self.reactor.call_later(timeout,
+                                                      self._on_connect_timeout)
+        if addrs:
+            self._start_connect(addrs[0])
+        else:
+            # Name lookups block, so they are done away from the loop.
+            threading.Thread(target=self._resolve,
+                             args=(self._connect_seq, self.addr, self.port),
+                             daemon=True).start()
+
+    def _resolve(self, seq, addr, port):
+        """Runs in a thread of its own."""
+        try:
+            addrs = socket.getaddrinfo(addr, port, type=socket.SOCK_STREAM)
+            self.reactor.call_soon_threadsafe(self._on_resolved, seq, addrs, None)
+        except OSError as exc:
+            self.reactor.call_soon_threadsafe(self._on_resolved, seq, None, exc)
+
+    def _on_resolved(self, seq, addrs, exc):
+        if seq != self._connect_seq or not self._connecting:
+            # Cancelled or timed out meanwhile.
+            return
+        if exc:
+            self._abort_connect(f"can not resolve {self.addr}: {exc}")
+            return
+        self._start_connect(addrs[0])
+
+    def _start_connect(self, addrinfo):
+        family, type_, proto, _, sockaddr = addrinfo
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        err = sock.connect_ex(sockaddr)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            self._abort_connect(os.strerror(err))
+            return
+        self._sock = sock
+        self.reactor.add_writer(sock, self._on_connect_done)
+
+    def _on_connect_done(self):
+        err = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self._abort_connect(os.strerror(err))
+            return
+        self._connect_timer.cancel()
+        self._connect_timer = None
+        self._connecting = False
+        self.reactor.remove_writer(self._sock)
+        self.reactor.add_reader(self._sock, self.on_readable)
+        if self._outq:
+            self.reactor.add_writer(self._sock, self.on_writable)
+        self.on_stream_connected()
+
+    def _on_connect_timeout(self):
+        self._connect_timer = None
+        self._abort_connect("timed out")
+
+    def _abort_connect(self, reason, notify=True):
+        logger.warning(f"{self.PROTOCOL} connection to {self.addr}:{self.port} failed: {reason}")
+        if self._connect_timer:
+            self._connect_timer.cancel()
+            self._connect_timer = None
+        if self._sock:
+            self.reactor.remove(self._sock)
+            self._sock.close()
+            self._sock = None
+        self._connecting = False
+        if notify:
+            self.on_connect_failed()
+
+    def disconnect(self):
+        if self._connecting:
+            self._abort_connect("cancelled")
+            return
+        if self._sock:
+            self.reactor.remove(self._sock)
+            self._sock.close()
+            self._sock = None
+            self.reset_stream()
+            self.on_disconnect()
+
+    def is_connected(self):
+        return bool(self._sock) and not self._connecting
+
+    def queue_depth(self):
+        """Number of frames waiting to be written to the socket."""
+        return len(self._outq)
+
+    def bytes_in_flight(self):
+        """Number of bytes waiting to be written to the socket."""
+        return self._outq.bytes_in_flight()
+
+    def reset_stream(self):
+        """Forget any partially received data. Called when (re)connecting
+        and after disconnection.
+        """
+        pass
+
+    def on_stream_connected(self):
+        """The TCP connection is up. Handshakes go here."""
+        self.on_connect()
+
+    def on_data(self, data):
+        """Handle received bytes. 'data' is only valid during the call."""
+        raise NotImplementedError
+
+    def send_bytes(self, data, first=False):
+        """Queue raw bytes for the socket, before anything else already
+        queued if 'first' is set.
+        """
+        if first:
+            self._outq.prepend(data)
+        else:
+            self._outq.append(data)
+        if self._sock and not self._connecting:
+            self.reactor.add_writer(self._sock, self.on_writable)
+
+    def on_readable(self):
+        """Called by the reactor when there is data to be read."""
+        logger.debug('()')
+        try:
+            nrecv = self._sock.recv_into(self._rbuf)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            logger.warning(f"{self.PROTOCOL} recv failed: {exc}")
+            self.disconnect()
+            return
+
+        if nrecv == 0:
+            self.disconnect()
+            return
+        self.on_data(self._rview[:nrecv])
+
+    def on_writable(self):
+        """Called by the reactor when the socket can accept more data."""
+        logger.debug('()')
+        try:
+            self._outq.send(self._sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            logger.warning(f"{self.PROTOCOL} send failed: {exc}")
+            self.disconnect()
+            return
+        if not self._outq:
+            self.reactor.remove_writer(self._sock)
@@ -16,135 +16,51 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
-import os
-import socket
-import select
-import time
 import logging
 
-from .aprs_client import AprsClient
+from .stream_client import StreamClient
 from .ax25 import Frame
+from . import kiss
 
 logging.basicConfig()
 logger = logging.getLogger('iorethd.tcp_kiss_client')
 
-class TcpKissClient(AprsClient):
-    FEND = b"\xc0"
-    FESC = b"\xdb"
-    TFEND = b"\xdc"
-    TFESC = b"\xdd"
-    DATA = b"\x00"
-    FESC_TFESC = FESC + TFESC
-    FESC_TFEND = FESC + TFEND
+class TcpKissClient(StreamClient):
+    FEND = kiss.FEND
+    FESC = kiss.FESC
+    TFEND = kiss.TFEND
+    TFESC = kiss.TFESC
+    DATA = kiss.DATA
+    FESC_TFESC = kiss.FESC_TFESC
+    FESC_TFEND = kiss.FESC_TFEND
+
+    PROTOCOL = "KISS"
 
     def __init__(self, addr="localhost", port=8001):
         logger.debug(f'({addr=}, {port=})')
 
-        AprsClient.__init__(self)
-        self.addr = addr
-        self.port = int(port)
-        self._sock = None
-        self._inbuf = bytearray()
-        self._outbuf = bytearray()
+        StreamClient.__init__(self, addr, port)
+        self._decoder = kiss.KissDecoder()
         self._run = False
 
-    def connect(self, timeout=10):
-        if self._sock:
-            self.disconnect()
-        self._inbuf.clear()
-        self._outbuf.clear()
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._sock.settimeout(timeout)
-        self._sock.connect((self.addr, self.port))
-        self._sock.settimeout(None)
-        self.on_connect()
-
-    def disconnect(self):
-        if self._sock:
-            self._sock.close()
-            self._sock = None
-            self._inbuf.clear()
-            self._outbuf.clear()
-            self.on_disconnect()
-
-    def is_connected(self):
-        return bool(self._sock)
-
-    def setCallsign(self, callsign: str):
-        self.callsign = callsign
+    def reset_stream(self):
+        self._decoder.reset()
 
     def on_recv(self, frame_bytes):
-        logger.debug(f'({frame_bytes})')
+        logger.debug('(%s)', frame_bytes)
 
-        frame = Frame.from_kiss_bytes(frame_bytes)
+        try:
+            frame = Frame.from_kiss_bytes(frame_bytes)
+        except ValueError as exc:
+            logger.warning(f"Discarding bad KISS frame: {exc}")
+            return
         self.on_recv_frame(frame)
 
-    def on_loop_hook(self):
-        logger.debug('()')
-        poller = select.poll()
-        self._run = True
-
-        will_disconnect = False
-        fd = -1
-        if self.is_connected():
-            fd = self._sock.fileno()
-            flags = select.POLLIN | select.POLLHUP | select.POLLERR
-            if len(self._outbuf) > 0:
-                flags |= select.POLLOUT
-            poller.register(fd, flags)
-
-        # Look for incoming packets
-        logger.debug('Start polling')
-        events = poller.poll(1000)
-        logger.debug('Finish polling')
-
-        # Process each event
-        for _, evt in events:
-            # error in socket connection
-            if evt & (select.POLLHUP | select.POLLERR):
-                logger.debug('Received disconnect event')
-                will_disconnect = True
-            # TODO handle POLLRDHUP
-
-            # incoming packet
-            if evt & select.POLLIN:
-                logger.debug('Received incoming packets')
-                rdata = self._sock.recv(2048)
-                if len(rdata) == 0:
-                    will_disconnect = True
-                else:
-                    self._inbuf += rdata
-
-            # socket can accept writes
-            if evt & select.POLLOUT:
-                logger.debug('Received output event')
-                nsent = self._sock.send(self._outbuf)
-                self._outbuf = self._outbuf[nsent:]
-
-        if fd >= 0:
-            logger.debug('Unregister poller')
-            poller.unregister(fd)
-
+    def on_data(self, data):
         # process any packets received
-        while len(self._inbuf) > 3:
-            logger.debug('Processing received packets')
-            # FEND, FDATA, escaped_data, FEND, ...
-            if self._inbuf[0] != ord(TcpKissClient.FEND):
-                logger.error('Bad frame start')
-                raise ValueError("Bad frame start")
-            lst = self._inbuf[2:].split(TcpKissClient.FEND, 1)
-            if len(lst) > 1:
-                self._inbuf = lst[1]
-                frame = (
-                    lst[0]
-                    .replace(TcpKissClient.FESC_TFEND, TcpKissClient.FEND)
-                    .replace(TcpKissClient.FESC_TFESC, TcpKissClient.FESC)
-                )
-                logger.debug('Sending frame to APRS client')
-                self.on_recv(frame)
-
-        if will_disconnect:
-            self.disconnect()
+        for frame in self._decoder.feed(data):
+            logger.debug('Sending frame to APRS client')
+            self.on_recv(frame)
 
     def exit_loop(self):
         self._run = False
@@ -159,18 +75,12 @@ class TcpKissClient(AprsClient):
 
         if not self.is_connected():
             return
-        frame_bytes = frame.to_kiss_bytes()
-        esc_frame = frame_bytes.replace(
-            TcpKissClient.FESC, TcpKissClient.FESC_TFESC
-        ).replace(TcpKissClient.FEND, TcpKissClient.FESC_TFEND)
-        self._outbuf += (
-            TcpKissClient.FEND + TcpKissClient.DATA + esc_frame + TcpKissClient.FEND
-        )
+        self.send_bytes(kiss.escape(frame.to_kiss_bytes()))
 
     def on_connect(self):
         logger.info("KISS connection connected")
+        StreamClient.on_connect(self)
 
     def on_disconnect(self):
         logger.warning("KISS connection disconnected! Will try again soon...")
-        recon = 'sudo systemctl restart ioreth'
-        os.system(recon)
+        StreamClient.on_disconnect(self)
@@ -0,0 +1,155 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import logging
+import time
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.txsched')
+
+# Priority classes, most urgent first.
+PRIO_ACK = 0
+PRIO_REPLY = 1
+PRIO_FANOUT = 2
+PRIO_BULLETIN = 3
+PRIO_NAMES = ('ack', 'reply', 'fanout', 'bulletin')
+
+
+class TransmitScheduler:
+    """Pace the frames sent by a connection.
+
+    Frames wait in one FIFO per priority class and are released, most
+    urgent class first, at the rate allowed by a token bucket: 'rate'
+    frames per second on average with bursts of up to 'burst' frames. A
+    rate of 0 disables pacing. When 'max_queue' frames are waiting, the
+    oldest frame of the least urgent class is dropped to make room (or the
+    new one, if it is the least urgent). Nothing is released while
+    'ready()' is false, e.g. during a reconnection; call pump() after it
+    changes.
+    """
+
+    def __init__(self, send, ready=None, rate=0, burst=1, max_queue=100):
+        self._send = send
+        self._ready = ready or (lambda: True)
+        self.reactor = None
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self._queues = [collections.deque() for _ in PRIO_NAMES]
+        self._queued = 0
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._timer = None
+        self.dropped = [0] * len(PRIO_NAMES)
+        self._latency_count = [0] * len(PRIO_NAMES)
+        self._latency_total = [0.0] * len(PRIO_NAMES)
+        self._latency_max = [0.0] * len(PRIO_NAMES)
+
+    def configure(self, rate, burst, max_queue):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self._tokens = burst
+
+    def __len__(self):
+        return self._queued
+
+    def enqueue(self, frame, priority=PRIO_REPLY):
+        """Queue 'frame' for transmission. Returns False if it was dropped.
+        """
+        if self._queued >= self.max_queue:
+            victim = max(p for p, q in enumerate(self._queues) if q)
+            if victim < priority:
+                self.dropped[priority] += 1
+                logger.warning(f"Transmit queue full, dropping {PRIO_NAMES[priority]} frame")
+                return False
+            self._queues[victim].popleft()
+            self._queued -= 1
+            self.dropped[victim] += 1
+            logger.warning(f"Transmit queue full, dropping {PRIO_NAMES[victim]} frame")
+
+        self._queues[priority].append((time.monotonic(), frame))
+        self._queued += 1
+        self.pump()
+        return True
+
+    def clear(self):
+        for q in self._queues:
+            q.clear()
+        self._queued = 0
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def pump(self):
+        """Send as many queued frames as the bucket allows and schedule
+        the next attempt if frames are left waiting.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        paced = self.rate > 0 and self.reactor is not None
+
+        if not self._ready():
+            return
+
+        while self._queued:
+            if paced and self._tokens < 1:
+                break
+            for prio, q in enumerate(self._queues):
+                if q:
+                    queued_at, frame = q.popleft()
+                    break
+            self._queued -= 1
+            self._tokens -= 1
+
+            waited = now - queued_at
+            self._latency_count[prio] += 1
+            self._latency_total[prio] += waited
+            self._latency_max[prio] = max(self._latency_max[prio], waited)
+            self._send(frame)
+
+        if not paced:
+            self._tokens = self.burst
+        elif self._queued and self._timer is None:
+            delay = (1 - self._tokens) / self.rate
+            self._timer = self.reactor.call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self.pump()
+
+    def stats(self):
+        """Queue depth, drops and queue latency (seconds) per class."""
+        ret = {}
+        for prio, name in enumerate(PRIO_NAMES):
+            count = self._latency_count[prio]
+            ret[name] = {
+                'queued': len(self._queues[prio]),
+                'sent': count,
+                'dropped': self.dropped[prio],
+                'latency_avg': self._latency_total[prio] / count if count else 0.0,
+                'latency_max': self._latency_max[prio],
+            }
+        return ret
@@ -0,0 +1,185 @@
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import fnmatch
+import glob
+import logging
+import os
+import struct
+
+logging.basicConfig()
+logger = logging.getLogger('iorethd.watcher')
+
+"""
+Noticing changes to files, with inotify where available.
+"""
+
+
+class _Inotify:
+    """Just enough of inotify(7) through ctypes."""
+
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        # Only imported when watching starts.
+        import ctypes
+        import ctypes.util
+        self._ctypes = ctypes
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = self._ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read_names(self):
+        """Names of the files with events since the last call."""
+        names = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return names
+            pos = 0
+            while pos + self._EVENT.size <= len(data):
+                _, _, _, length = self._EVENT.unpack_from(data, pos)
+                pos += self._EVENT.size
+                names.add(os.fsdecode(data[pos:pos + length].rstrip(b'\0')))
+                pos += length
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """Call callback(names) with the names of the files in 'directory'
+    matching the glob 'pattern' that were changed, created or removed.
+
+    The directory is watched with inotify, so editors that replace files
+    are noticed too, and the files are only compared 'settle' seconds
+    after the last event so files being written are seen complete. Where
+    inotify is not available the files are compared every 'interval'
+    seconds instead.
+    """
+
+    _MASK = (_Inotify.IN_MODIFY | _Inotify.IN_CLOSE_WRITE | _Inotify.IN_CREATE
+             | _Inotify.IN_DELETE | _Inotify.IN_MOVED_FROM | _Inotify.IN_MOVED_TO)
+
+    def __init__(self, directory, reactor, callback, pattern='*', interval=5,
+                 settle=0.5):
+        self.directory = os.path.abspath(directory)
+        self.reactor = reactor
+        self.callback = callback
+        self.pattern = pattern
+        self.interval = interval
+        self.settle = settle
+        self.uses_inotify = False
+        self._inotify = None
+        self._timer = None
+        self._signatures = self._scan()
+
+    def _scan(self):
+        signatures = {}
+        for path in glob.glob(os.path.join(glob.escape(self.directory), self.pattern)):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            signatures[os.path.basename(path)] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return signatures
+
+    def start(self):
+        try:
+            self._inotify = _Inotify()
+            self._inotify.add_watch(self.directory, self._MASK)
+        except (OSError, AttributeError) as exc:
+            logger.info(f"inotify not available ({exc}), checking "
+                        f"{self.directory} every {self.interval}s")
+            if self._inotify:
+                self._inotify.close()
+                self._inotify = None
+            self._timer = self.reactor.call_later(self.interval, self._poll)
+            return
+        self.uses_inotify = True
+        self.reactor.add_reader(self._inotify, self._on_events)
+
+    def stop(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._inotify:
+            self.reactor.remove(self._inotify)
+            self._inotify.close()
+            self._inotify = None
+
+    def _on_events(self):
+        if not fnmatch.filter(self._inotify.read_names(), self.pattern):
+            return
+        # Wait until the writes stop.
+        if self._timer:
+            self._timer.cancel()
+        self._timer = self.reactor.call_later(self.settle, self._check)
+
+    def _poll(self):
+        self._timer = self.reactor.call_later(self.interval, self._poll)
+        self._check()
+
+    def _check(self):
+        if self.uses_inotify:
+            self._timer = None
+        old, new = self._signatures, self._scan()
+        changed = {n for n in old.keys() | new.keys() if old.get(n) != new.get(n)}
+        self._signatures = new
+        if not changed:
+            return
+        try:
+            self.callback(changed)
+        except Exception as exc:
+            logger.exception(f"Handling changes in {self.directory} failed: {exc}")
+
+
+class ConfigWatcher(DirectoryWatcher):
+    """Call callback() when the configuration file at 'path' changes."""
+
+    def __init__(self, path, reactor, callback, interval=5, settle=0.5):
+        path = os.path.abspath(path)
+        DirectoryWatcher.__init__(self, os.path.dirname(path), reactor,
+                                  lambda names: callback(),
+                                  glob.escape(os.path.basename(path)),
+                                  interval, settle)
+        self.path = path
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Exercise the AprsIsClient server selection against local fake servers
+with injected login delays.
+
+    python3 scenarios/aprs_is_failover.py [-v]
+
+Three servers are configured: one refusing connections, a slow one and
+a fast one. The client must skip the dead server, fail over when a
+session drops right after the login, measure both live servers and go
+back to the fastest after a stable session drops, all without stalling
+the event loop. Exits with status 1 if not.
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ioreth.aprs_is_client import AprsIsClient
+from ioreth.reactor import Reactor
+
+
+class FakeServer:
+    """An APRS-IS server, in a thread, answering logins after 'delay'
+    seconds and keeping the session until drop() is called.
+    """
+
+    def __init__(self, name, delay, logins):
+        self.name = name
+        self.delay = delay
+        self.logins = logins
+        self._drop = threading.Event()
+        self._srv = socket.create_server(('127.0.0.1', 0))
+        self.port = self._srv.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._srv.accept()
+            except OSError:
+                return
+            with conn:
+                self._session(conn)
+
+    def _session(self, conn):
+        conn.sendall(b"# aprsc 2.1.14 fake\r\n")
+        login = b""
+        while b"\n" not in login:
+            data = conn.recv(512)
+            if not data:
+                return
+            login += data
+        time.sleep(self.delay)
+        call = login.split()[1]
+        conn.sendall(b"# logresp " + call + b" verified, server " +
+                     self.name.encode() + b"\r\n")
+        self.logins.append(self.name)
+        self._drop.clear()
+        while not self._drop.wait(0.2):
+            conn.sendall(b"# keepalive\r\n")
+
+    def drop(self):
+        self._drop.set()
+
+    def close(self):
+        self._srv.close()
+        self._drop.set()
+
+
+def run_for(reactor, seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        reactor.run_once(0.02)
+
+
+def run_until(reactor, cond, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise TimeoutError("scenario stalled")
+        reactor.run_once(0.02)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.getLogger('iorethd').setLevel(logging.INFO if args.verbose
+                                          else logging.CRITICAL)
+
+    logins = []
+    slow = FakeServer('SLOW', 0.3, logins)
+    fast = FakeServer('FAST', 0.05, logins)
+    dead = socket.socket()
+    dead.bind(('127.0.0.1', 0))
+    dead_port = dead.getsockname()[1]
+
+    reactor = Reactor()
+    client = AprsIsClient()
+    client.conn_name = 'aprsis'
+    client.setCallsign('N0CALL')
+    client.setDestination('APZIOR')
+    client.setPath('TCPIP*')
+    client.setServers(f"127.0.0.1:{dead_port}, 127.0.0.1:{slow.port}, "
+                      f"127.0.0.1:{fast.port}")
+    client.setReconnect(0.1, 1)
+    client.setReactor(reactor)
+    client.STABLE_SESSION = 1
+
+    # The largest pause of the event loop, seen by a timer every 20ms.
+    ticks = []
+
+    def tick():
+        ticks.append(time.monotonic())
+        reactor.call_later(0.02, tick)
+    tick()
+
+    client.start()
+    # Unmeasured servers go first, in order: dead, then slow.
+    run_until(reactor, lambda: len(logins) == 1 and client.is_connected())
+    # A session dropped right after the login is a failure: fail over.
+    slow.drop()
+    run_until(reactor, lambda: len(logins) == 2 and client.is_connected())
+    # A stable session drops: back to the fastest server.
+    run_for(reactor, client.STABLE_SESSION + 0.5)
+    fast.drop()
+    run_until(reactor, lambda: len(logins) == 3 and client.is_connected())
+    client.stop()
+    slow.close()
+    fast.close()
+    dead.close()
+
+    by_port = {s.port: s for s in client.servers}
+    gap = max(b - a for a, b in zip(ticks, ticks[1:]))
+    print(f"logins: {', '.join(logins)}")
+    for server in client.servers:
+        print(f"  {server}")
+    print(f"longest event loop pause: {gap * 1000:.0f}ms")
+
+    failures = []
+    if logins != ['SLOW', 'FAST', 'FAST']:
+        failures.append(f"unexpected server choices: {logins}")
+    if not by_port[dead_port].failures:
+        failures.append("the dead server was never tried")
+    slow_latency = by_port[slow.port].latency
+    fast_latency = by_port[fast.port].latency
+    if not (fast_latency and slow_latency and fast_latency < slow_latency):
+        failures.append(f"latencies not measured: {client.servers}")
+    if gap > 0.2:
+        failures.append(f"event loop stalled for {gap * 1000:.0f}ms")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    if failures:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Exercise the TcpKissClient reconnection against a stand-in TNC that
+drops connections, and check nothing queued meanwhile is lost.
+
+    python3 scenarios/kiss_reconnect.py [-v]
+
+The stand-in TNC refuses connections at first, then drops the first
+session and refuses connections again for a while. The client must back
+off exponentially meanwhile, and the frames queued while it is
+disconnected must all arrive, in order, once it is connected again.
+Exits with status 1 if not.
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ioreth import kiss
+from ioreth.ax25 import Frame
+from ioreth.reactor import Reactor
+from ioreth.tcp_kiss_client import TcpKissClient
+
+
+class StandInTnc:
+    """A KISS TCP server running in the same reactor as the client, so
+    the scenario is deterministic. While it is down, connections are
+    refused; drop() closes the current session and goes down.
+    """
+
+    def __init__(self, reactor):
+        self.reactor = reactor
+        self.frames = []
+        self.sessions = 0
+        self._conn = None
+        self._decoder = kiss.KissDecoder()
+        self._srv = self._bind(0)
+        self.port = self._srv.getsockname()[1]
+
+    @staticmethod
+    def _bind(port):
+        # Bound but not listening: connections are refused.
+        srv = socket.socket()
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind(('127.0.0.1', port))
+        return srv
+
+    def up(self):
+        self._srv.listen(1)
+        self._srv.setblocking(False)
+        self.reactor.add_reader(self._srv, self._on_accept)
+
+    def drop(self):
+        self.reactor.remove(self._srv)
+        self._srv.close()
+        self._srv = self._bind(self.port)
+        if self._conn:
+            self.reactor.remove(self._conn)
+            self._conn.close()
+            self._conn = None
+
+    def _on_accept(self):
+        conn, _ = self._srv.accept()
+        conn.setblocking(False)
+        self._conn = conn
+        self.sessions += 1
+        self._decoder.reset()
+        self.reactor.add_reader(conn, self._on_data)
+
+    def _on_data(self):
+        data = self._conn.recv(4096)
+        if not data:
+            self.reactor.remove(self._conn)
+            self._conn.close()
+            self._conn = None
+            return
+        for raw in self._decoder.feed(data):
+            self.frames.append((self.sessions,
+                                Frame.from_kiss_bytes(raw).info.decode()))
+
+    def close(self):
+        self.drop()
+        self._srv.close()
+
+
+def run_for(reactor, seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        reactor.run_once(0.02)
+
+
+def run_until(reactor, cond, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise TimeoutError("scenario stalled")
+        reactor.run_once(0.02)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.getLogger('iorethd').setLevel(logging.INFO if args.verbose
+                                          else logging.CRITICAL)
+
+    reactor = Reactor()
+    tnc = StandInTnc(reactor)
+    client = TcpKissClient('127.0.0.1', tnc.port)
+    client.conn_name = 'tnc'
+    client.setCallsign('N0CALL')
+    client.setDestination('APZIOR')
+    client.setPath('WIDE1-1')
+    client.setReactor(reactor)
+    client.setReconnect(0.05, 0.4)
+    texts = [f':W1AW     :frame {i}' for i in range(10)]
+    failures = []
+
+    # The TNC is down at first: frames wait while the client backs off.
+    for i in range(5):
+        client.send_aprs_msg('W1AW', f'frame {i}')
+    client.start()
+    run_for(reactor, 1)
+    attempts = client._reconnect_attempts
+    print(f"TNC down: {attempts} attempts in 1s, {len(client.tx)} frames queued")
+    if not 3 <= attempts <= 8:
+        failures.append(f"{attempts} connection attempts in 1s while down")
+    tnc.up()
+    run_until(reactor, lambda: len(tnc.frames) == 5)
+
+    # The session drops; more frames are queued until the TNC is back.
+    tnc.drop()
+    run_until(reactor, lambda: client.reconnect_state != 'connected')
+    for i in range(5, 10):
+        client.send_aprs_msg('W1AW', f'frame {i}')
+    run_for(reactor, 0.5)
+    queued = len(client.tx)
+    print(f"session dropped: {client._reconnect_attempts} attempts in 0.5s, "
+          f"{queued} frames queued")
+    tnc.up()
+    run_until(reactor, lambda: len(tnc.frames) == 10)
+    print(f"{tnc.sessions} sessions, {len(tnc.frames)} frames received")
+
+    if [t for _, t in tnc.frames] != texts:
+        failures.append(f"frames lost or out of order: {tnc.frames}")
+    if [n for n, _ in tnc.frames] != [1] * 5 + [2] * 5:
+        failures.append(f"frames sent in the wrong sessions: {tnc.frames}")
+    if queued != 5:
+        failures.append(f"{queued} frames queued while disconnected, expected 5")
+    if client.reconnect_state != 'connected' or client._reconnect_attempts:
+        failures.append(f"not connected at the end: {client.reconnect_state}")
+    client.stop()
+    tnc.close()
+
+    for failure in failures:
+        print("FAIL:", failure)
+    if failures:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+#
+# Ioreth - An APRS library and bot
+# Copyright (C) 2020  Alexandre Erwin Ittner, PP5ITT <alexandre@ittner.com.br>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Check that cancelling queued remote commands neither stalls the ones
+behind them nor leaves futures unresolved.
+
+    python3 scenarios/remote_cancel.py [-v]
+
+With a single worker busy, the command queued next is cancelled: the
+one after it must still run as soon as the worker is free. Then the
+handler is stopped with commands waiting, and all their futures must be
+done. Exits with status 1 if not.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ioreth.reactor import Reactor
+from ioreth.remotecmd import BaseRemoteCommand, RemoteCommandHandler
+
+
+class Sleep(BaseRemoteCommand):
+    def __init__(self, token, seconds):
+        super().__init__(token)
+        self.seconds = seconds
+
+    def run(self):
+        time.sleep(self.seconds)
+
+
+def state(future):
+    if future.cancelled():
+        return 'cancelled'
+    return 'done' if future.done() else 'pending'
+
+
+def run_until(reactor, cond, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            return False
+        reactor.run_once(0.02)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.getLogger('iorethd').setLevel(logging.DEBUG if args.verbose
+                                          else logging.CRITICAL)
+    failures = []
+
+    # A cancelled command in the middle of the queue.
+    reactor = Reactor()
+    handler = RemoteCommandHandler(workers=1, reactor=reactor,
+                                   callback=lambda cmd: None)
+    futures = [handler.post_cmd(Sleep(i, 0.3)) for i in range(3)]
+    futures[1].cancel()
+    if not run_until(reactor, lambda: futures[2].done()):
+        failures.append("the command behind a cancelled one never ran")
+    elif futures[2].result().token != 2:
+        failures.append(f"unexpected result: {futures[2].result()!r}")
+    print(f"cancelled in the middle: {[state(f) for f in futures]}")
+    handler.stop()
+
+    # Stopping with commands running and waiting.
+    handler = RemoteCommandHandler(workers=1, reactor=reactor,
+                                   callback=lambda cmd: None)
+    futures = [handler.post_cmd(Sleep(i, 5)) for i in range(3)]
+    handler.stop()
+    print(f"stopped: {[state(f) for f in futures]}")
+    if not all(f.done() for f in futures):
+        failures.append(f"futures left unresolved by stop(): {futures}")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    if failures:
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()